@@ -36,6 +36,9 @@
   languages.javascript.enable = true;
   languages.typescript.enable = true;
 
+  # count each viewer of a recipe once an hour (server/views.py)
+  env.VIEW_DEDUPE_WINDOW = "3600";
+
   processes = {
     server = {
       exec = "fastapi dev main.py";
@@ -0,0 +1,664 @@
+"""In-process micro-benchmarks for the route handlers and hot helpers.
+
+python -m server.bench.micro run [-k name] [--repeat 15] [--output results.json]
+python -m server.bench.micro compare [baseline.json] results.json
+
+`run` times every benchmark against a fixed dataset; `--output
+server/bench/baselines/micro.json` refreshes the stored baseline.
+`compare` runs Welch's t-test per benchmark and exits non-zero when one got
+significantly slower (p < --alpha and more than --threshold slower). Times
+are compared relative to a calibration loop run in the same round, so a
+busier or slower machine doesn't read as a regression; --raw compares
+wall-clock seconds.
+"""
+
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import math
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import bcrypt
+from httpx import ASGITransport, AsyncClient
+from fastapi import FastAPI
+from sqlmodel import SQLModel, Session, create_engine, select
+
+from .. import models
+from ..models import User
+from ..ingredients import _parse as _parse_ingredients
+from ..ratelimit import Decision
+from ..rendering import render_markdown
+from ..similarity import FEATURE_COLUMNS, build, featurize
+from ..routes import auth, batch, categories, comments, metrics, recipes, shopping
+from ..shopping import aggregate
+from ..routes.auth import decode_jwt, get_current_user, sign_jwt
+from ..utils import parse_fields, slugify
+from ..writer import close_writers
+
+
+BASELINE = Path(__file__).parent / "baselines" / "micro.json"
+
+Op = Callable[[], Any]
+BENCHMARKS: dict[str, Callable[["Context"], Op]] = {}
+
+
+def bench(name: str):
+    def register(setup: Callable[["Context"], Op]):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+class Unlimited:
+    async def hit(self, name: str, key: str) -> Decision:
+        return Decision(True, 0, 0, 0)
+
+
+class Context:
+    """A seeded database and a client for an app with every router mounted."""
+
+    RECIPES = 2000
+    COMMENTS = 5000
+    CATEGORIES = 20
+
+    def __init__(self, directory: Path):
+        self.engine = create_engine(
+            f"sqlite:///{directory / 'bench.db'}",
+            connect_args={"check_same_thread": False},
+        )
+        SQLModel.metadata.create_all(self.engine)
+        self.seed()
+        # the routes and POST /batch look the engine up on the models module
+        models.engine = self.engine
+
+        app = FastAPI()
+        app.include_router(categories.router, prefix="/categories")
+        app.include_router(recipes.router, prefix="/recipes")
+        app.include_router(comments.router, prefix="/comments")
+        app.include_router(auth.router, prefix="/auth")
+        app.include_router(batch.router, prefix="/batch")
+        app.include_router(metrics.router, prefix="/metrics")
+        app.include_router(shopping.router, prefix="/shopping-list")
+        app.state.limiter = Unlimited()
+        with Session(self.engine) as session:
+            user = session.get(User, 1)
+        app.dependency_overrides[get_current_user] = lambda: (user, "ADMIN")
+        self.client = AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://bench"
+        )
+        self.counter = itertools.count()
+
+    def seed(self):
+        password = bcrypt.hashpw(b"password", bcrypt.gensalt()).decode()
+        conn = self.engine.raw_connection()
+        try:
+            conn.execute(
+                'INSERT INTO "user" (username, email, password, role)'
+                " VALUES ('bench', 'bench@example.com', ?, 'ADMIN')",
+                (password,),
+            )
+            conn.executemany(
+                "INSERT INTO category (name, description, slug) VALUES (?, 'd', ?)",
+                [(f"Category {i}", f"category-{i}") for i in range(self.CATEGORIES)],
+            )
+            conn.executemany(
+                "INSERT INTO recipe (name, description, instructions, ingredients,"
+                " calories, prep_time, servings, category_id, slug, author_id, rating)"
+                " VALUES (?, 'd', ?, 'x', ?, ?, ?, ?, ?, 1, ?)",
+                [
+                    (
+                        f"Recipe {i}",
+                        f"# Recipe {i}\n\n1. Mix *well*\n2. Bake",
+                        50 + i % 900,
+                        5 + i % 120,
+                        1 + i % 8,
+                        1 + i % self.CATEGORIES,
+                        f"recipe-{i}",
+                        i % 50 / 10,
+                    )
+                    for i in range(1, self.RECIPES + 1)
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO comment (title, text, rating, recipe_id, user_id)"
+                " VALUES ('t', 'text', ?, ?, 1)",
+                [(i % 5, 1 + i % self.RECIPES) for i in range(self.COMMENTS)],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def unique(self, prefix: str) -> str:
+        return f"{prefix} {next(self.counter)}"
+
+    def get(self, url: str) -> Op:
+        return lambda: self.expect(self.client.get(url))
+
+    async def expect(self, request: Any) -> Any:
+        response = await request
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.request.url}: {response.status_code}")
+        return response
+
+
+def recipe_json(name: str) -> dict[str, Any]:
+    return {
+        "name": name,
+        "description": "bench",
+        "instructions": "Mix and *bake*",
+        "ingredients": "flour",
+        "calories": 300,
+        "prep_time": 20,
+        "servings": 2,
+        "category_id": 1,
+    }
+
+
+@bench("utils.slugify")
+def _(ctx: Context) -> Op:
+    return lambda: slugify("Grandma's Best Chocolate-Chip Cookies (Vegan!)")
+
+
+@bench("utils.parse_fields")
+def _(ctx: Context) -> Op:
+    return lambda: parse_fields("name,calories,slug", "full", models.RECIPE_VIEWS)
+
+
+@bench("auth.sign_jwt")
+def _(ctx: Context) -> Op:
+    return lambda: sign_jwt(1, "USER")
+
+
+@bench("auth.decode_jwt")
+def _(ctx: Context) -> Op:
+    token, _ = sign_jwt(1, "USER")
+    return lambda: decode_jwt(token)
+
+
+@bench("rendering.render_markdown")
+def _(ctx: Context) -> Op:
+    return lambda: render_markdown(f"# {ctx.unique('Title')}\n\n*a* **b** `c`")
+
+
+@bench("similarity.featurize_500")
+def _(ctx: Context) -> Op:
+    with Session(ctx.engine) as session:
+        rows = session.exec(select(*FEATURE_COLUMNS).limit(500)).all()
+    return lambda: featurize(rows)
+
+
+@bench("ingredients.parse_500")
+def _(ctx: Context) -> Op:
+    # uncached: the cost of parsing the whole catalogue, 500 recipes at a time
+    texts = [
+        json.dumps(
+            {
+                f"item {i}": "1 1/2 cups",
+                "eggs": i % 4 + 1,
+                "butter": f"{i % 3 + 1} tbsp",
+                "garlic": "2-3 cloves",
+                "salt": "to taste",
+                "rice": f"{i % 900 + 100} g",
+            }
+        )
+        for i in range(500)
+    ]
+    return lambda: [_parse_ingredients(t) for t in texts]
+
+
+@bench("shopping.aggregate_120")
+def _(ctx: Context) -> Op:
+    # a week's meal plan of popular recipes: every form is cached after round 1
+    recipes = [
+        (
+            i,
+            json.dumps(
+                {
+                    f"item {i % 40}": "1 1/2 cups",
+                    "eggs": i % 4 + 1,
+                    "butter": f"{i % 3 + 1} tbsp",
+                    "milk": f"{i % 5 * 100 + 100} ml",
+                    "garlic": "2-3 cloves",
+                    "salt": "to taste",
+                    "rice": f"{i % 900 + 100} g",
+                }
+            ),
+            1 + i % 3 / 2,
+        )
+        for i in range(120)
+    ]
+    return lambda: aggregate(recipes)
+
+
+@bench("shopping.create_shopping_list_120")
+def _(ctx: Context) -> Op:
+    body = {"recipes": [{"recipe_id": i, "servings": 4} for i in range(1, 121)]}
+    return lambda: ctx.expect(ctx.client.post("/shopping-list/", json=body))
+
+
+@bench("similarity.build")
+def _(ctx: Context) -> Op:
+    return lambda: build(ctx.engine)
+
+
+@bench("categories.read_categories")
+def _(ctx: Context) -> Op:
+    return ctx.get("/categories/")
+
+
+@bench("categories.read_category")
+def _(ctx: Context) -> Op:
+    return ctx.get("/categories/3")
+
+
+@bench("categories.read_category_by_slug")
+def _(ctx: Context) -> Op:
+    return ctx.get("/categories/by-slug/category-3")
+
+
+@bench("categories.read_recipes")
+def _(ctx: Context) -> Op:
+    return ctx.get("/categories/3/recipes?view=card")
+
+
+@bench("categories.create_category")
+def _(ctx: Context) -> Op:
+    return lambda: ctx.expect(
+        ctx.client.post(
+            "/categories/", json={"name": ctx.unique("Bench"), "description": None}
+        )
+    )
+
+
+@bench("categories.update_category")
+def _(ctx: Context) -> Op:
+    return lambda: ctx.expect(
+        ctx.client.patch("/categories/2", json={"description": ctx.unique("d")})
+    )
+
+
+@bench("recipes.read_recipes")
+def _(ctx: Context) -> Op:
+    return ctx.get("/recipes/")
+
+
+@bench("recipes.read_recipes_card")
+def _(ctx: Context) -> Op:
+    return ctx.get("/recipes/?view=card")
+
+
+@bench("recipes.read_recipes_filtered")
+def _(ctx: Context) -> Op:
+    return ctx.get("/recipes/?category_id=3&calories_max=500&sort=rating")
+
+
+@bench("recipes.read_recipe")
+def _(ctx: Context) -> Op:
+    return ctx.get("/recipes/10")
+
+
+@bench("recipes.read_recipe_html")
+def _(ctx: Context) -> Op:
+    return ctx.get("/recipes/10?html=true")
+
+
+@bench("recipes.read_recipe_by_slug")
+def _(ctx: Context) -> Op:
+    return ctx.get("/recipes/by-slug/recipe-10")
+
+
+@bench("recipes.read_comments")
+def _(ctx: Context) -> Op:
+    return ctx.get("/recipes/10/comments")
+
+
+@bench("recipes.count_recipes")
+def _(ctx: Context) -> Op:
+    return ctx.get("/recipes/count?category_id=3")
+
+
+@bench("recipes.read_similar_recipes")
+def _(ctx: Context) -> Op:
+    _ = build(ctx.engine)
+    return ctx.get("/recipes/10/similar")
+
+
+@bench("recipes.export_recipes")
+def _(ctx: Context) -> Op:
+    return ctx.get("/recipes/export?category_id=3")
+
+
+@bench("recipes.create_recipe")
+def _(ctx: Context) -> Op:
+    return lambda: ctx.expect(
+        ctx.client.post("/recipes/", json=recipe_json(ctx.unique("Bench")))
+    )
+
+
+@bench("recipes.update_recipe")
+def _(ctx: Context) -> Op:
+    return lambda: ctx.expect(
+        ctx.client.patch(
+            "/recipes/5", json={"description": ctx.unique("d"), "category_id": 1}
+        )
+    )
+
+
+@bench("recipes.create_and_delete_recipe")
+def _(ctx: Context) -> Op:
+    async def op():
+        created = await ctx.expect(
+            ctx.client.post("/recipes/", json=recipe_json(ctx.unique("Gone")))
+        )
+        _ = await ctx.expect(ctx.client.delete(f"/recipes/{created.json()['id']}"))
+
+    return op
+
+
+@bench("recipes.import_recipes_100")
+def _(ctx: Context) -> Op:
+    def body() -> bytes:
+        rows = (json.dumps(recipe_json(ctx.unique("Imported"))) for _ in range(100))
+        return "\n".join(rows).encode()
+
+    return lambda: ctx.expect(ctx.client.post("/recipes/import", content=body()))
+
+
+@bench("comments.read_comments")
+def _(ctx: Context) -> Op:
+    return ctx.get("/comments/")
+
+
+@bench("comments.read_comment")
+def _(ctx: Context) -> Op:
+    return ctx.get("/comments/10")
+
+
+@bench("comments.create_comment")
+def _(ctx: Context) -> Op:
+    body = {"title": "t", "text": "bench", "rating": 4, "recipe_id": 10}
+    return lambda: ctx.expect(ctx.client.post("/comments/", json=body))
+
+
+@bench("comments.update_comment")
+def _(ctx: Context) -> Op:
+    return lambda: ctx.expect(ctx.client.patch("/comments/10", json={"rating": 3}))
+
+
+@bench("comments.create_and_delete_comment")
+def _(ctx: Context) -> Op:
+    body = {"title": "t", "text": "bench", "rating": 4, "recipe_id": 11}
+
+    async def op():
+        created = await ctx.expect(ctx.client.post("/comments/", json=body))
+        _ = await ctx.expect(ctx.client.delete(f"/comments/{created.json()['id']}"))
+
+    return op
+
+
+@bench("auth.login_user")
+def _(ctx: Context) -> Op:
+    body = {"email": "bench@example.com", "password": "password"}
+    return lambda: ctx.expect(ctx.client.post("/auth/login", json=body))
+
+
+@bench("auth.create_user")
+def _(ctx: Context) -> Op:
+    def body() -> dict[str, str]:
+        name = ctx.unique("user").replace(" ", "")
+        return {"username": name, "email": f"{name}@example.com", "password": "pw"}
+
+    return lambda: ctx.expect(ctx.client.post("/auth/register", json=body()))
+
+
+@bench("batch.run_batch")
+def _(ctx: Context) -> Op:
+    body = {
+        "operations": [
+            {"method": "GET", "path": "/recipes/12"},
+            {
+                "method": "POST",
+                "path": "/comments/",
+                "body": {"title": "t", "text": "b", "rating": 5, "recipe_id": 12},
+            },
+            {"method": "GET", "path": "/recipes/12/comments?limit=5"},
+        ]
+    }
+    return lambda: ctx.expect(ctx.client.post("/batch/", json=body))
+
+
+@bench("metrics.read_metrics")
+def _(ctx: Context) -> Op:
+    return ctx.get("/metrics/")
+
+
+def calibration():
+    # fixed pure-Python work that tracks the machine's current speed
+    return json.dumps({str(i): [i, i * i, "x" * (i % 7)] for i in range(200)})
+
+
+def sampler(
+    loop: asyncio.AbstractEventLoop, op: Op, min_time: float
+) -> tuple[Callable[[], float], int]:
+    """A function taking one sample (seconds per op), and its iteration count."""
+    first = op()
+    if inspect.isawaitable(first):
+        _ = loop.run_until_complete(first)  # pyright: ignore
+
+        async def run(n: int):
+            for _ in range(n):
+                _ = await op()
+
+        def timed(n: int) -> float:
+            start = time.perf_counter()
+            loop.run_until_complete(run(n))
+            return time.perf_counter() - start
+
+    else:
+
+        def timed(n: int) -> float:
+            start = time.perf_counter()
+            for _ in range(n):
+                _ = op()
+            return time.perf_counter() - start
+
+    # size each sample to take at least min_time
+    iterations = max(1, math.ceil(min_time / max(timed(1), 1e-9)))
+    return lambda: timed(iterations) / iterations, iterations
+
+
+def run(pattern: str | None, repeat: int, min_time: float) -> dict[str, Any]:
+    loop = asyncio.new_event_loop()
+    samplers: dict[str, tuple[Callable[[], float], int]] = {}
+    samples: dict[str, list[float]] = {}
+    speed: list[float] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        ctx = Context(Path(tmp))
+        try:
+            for name, setup in BENCHMARKS.items():
+                if not pattern or pattern in name:
+                    samplers[name] = sampler(loop, setup(ctx), min_time)
+                    samples[name] = []
+            calibrate, _ = sampler(loop, calibration, min_time)
+            # round-robin, so drift in machine load or dataset size over the
+            # run spreads across every benchmark instead of skewing a few
+            for round in range(repeat):
+                print(f"round {round + 1}/{repeat}", file=sys.stderr)
+                speed.append(calibrate())
+                for name, (sample, _) in samplers.items():
+                    samples[name].append(sample())
+        finally:
+            loop.run_until_complete(ctx.client.aclose())
+            loop.close()
+            close_writers()
+            ctx.engine.dispose()
+
+    results: dict[str, Any] = {}
+    for name, values in samples.items():
+        results[name] = {
+            "unit": "s",
+            "iterations": samplers[name][1],
+            "mean": statistics.fmean(values),
+            "stdev": statistics.stdev(values) if len(values) > 1 else 0.0,
+            "samples": values,
+            # the same samples in units of the calibration loop timed in that
+            # round, which cancels out the machine getting faster or slower
+            "normalized": [v / c for v, c in zip(values, speed)],
+        }
+        print(
+            f"{name:<40} {results[name]['mean'] * 1e6:12.1f} us"
+            f"  ± {results[name]['stdev'] * 1e6:.1f}",
+            file=sys.stderr,
+        )
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "benchmarks": results,
+    }
+
+
+def _betacf(a: float, b: float, x: float) -> float:
+    # continued fraction for the incomplete beta function (modified Lentz)
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        for numerator in (
+            m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+            -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1)),
+        ):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1) < 1e-12:
+            break
+    return h
+
+
+def betainc(a: float, b: float, x: float) -> float:
+    """Regularized incomplete beta function I_x(a, b)."""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(
+        math.lgamma(a + b)
+        - math.lgamma(a)
+        - math.lgamma(b)
+        + a * math.log(x)
+        + b * math.log1p(-x)
+    )
+    if x < (a + 1) / (a + b + 2):
+        return front * _betacf(a, b, x) / a
+    return 1 - front * _betacf(b, a, 1 - x) / b
+
+
+def welch(a: list[float], b: list[float]) -> tuple[float, float]:
+    """Welch's t statistic and two-sided p-value for mean(b) != mean(a)."""
+    va, vb = statistics.variance(a) / len(a), statistics.variance(b) / len(b)
+    if va + vb == 0:
+        return 0.0, 1.0 if statistics.fmean(a) == statistics.fmean(b) else 0.0
+    t = (statistics.fmean(b) - statistics.fmean(a)) / math.sqrt(va + vb)
+    df = (va + vb) ** 2 / (va**2 / (len(a) - 1) + vb**2 / (len(b) - 1))
+    return t, betainc(df / 2, 0.5, df / (df + t * t))
+
+
+def compare(
+    baseline: dict[str, Any],
+    current: dict[str, Any],
+    alpha: float = 0.01,
+    threshold: float = 0.05,
+    normalize: bool = True,
+) -> list[tuple[str, float, float, str]]:
+    """(name, relative change, p-value, verdict) for every benchmark in current.
+
+    A benchmark the baseline doesn't have yet is "missing": it has to be
+    added to the baseline before it can guard anything.
+    """
+    rows = []
+    for name, new in current["benchmarks"].items():
+        old = baseline["benchmarks"].get(name)
+        if old is None:
+            rows.append((name, math.nan, math.nan, "missing"))
+            continue
+        key = "normalized" if normalize else "samples"
+        _, p = welch(old[key], new[key])
+        change = statistics.fmean(new[key]) / statistics.fmean(old[key]) - 1
+        verdict = "same"
+        if p < alpha and change > threshold:
+            verdict = "slower"
+        elif p < alpha and change < -threshold:
+            verdict = "faster"
+        rows.append((name, change, p, verdict))
+    return rows
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_cmd = commands.add_parser("run")
+    _ = run_cmd.add_argument("-k", dest="pattern")
+    _ = run_cmd.add_argument("--repeat", type=int, default=15)
+    _ = run_cmd.add_argument("--min-time", type=float, default=0.02)
+    _ = run_cmd.add_argument("--output", type=Path)
+    compare_cmd = commands.add_parser("compare")
+    _ = compare_cmd.add_argument("files", type=Path, nargs="+")
+    _ = compare_cmd.add_argument("--alpha", type=float, default=0.01)
+    _ = compare_cmd.add_argument("--threshold", type=float, default=0.05)
+    _ = compare_cmd.add_argument(
+        "--raw", action="store_true", help="compare wall-clock seconds"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run(args.pattern, args.repeat, args.min_time)
+        text = json.dumps(results, indent=1)
+        if args.output:
+            args.output.parent.mkdir(parents=True, exist_ok=True)
+            _ = args.output.write_text(text + "\n")
+        else:
+            print(text)
+        return 0
+
+    baseline_path, current_path = (
+        args.files if len(args.files) == 2 else (BASELINE, args.files[0])
+    )
+    rows = compare(
+        json.loads(baseline_path.read_text()),
+        json.loads(current_path.read_text()),
+        args.alpha,
+        args.threshold,
+        not args.raw,
+    )
+    for name, change, p, verdict in rows:
+        if verdict == "missing":
+            print(f"{name:<40} {'':>8}  {'':<8}  no baseline")
+        else:
+            print(f"{name:<40} {change:+8.1%}  p={p:.4f}  {verdict}")
+    slower = [name for name, _, _, verdict in rows if verdict == "slower"]
+    missing = [name for name, _, _, verdict in rows if verdict == "missing"]
+    if slower:
+        print(f"\n{len(slower)} significant regression(s): {', '.join(slower)}")
+    if missing:
+        print(f"\n{len(missing)} benchmark(s) without a baseline: {', '.join(missing)}")
+    return 1 if slower or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
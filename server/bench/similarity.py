@@ -0,0 +1,146 @@
+"""Build time and query latency of the similar-recipes index at scale.
+
+python -m server.bench.similarity [--recipes 1000000] [--sample 2000] [--queries 2000]
+
+A full build is quadratic, so it is timed on --sample rows and extrapolated
+to the whole catalogue. The similarrecipe table is then filled with K rows
+per recipe so GET /recipes/{id}/similar is measured at full size.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from httpx import ASGITransport, AsyncClient
+from fastapi import FastAPI
+from sqlmodel import SQLModel, Session, create_engine
+
+from .. import models, similarity
+from ..routes import recipes
+from ..similarity import K, SimilarityIndex, refresh
+
+
+PANTRY = [f"ingredient {i}" for i in range(2000)]
+
+
+def seed(engine, count: int):
+    rng = random.Random(1)
+    conn = engine.raw_connection()
+    try:
+        for start in range(1, count + 1, 50_000):
+            conn.executemany(
+                "INSERT INTO recipe (id, name, description, instructions, ingredients,"
+                " calories, prep_time, servings, category_id, slug)"
+                " VALUES (?, ?, NULL, 'x', ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        i,
+                        f"Recipe {i}",
+                        json.dumps({name: "1" for name in rng.sample(PANTRY, 8)}),
+                        rng.randint(50, 1500),
+                        rng.randint(5, 240),
+                        rng.randint(1, 12),
+                        rng.randint(1, 40),
+                        f"recipe-{i}",
+                    )
+                    for i in range(start, min(start + 50_000, count + 1))
+                ],
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def fill_lists(engine, count: int):
+    # plausible rows; only the size of the table matters for the query
+    rng = random.Random(2)
+    conn = engine.raw_connection()
+    try:
+        for start in range(1, count + 1, 20_000):
+            conn.executemany(
+                "INSERT INTO similarrecipe (recipe_id, similar_id, score)"
+                " VALUES (?, ?, ?)",
+                [
+                    (i, j, rng.random())
+                    for i in range(start, min(start + 20_000, count + 1))
+                    for j in rng.sample(range(1, count + 1), K)
+                    if j != i
+                ],
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def query_latency(count: int, queries: int) -> list[float]:
+    app = FastAPI()
+    app.include_router(recipes.router, prefix="/recipes")
+    rng = random.Random(3)
+    timings = []
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://bench"
+    ) as client:
+        for _ in range(queries):
+            start = time.perf_counter()
+            resp = await client.get(f"/recipes/{rng.randint(1, count)}/similar")
+            timings.append(time.perf_counter() - start)
+            assert resp.status_code == 200 and len(resp.json()) > 0
+    return timings
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    _ = parser.add_argument("--recipes", type=int, default=1_000_000)
+    _ = parser.add_argument("--sample", type=int, default=2000)
+    _ = parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(
+            f"sqlite:///{Path(tmp) / 'similarity.db'}",
+            connect_args={"check_same_thread": False},
+        )
+        SQLModel.metadata.create_all(engine)
+        models.engine = engine
+        seed(engine, args.recipes)
+
+        start = time.perf_counter()
+        index = SimilarityIndex()
+        with Session(engine) as session:
+            index.load(session)
+        load = time.perf_counter() - start
+        print(f"  load + featurize: {load:8.2f}s  ({args.recipes} recipes)")
+
+        sample = np.arange(min(args.sample, index.size))
+        start = time.perf_counter()
+        _ = list(index.neighbours(sample))
+        elapsed = time.perf_counter() - start
+        print(
+            f"  neighbour lists:  {elapsed / len(sample) * 1000:8.3f}ms per recipe"
+            f"  (full build ~{load + elapsed * index.size / len(sample):.0f}s)"
+        )
+
+        similarity._index = index
+        fill_lists(engine, args.recipes)
+        timings = []
+        for recipe_id in random.Random(4).sample(range(1, args.recipes + 1), 20):
+            start = time.perf_counter()
+            _ = refresh(engine, recipe_id)
+            timings.append(time.perf_counter() - start)
+        print(f"  refresh:          {statistics.median(timings) * 1000:8.1f}ms median")
+
+        timings = sorted(await query_latency(args.recipes, args.queries))
+        p50 = timings[len(timings) // 2] * 1000
+        p99 = timings[int(len(timings) * 0.99)] * 1000
+        print(f"  GET similar:      {p50:8.2f}ms p50  {p99:.2f}ms p99")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
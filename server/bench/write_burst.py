@@ -0,0 +1,101 @@
+"""Burst of small comment inserts: one commit per write vs. the writer queue.
+
+python -m server.bench.write_burst [--writes 2000] [--concurrency 64]
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel, Session, create_engine
+
+from ..models import Comment, User
+from ..writer import WriteQueue
+
+
+def make_engine(path: Path):
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False, "timeout": 5},
+        pool_size=64,
+    )
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):  # pyright: ignore
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as s:
+        s.add(User(username="bench", password="x", role="USER"))
+        s.commit()
+    return engine
+
+
+def comment(i: int) -> Comment:
+    return Comment(title=f"c{i}", text="burst", rating=4, user_id=1, recipe_id=None)
+
+
+async def direct(engine, writes: int, concurrency: int) -> tuple[float, int]:
+    # what the routes did before: every request commits on its own
+    sem = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    def insert(i: int):
+        with Session(engine) as s:
+            s.add(comment(i))
+            s.commit()
+
+    async def one(i: int):
+        nonlocal errors
+        async with sem:
+            try:
+                await asyncio.to_thread(insert, i)
+            except OperationalError:
+                errors += 1
+
+    start = time.perf_counter()
+    _ = await asyncio.gather(*(one(i) for i in range(writes)))
+    return time.perf_counter() - start, errors
+
+
+async def queued(engine, writes: int, concurrency: int) -> tuple[float, int]:
+    writer = WriteQueue(engine)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with sem:
+            _ = await writer.submit(lambda s: s.add(comment(i)))
+
+    start = time.perf_counter()
+    _ = await asyncio.gather(*(one(i) for i in range(writes)))
+    elapsed = time.perf_counter() - start
+    writer.close()
+    return elapsed, 0
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    _ = parser.add_argument("--writes", type=int, default=2000)
+    _ = parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, run in (("commit per write", direct), ("writer queue", queued)):
+            engine = make_engine(Path(tmp) / f"{run.__name__}.db")
+            elapsed, errors = await run(engine, args.writes, args.concurrency)
+            engine.dispose()
+            print(
+                f"{name:>17}: {args.writes / elapsed:8.0f} writes/s"
+                f"  ({elapsed:.2f}s, {errors} lock errors)"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
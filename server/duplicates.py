@@ -0,0 +1,407 @@
+"""Near-duplicate recipes by MinHash over name, ingredients and instructions.
+
+A recipe's text becomes a set of shingles (word 3-grams of the name and
+instructions, plus its ingredient names). NUM_PERM MinHash values estimate
+the Jaccard similarity of two such sets: the fraction of positions where
+their signatures agree. The signature is split into BANDS bands of ROWS
+values; recipes sharing any whole band land in the same recipebucket row,
+so finding candidates is a handful of index lookups. Two recipes of
+similarity s share a band with probability 1 - (1 - s**ROWS)**BANDS; with
+32 bands of 4 rows that curve turns at ~0.42, so a pair at the 0.7
+threshold collides 99.98% of the time and one at 0.65 99.8%. Candidates
+below the threshold are dropped by comparing whole signatures.
+
+Clustering every indexed recipe reads the whole bucket table, so a
+periodic job stores the clusters in recipecluster and GET
+/recipes/duplicates pages through that.
+
+python -m server.duplicates backfill [--workers N]   # index what isn't yet
+python -m server.duplicates backfill --all           # after a hashing change
+python -m server.duplicates cluster                  # store clusters now
+"""
+
+import argparse
+import os
+import re
+import time
+import zlib
+from collections.abc import Iterable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+import numpy as np
+from sqlalchemy import Engine, and_, bindparam, delete, insert, or_
+from sqlmodel import Session, select
+
+from .jobs import jobs
+from .metrics import metrics
+from .models import Recipe, RecipeBucket, RecipeCluster, RecipeSignature
+from .similarity import ingredient_names
+
+
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+DUPLICATE_THRESHOLD = 0.7
+# members of one bucket that are paired with each other when clustering
+MAX_BUCKET_PAIRS = int(os.environ.get("DUPLICATE_MAX_BUCKET_PAIRS", "50"))
+CLUSTER_INTERVAL = float(os.environ.get("DUPLICATE_CLUSTER_INTERVAL", "900"))
+# a Mersenne prime: a * h + b stays below 2**64 for 32-bit shingle hashes
+PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240501)
+_A = _rng.integers(1, PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+_B = _rng.integers(0, PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+# odd, so multiplying by a key is a bijection mod 2**64
+_BAND_KEYS = _rng.integers(0, 1 << 63, (BANDS, ROWS), dtype=np.uint64)
+_BAND_KEYS |= np.uint64(1)
+_PRIME = np.uint64(PRIME)
+_SHIFT = np.uint64(31)
+
+TEXT_COLUMNS = (Recipe.id, Recipe.name, Recipe.ingredients, Recipe.instructions)
+
+
+def shingles(name: str, ingredients: str, instructions: str) -> set[str]:
+    words = re.findall(r"[a-z0-9]+", f"{name} {instructions}".lower())
+    grams = {" ".join(words[i : i + 3]) for i in range(max(len(words) - 2, 1))}
+    grams.discard("")
+    grams.update(f"ingredient:{n}" for n in ingredient_names(ingredients))
+    return grams
+
+
+def signature(tokens: set[str]) -> np.ndarray | None:
+    if not tokens:
+        return None
+    # crc32 through map() stays in C; a hash object per shingle cost more
+    # than the permutations
+    hashes = np.fromiter(
+        map(zlib.crc32, map(str.encode, tokens)), dtype=np.uint64, count=len(tokens)
+    )
+    values = _A * hashes + _B
+    # x mod 2**31 - 1 without division: fold the high bits onto the low ones
+    for _ in range(2):
+        values = (values & _PRIME) + (values >> _SHIFT)
+    values[values >= _PRIME] -= _PRIME
+    return values.min(axis=1).astype(np.uint32)
+
+
+def text_signature(row: Sequence[Any]) -> tuple[int, bytes | None]:
+    # (id, name, ingredients, instructions) -> (id, signature); picklable for
+    # the backfill's worker processes
+    sig = signature(shingles(row[1], row[2], row[3]))
+    return row[0], None if sig is None else sig.tobytes()
+
+
+def band_keys(signatures: np.ndarray) -> np.ndarray:
+    """Bucket of every band of (n, NUM_PERM) signatures, as (n, BANDS) int64.
+
+    Each band's values times odd random 64-bit keys, summed with wraparound:
+    a multiply-add hash of the whole band, vectorised over every row.
+    """
+    rows = signatures.reshape(-1, BANDS, ROWS).astype(np.uint64)
+    return (rows * _BAND_KEYS).sum(axis=2, dtype=np.uint64).view(np.int64)
+
+
+def bands(sig: np.ndarray) -> list[tuple[int, int]]:
+    return list(enumerate(band_keys(sig)[0].tolist()))
+
+
+def estimate(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+
+# OR of equalities: SQLite probes the primary key once per band, where a
+# row-value IN would scan the table. Built once, since constructing the
+# terms per call cost more than running the query.
+_CANDIDATES = select(RecipeBucket.recipe_id).where(
+    or_(
+        *(
+            and_(
+                RecipeBucket.band == band,
+                RecipeBucket.bucket == bindparam(f"bucket{band}"),
+            )
+            for band in range(BANDS)
+        )
+    )
+)
+
+
+def find_duplicates(
+    session: Session,
+    sig: np.ndarray,
+    exclude: int | None = None,
+    threshold: float = DUPLICATE_THRESHOLD,
+) -> list[tuple[int, float]]:
+    """Indexed recipes whose estimated similarity reaches the threshold."""
+    candidates = set(
+        session.exec(
+            _CANDIDATES,  # pyright: ignore
+            params={f"bucket{band}": bucket for band, bucket in bands(sig)},
+        ).all()
+    )
+    candidates.discard(exclude)
+    if not candidates:
+        return []
+    matches = []
+    for recipe_id, other in session.exec(
+        select(RecipeSignature.recipe_id, RecipeSignature.signature).where(
+            RecipeSignature.recipe_id.in_(candidates)  # pyright: ignore
+        )
+    ):
+        score = estimate(sig, np.frombuffer(other, dtype=np.uint32))
+        if score >= threshold:
+            matches.append((recipe_id, score))
+    return sorted(matches, key=lambda m: (-m[1], m[0]))
+
+
+def describe(session: Session, scores: dict[int, float]) -> list[dict[str, Any]]:
+    """RecipeDuplicate rows, most similar first."""
+    if not scores:
+        return []
+    rows = session.exec(
+        select(Recipe.id, Recipe.name, Recipe.slug).where(
+            Recipe.id.in_(scores)  # pyright: ignore
+        )
+    ).all()
+    return sorted(
+        ({**r._asdict(), "similarity": scores[r.id]} for r in rows),
+        key=lambda d: (-d["similarity"], d["id"]),
+    )
+
+
+_SIGNATURES = RecipeSignature.__table__  # pyright: ignore
+_BUCKETS = RecipeBucket.__table__  # pyright: ignore
+_CLUSTERS = RecipeCluster.__table__  # pyright: ignore
+
+
+def unindex(session: Session, recipe_ids: Sequence[int]):
+    # Core statements on the connection: these run on every recipe write and
+    # the ORM's bulk paths cost several times the SQL
+    conn = session.connection()
+    _ = conn.execute(delete(_BUCKETS).where(_BUCKETS.c.recipe_id.in_(recipe_ids)))
+    _ = conn.execute(delete(_SIGNATURES).where(_SIGNATURES.c.recipe_id.in_(recipe_ids)))
+
+
+def index_signatures(
+    session: Session,
+    signatures: Sequence[tuple[int, bytes | None]],
+    replace: bool = True,
+):
+    """Stores signatures and their buckets, replacing any older ones.
+
+    replace=False skips the delete for recipes that were just created.
+    """
+    if replace:
+        unindex(session, [recipe_id for recipe_id, _ in signatures])
+    indexed = [(r, s) for r, s in signatures if s is not None]
+    if not indexed:
+        return
+    conn = session.connection()
+    _ = conn.execute(
+        insert(_SIGNATURES),
+        [{"recipe_id": r, "signature": s} for r, s in indexed],
+    )
+    keys = band_keys(np.frombuffer(b"".join(s for _, s in indexed), dtype=np.uint32))
+    _ = conn.execute(
+        insert(_BUCKETS),
+        [
+            {"band": band, "bucket": bucket, "recipe_id": r}
+            for (r, _), buckets in zip(indexed, keys.tolist())
+            for band, bucket in enumerate(buckets)
+        ],
+    )
+
+
+def duplicate_clusters(
+    session: Session, threshold: float = DUPLICATE_THRESHOLD
+) -> list[tuple[float, dict[int, float]]]:
+    """Groups of recipes linked by pairs above the threshold, largest first.
+
+    Returns (lowest pair similarity, {recipe_id: best similarity}) per group.
+    """
+    pairs: set[tuple[int, int]] = set()
+    current: tuple[int, int] | None = None
+    members: list[int] = []
+    # one pass over the primary key index finds every collision
+    for band, bucket, recipe_id in session.exec(
+        select(RecipeBucket.band, RecipeBucket.bucket, RecipeBucket.recipe_id).order_by(
+            RecipeBucket.band, RecipeBucket.bucket  # pyright: ignore
+        )
+    ):
+        if (band, bucket) != current:
+            current, members = (band, bucket), []
+        if len(members) < MAX_BUCKET_PAIRS:
+            pairs.update((m, recipe_id) for m in members)
+        else:
+            # past the cap only the first member links in, so a crowded
+            # bucket costs pairs linear in its size
+            pairs.add((members[0], recipe_id))
+            if len(members) == MAX_BUCKET_PAIRS:
+                metrics.inc("duplicate_buckets_capped")
+        members.append(recipe_id)
+    if not pairs:
+        return []
+
+    ids = {r for pair in pairs for r in pair}
+    signatures: dict[int, np.ndarray] = {}
+    ordered = sorted(ids)
+    for i in range(0, len(ordered), 500):
+        for recipe_id, sig in session.exec(
+            select(RecipeSignature.recipe_id, RecipeSignature.signature).where(
+                RecipeSignature.recipe_id.in_(ordered[i : i + 500])  # pyright: ignore
+            )
+        ):
+            signatures[recipe_id] = np.frombuffer(sig, dtype=np.uint32)
+
+    parent = {r: r for r in ids}
+
+    def root(r: int) -> int:
+        while parent[r] != r:
+            parent[r] = parent[parent[r]]
+            r = parent[r]
+        return r
+
+    best: dict[int, float] = {}
+    links: list[tuple[int, int, float]] = []
+    for a, b in pairs:
+        score = estimate(signatures[a], signatures[b])
+        if score < threshold:
+            continue
+        links.append((a, b, score))
+        parent[root(a)] = root(b)
+        best[a] = max(best.get(a, 0.0), score)
+        best[b] = max(best.get(b, 0.0), score)
+
+    clusters: dict[int, tuple[float, dict[int, float]]] = {}
+    for a, _, score in links:
+        low, group = clusters.get(root(a), (1.0, {}))
+        clusters[root(a)] = (min(low, score), group)
+    for recipe_id, score in best.items():
+        clusters[root(recipe_id)][1][recipe_id] = score
+    return sorted(clusters.values(), key=lambda c: (-len(c[1]), min(c[1])))
+
+
+@jobs.periodic(CLUSTER_INTERVAL)
+def store_clusters(engine: Engine) -> int:
+    """Recomputes the clusters GET /recipes/duplicates pages through.
+
+    Clustering reads every bucket, so it runs here rather than per request;
+    the rows are replaced in one transaction.
+    """
+    with Session(engine) as session:
+        clusters = duplicate_clusters(session)
+    rows = [
+        {
+            "cluster": number,
+            "recipe_id": recipe_id,
+            "similarity": score,
+            "cluster_similarity": low,
+        }
+        for number, (low, members) in enumerate(clusters)
+        for recipe_id, score in members.items()
+    ]
+    with engine.connect() as conn:
+        _ = conn.exec_driver_sql("BEGIN IMMEDIATE")
+        _ = conn.execute(delete(_CLUSTERS))
+        if rows:
+            _ = conn.execute(insert(_CLUSTERS), rows)
+        conn.commit()
+    return len(clusters)
+
+
+def read_clusters(
+    session: Session, offset: int, limit: int
+) -> list[tuple[float, dict[int, float]]]:
+    """A page of the stored clusters, in the order duplicate_clusters made."""
+    clusters: dict[int, tuple[float, dict[int, float]]] = {}
+    for row in session.exec(
+        select(RecipeCluster)
+        .where(
+            RecipeCluster.cluster >= offset,
+            RecipeCluster.cluster < offset + limit,
+        )
+        .order_by(RecipeCluster.cluster)  # pyright: ignore
+    ):
+        _, members = clusters.setdefault(row.cluster, (row.cluster_similarity, {}))
+        members[row.recipe_id] = row.similarity
+    return list(clusters.values())
+
+
+def unindexed(
+    session: Session, after: int, limit: int, reindex: bool = False
+) -> list[Sequence[Any]]:
+    statement = select(*TEXT_COLUMNS).where(Recipe.id > after)
+    if not reindex:
+        statement = statement.where(
+            Recipe.id.not_in(select(RecipeSignature.recipe_id))  # pyright: ignore
+        )
+    return list(
+        session.exec(
+            statement.order_by(Recipe.id).limit(limit)  # pyright: ignore
+        ).all()
+    )
+
+
+def backfill(
+    engine: Engine,
+    workers: int | None = None,
+    chunk_size: int = 2000,
+    reindex: bool = False,
+) -> int:
+    """Indexes every recipe without a signature, or every recipe on reindex.
+
+    Signatures are computed in a pool of processes; this process only
+    reads chunks and writes the results, SQLite's single writer.
+    """
+    done = 0
+    last = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            with Session(engine) as session:
+                rows = unindexed(session, last, chunk_size, reindex)
+                if not rows:
+                    return done
+                last = rows[-1][0]
+                signatures = list(
+                    pool.map(
+                        text_signature,
+                        [tuple(r) for r in rows],
+                        chunksize=max(1, len(rows) // (4 * (workers or 4))),
+                    )
+                )
+                index_signatures(session, signatures)
+                session.commit()
+            done += len(rows)
+
+
+def index_recipes(
+    session: Session, rows: Iterable[Sequence[Any]], replace: bool = True
+):
+    """(id, name, ingredients, instructions) rows; see TEXT_COLUMNS."""
+    index_signatures(session, [text_signature(r) for r in rows], replace)
+
+
+def main():
+    from . import models
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("backfill", help="index recipes that have no signature")
+    _ = run.add_argument("--workers", type=int, default=None)
+    _ = run.add_argument("--chunk-size", type=int, default=2000)
+    _ = run.add_argument(
+        "--all", action="store_true", help="recompute every recipe's signature"
+    )
+    _ = sub.add_parser("cluster", help="store the duplicate clusters now")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "cluster":
+        done = store_clusters(models.engine)
+        print(f"{done} clusters in {time.perf_counter() - start:.1f}s")
+        return
+    done = backfill(models.engine, args.workers, args.chunk_size, args.all)
+    print(f"{done} recipes in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+import asyncio
+import hashlib
+import json
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import Engine, and_, delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import metrics
+from .models import IdempotencyKey
+from .routes.auth import by_user
+from .writer import get_writer
+
+
+IDEMPOTENT_PATHS = ("/recipes/", "/comments/", "/auth/register")
+# 4xx that say nothing about the request itself: the same retry may succeed
+TRANSIENT_STATUSES = frozenset({401, 403, 408, 409, 429})
+# credentials handed to the first response only; a replay would hand the same
+# session to whoever retries the key for the next day
+UNSTORED_HEADERS = frozenset(
+    {b"set-cookie", b"authentication-info", b"proxy-authentication-info"}
+)
+
+
+def storable(status: int) -> bool:
+    return 200 <= status < 300 or (
+        400 <= status < 500 and status not in TRANSIENT_STATUSES
+    )
+
+
+def abandoned(stored: IdempotencyKey, now: float) -> bool:
+    return stored.status is None and (
+        stored.locked_until is None or stored.locked_until < now
+    )
+
+
+class IdempotencyMiddleware:
+    """Replays the stored response when a POST is retried with the same Idempotency-Key.
+
+    A retry with a different body is rejected with 422. A duplicate that
+    arrives while the first request is still running waits for it in this
+    process, or gets a 409 if the first one is running in another worker.
+    A running request holds the key on a lease it keeps renewing; if its
+    worker dies the lease runs out and a retry takes the key over.
+    Only 2xx and deterministic 4xx responses are stored; after a 5xx or a
+    transient 4xx (auth, timeout, conflict, rate limit) the key is released
+    so the client can retry. Cookies and other credentials aren't stored, so
+    a replay carries none.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        engine: Engine,
+        paths: tuple[str, ...] = IDEMPOTENT_PATHS,
+        ttl: float = 24 * 3600,
+        purge_interval: float = 600,
+        lease: float = 60,
+    ):
+        self.app: ASGIApp = app
+        self.engine: Engine = engine
+        self.paths: tuple[str, ...] = paths
+        self.ttl: float = ttl
+        self.purge_interval: float = purge_interval
+        self.lease: float = lease
+        self._inflight: dict[tuple[str, str], asyncio.Event] = {}
+        self._last_purge: float = 0.0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        key = None
+        for name, value in scope["headers"]:
+            if name == b"idempotency-key":
+                key = value.decode("latin-1").strip()
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > 255:
+            response = JSONResponse(
+                status_code=400, content={"message": "Idempotency-Key is too long"}
+            )
+            await response(scope, receive, send)
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+
+        owner = by_user(Request(scope))
+        digest = hashlib.sha256(
+            b"%s %s\n%s" % (scope["method"].encode(), scope["path"].encode(), body)
+        ).hexdigest()
+
+        while True:
+            waiting = self._inflight.get((owner, key))
+            if waiting is not None:
+                metrics.inc("idempotency_waits")
+                _ = await waiting.wait()
+                continue
+
+            stored = await run_in_threadpool(self._lookup, owner, key)
+            if (owner, key) in self._inflight:
+                # claimed by a concurrent duplicate while we were looking
+                continue
+            if stored is None:
+                event = self._inflight[(owner, key)] = asyncio.Event()
+                try:
+                    claimed = await get_writer(self.engine).submit(
+                        self._claim(owner, key, digest)
+                    )
+                except IntegrityError:
+                    claimed = False
+                if claimed:
+                    try:
+                        await self._run(scope, body, send, owner, key)
+                    finally:
+                        _ = self._inflight.pop((owner, key), None)
+                        event.set()
+                    return
+                # another worker claimed the key between lookup and insert
+                _ = self._inflight.pop((owner, key), None)
+                event.set()
+                continue
+
+            if stored.request_hash != digest:
+                response = JSONResponse(
+                    status_code=422,
+                    content={
+                        "message": "Idempotency-Key was already used for a different request"
+                    },
+                )
+            elif stored.status is None:
+                response = JSONResponse(
+                    status_code=409,
+                    content={
+                        "message": "A request with this Idempotency-Key is in progress"
+                    },
+                    headers={"Retry-After": "1"},
+                )
+            else:
+                metrics.inc("idempotency_replays")
+                await self._replay(stored, send)
+                return
+            await response(scope, receive, send)
+            return
+
+    def _lookup(self, owner: str, key: str) -> IdempotencyKey | None:
+        with Session(self.engine, expire_on_commit=False) as session:
+            stored = session.exec(
+                select(IdempotencyKey).where(
+                    IdempotencyKey.owner == owner, IdempotencyKey.key == key
+                )
+            ).first()
+        if stored is None:
+            return None
+        now = time.time()
+        if stored.expires_at < now or abandoned(stored, now):
+            return None
+        return stored
+
+    def _claim(self, owner: str, key: str, digest: str):
+        now = time.time()
+
+        def claim(s: Session) -> bool:
+            # an expired row, or the claim of a request that died, is replaced
+            _ = s.exec(
+                delete(IdempotencyKey).where(  # pyright: ignore
+                    IdempotencyKey.owner == owner,
+                    IdempotencyKey.key == key,
+                    or_(
+                        IdempotencyKey.expires_at < now,
+                        and_(
+                            IdempotencyKey.status.is_(None),  # pyright: ignore
+                            or_(
+                                IdempotencyKey.locked_until.is_(
+                                    None
+                                ),  # pyright: ignore
+                                IdempotencyKey.locked_until < now,  # pyright: ignore
+                            ),
+                        ),
+                    ),
+                )
+            )
+            s.add(
+                IdempotencyKey(
+                    owner=owner,
+                    key=key,
+                    request_hash=digest,
+                    expires_at=now + self.ttl,
+                    locked_until=now + self.lease,
+                )
+            )
+            s.flush()
+            return True
+
+        return claim
+
+    async def _run(self, scope: Scope, body: bytes, send: Send, owner: str, key: str):
+        delivered = False
+
+        async def receive() -> Message:
+            nonlocal delivered
+            if delivered:
+                return {"type": "http.disconnect"}
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        status = 500
+        headers: list[tuple[bytes, bytes]] = []
+        chunks: list[bytes] = []
+
+        async def capture(message: Message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        heartbeat = asyncio.create_task(self._heartbeat(owner, key))
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            _ = heartbeat.cancel()
+            if storable(status):
+                store = self._store(owner, key, status, headers, b"".join(chunks))
+            else:
+                store = self._release(owner, key)
+            _ = await get_writer(self.engine).submit(store)
+            now = time.time()
+            if now - self._last_purge > self.purge_interval:
+                self._last_purge = now
+                _ = await get_writer(self.engine).submit(self._purge)
+
+    async def _heartbeat(self, owner: str, key: str):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                _ = await get_writer(self.engine).submit(self._renew(owner, key))
+            except Exception:
+                metrics.inc("idempotency_renew_failures")
+
+    def _renew(self, owner: str, key: str):
+        def renew(s: Session):
+            _ = s.exec(
+                update(IdempotencyKey)
+                .where(
+                    IdempotencyKey.owner == owner,  # pyright: ignore
+                    IdempotencyKey.key == key,  # pyright: ignore
+                    IdempotencyKey.status.is_(None),  # pyright: ignore
+                )
+                .values(locked_until=time.time() + self.lease)
+            )
+
+        return renew
+
+    def _store(
+        self,
+        owner: str,
+        key: str,
+        status: int,
+        headers: list[tuple[bytes, bytes]],
+        body: bytes,
+    ):
+        encoded = json.dumps(
+            [
+                [k.decode("latin-1"), v.decode("latin-1")]
+                for k, v in headers
+                if k.lower() not in UNSTORED_HEADERS
+            ]
+        )
+
+        def store(s: Session):
+            stored = s.exec(
+                select(IdempotencyKey).where(
+                    IdempotencyKey.owner == owner, IdempotencyKey.key == key
+                )
+            ).first()
+            if stored is not None:
+                stored.status = status
+                stored.headers = encoded
+                stored.body = body
+                s.add(stored)
+
+        return store
+
+    def _release(self, owner: str, key: str):
+        def release(s: Session):
+            _ = s.exec(
+                delete(IdempotencyKey).where(  # pyright: ignore
+                    IdempotencyKey.owner == owner, IdempotencyKey.key == key
+                )
+            )
+
+        return release
+
+    @staticmethod
+    def _purge(s: Session):
+        _ = s.exec(
+            delete(IdempotencyKey).where(  # pyright: ignore
+                IdempotencyKey.expires_at < time.time()
+            )
+        )
+
+    async def _replay(self, stored: IdempotencyKey, send: Send):
+        headers = [
+            (k.encode("latin-1"), v.encode("latin-1"))
+            for k, v in json.loads(stored.headers or "[]")
+        ]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send(
+            {"type": "http.response.start", "status": stored.status, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": stored.body or b""})
@@ -0,0 +1,315 @@
+"""Ingredient entries parsed into (quantity, unit, item), scaled and converted.
+
+Recipes store ingredients as free-form JSON: usually an object mapping the
+item to its amount ({"flour": "1 1/2 cups", "eggs": 2}), sometimes a list
+of strings or of {"name", "quantity", "unit"} objects, sometimes plain
+text. Amounts may be integers, decimals, fractions ("3/4", "1 1/2",
+"1-1/2", "½") and ranges ("2-3", "2 to 3").
+
+Parsing depends only on the ingredients text, so parse_ingredients caches
+by its hash: an edited recipe gets a new entry and identical lists share
+one. Entries are tuples, safe to hand out to every caller.
+"""
+
+import json
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Any, Literal, NamedTuple
+
+from .metrics import metrics
+from .rendering import content_hash
+
+CACHE_SIZE = 4096
+
+UnitSystem = Literal["metric", "imperial"]
+
+
+class Unit(NamedTuple):
+    name: str
+    # "mass" in grams, "volume" in millilitres; None for counted units
+    dimension: str | None
+    factor: float
+
+
+_UNITS = [
+    Unit("g", "mass", 1),
+    Unit("kg", "mass", 1000),
+    Unit("mg", "mass", 0.001),
+    Unit("oz", "mass", 28.349523125),
+    Unit("lb", "mass", 453.59237),
+    Unit("ml", "volume", 1),
+    Unit("l", "volume", 1000),
+    Unit("tsp", "volume", 4.92892159375),
+    Unit("tbsp", "volume", 14.78676478125),
+    Unit("fl oz", "volume", 29.5735295625),
+    Unit("cup", "volume", 236.5882365),
+    Unit("pint", "volume", 473.176473),
+    Unit("quart", "volume", 946.352946),
+    Unit("gallon", "volume", 3785.411784),
+    *(
+        Unit(name, None, 1)
+        for name in (
+            "bunch",
+            "can",
+            "clove",
+            "dash",
+            "handful",
+            "head",
+            "leaf",
+            "package",
+            "piece",
+            "pinch",
+            "slice",
+            "sprig",
+            "stick",
+        )
+    ),
+]
+UNITS = {u.name: u for u in _UNITS}
+
+_ALIASES = {
+    "gram": "g",
+    "grams": "g",
+    "gr": "g",
+    "kilogram": "kg",
+    "kilograms": "kg",
+    "kilo": "kg",
+    "kilos": "kg",
+    "milligram": "mg",
+    "milligrams": "mg",
+    "ounce": "oz",
+    "ounces": "oz",
+    "pound": "lb",
+    "pounds": "lb",
+    "lbs": "lb",
+    "millilitre": "ml",
+    "millilitres": "ml",
+    "milliliter": "ml",
+    "milliliters": "ml",
+    "litre": "l",
+    "litres": "l",
+    "liter": "l",
+    "liters": "l",
+    "teaspoon": "tsp",
+    "teaspoons": "tsp",
+    "tsps": "tsp",
+    "tablespoon": "tbsp",
+    "tablespoons": "tbsp",
+    "tbsps": "tbsp",
+    "tbs": "tbsp",
+    "fluid ounce": "fl oz",
+    "fluid ounces": "fl oz",
+    "cups": "cup",
+    "c": "cup",
+    "pints": "pint",
+    "pt": "pint",
+    "quarts": "quart",
+    "qt": "quart",
+    "gallons": "gallon",
+    "gal": "gallon",
+    "bunches": "bunch",
+    "cans": "can",
+    "cloves": "clove",
+    "dashes": "dash",
+    "handfuls": "handful",
+    "heads": "head",
+    "leaves": "leaf",
+    "packages": "package",
+    "pieces": "piece",
+    "pinches": "pinch",
+    "slices": "slice",
+    "sprigs": "sprig",
+    "sticks": "stick",
+}
+_LOOKUP = {**{name: name for name in UNITS}, **_ALIASES}
+
+_VULGAR = {
+    "¼": 0.25,
+    "½": 0.5,
+    "¾": 0.75,
+    "⅓": 1 / 3,
+    "⅔": 2 / 3,
+    "⅛": 0.125,
+    "⅜": 0.375,
+    "⅝": 0.625,
+    "⅞": 0.875,
+}
+# "1 1/2" and "1-1/2" are mixed numbers; "1/2-3/4" and "2-3" are ranges
+_NUMBER = rf"(?:\d+(?:\s+|-)\d+/\d+|\d+/\d+|\d*\s*[{''.join(_VULGAR)}]|\d+(?:[.,]\d+)?)"
+_AMOUNT = re.compile(
+    rf"^\s*(?P<low>{_NUMBER})(?:\s*(?:-|–|to)\s*(?P<high>{_NUMBER}))?\s*",
+    re.IGNORECASE,
+)
+# longest alias first, so "fl oz" wins over "oz"; a unit ends at a word break
+_UNIT = re.compile(
+    r"^(?P<unit>"
+    + "|".join(re.escape(a) for a in sorted(_LOOKUP, key=len, reverse=True))
+    + r")\.?(?![a-z])\s*(?:of\s+)?",
+    re.IGNORECASE,
+)
+
+
+class Ingredient(NamedTuple):
+    item: str
+    quantity: float | None = None
+    # upper end of a range such as "2-3"
+    quantity_max: float | None = None
+    unit: str | None = None
+    # whatever couldn't be read as an amount, e.g. "to taste"
+    note: str | None = None
+
+
+def parse_number(text: str) -> float:
+    text = text.strip().replace(",", ".")
+    if text[-1] in _VULGAR:
+        whole = text[:-1].strip()
+        return (float(whole) if whole else 0) + _VULGAR[text[-1]]
+    if "/" in text:
+        whole, _, fraction = text.replace("-", " ").rpartition(" ")
+        numerator, denominator = fraction.split("/")
+        return (float(whole) if whole else 0) + int(numerator) / int(denominator)
+    return float(text)
+
+
+def parse_amount(text: str) -> tuple[float | None, float | None, str | None, str]:
+    """Leading quantity, range end and unit of text, and the remainder."""
+    match = _AMOUNT.match(text)
+    if not match:
+        return None, None, None, text.strip()
+    try:
+        low = parse_number(match["low"])
+        high = parse_number(match["high"]) if match["high"] else None
+    except (ValueError, ZeroDivisionError):
+        return None, None, None, text.strip()
+    if high is not None and high < low:
+        # "5-3" isn't a range; leave the text for the caller to keep as is
+        return None, None, None, text.strip()
+    rest = text[match.end() :]
+    unit = None
+    unit_match = _UNIT.match(rest)
+    if unit_match:
+        unit = _LOOKUP[unit_match["unit"].lower()]
+        rest = rest[unit_match.end() :]
+    return low, high, unit, rest.strip()
+
+
+def parse_entry(item: str, amount: Any = None) -> Ingredient:
+    """One entry: a full line ("2 cups flour"), or an item and its amount."""
+    item = item.replace("_", " ").strip()
+    if amount is None:
+        quantity, high, unit, rest = parse_amount(item)
+        # a bare amount ("½ cup") names no item; it isn't one either
+        return Ingredient(rest if quantity is not None else item, quantity, high, unit)
+    if isinstance(amount, bool):
+        return Ingredient(item, note=str(amount).lower())
+    if isinstance(amount, (int, float)):
+        return Ingredient(item, float(amount))
+    quantity, high, unit, rest = parse_amount(str(amount))
+    return Ingredient(item, quantity, high, unit, rest or None)
+
+
+def _parse(ingredients: str) -> tuple[Ingredient, ...]:
+    try:
+        parsed = json.loads(ingredients)
+    except ValueError:
+        parsed = ingredients
+    if isinstance(parsed, dict):
+        return tuple(parse_entry(str(k), v) for k, v in parsed.items())
+    if isinstance(parsed, list):
+        entries = []
+        for entry in parsed:
+            if isinstance(entry, dict):
+                amount = entry.get("quantity")
+                if amount is not None and entry.get("unit"):
+                    amount = f"{amount} {entry['unit']}"
+                entries.append(parse_entry(str(entry.get("name", "")), amount))
+            else:
+                entries.append(parse_entry(str(entry)))
+        return tuple(e for e in entries if e.item or e.quantity is not None)
+    return tuple(
+        parse_entry(line)
+        for line in re.split(r"[;\n]|,(?!\d)", str(parsed))
+        if line.strip()
+    )
+
+
+_cache: OrderedDict[str, tuple[Ingredient, ...]] = OrderedDict()
+_lock = threading.Lock()
+
+
+def parse_ingredients(ingredients: str) -> tuple[Ingredient, ...]:
+    key = content_hash(ingredients)
+    with _lock:
+        parsed = _cache.get(key)
+        if parsed is not None:
+            _cache.move_to_end(key)
+            metrics.inc("ingredient_cache_hits")
+            return parsed
+
+    parsed = _parse(ingredients)
+
+    with _lock:
+        _cache[key] = parsed
+        if len(_cache) > CACHE_SIZE:
+            _ = _cache.popitem(last=False)
+    return parsed
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+
+# the unit an amount is shown in: the largest whose quantity stays >= 1
+DISPLAY_UNITS: dict[tuple[str, UnitSystem], tuple[str, ...]] = {
+    ("mass", "metric"): ("kg", "g", "mg"),
+    ("volume", "metric"): ("l", "ml"),
+    ("mass", "imperial"): ("lb", "oz"),
+    ("volume", "imperial"): ("gallon", "quart", "cup", "tbsp", "tsp"),
+}
+
+
+def display_unit(base: float, dimension: str, system: UnitSystem) -> str:
+    """Unit to show a quantity of base units (g or ml) in."""
+    names = DISPLAY_UNITS[(dimension, system)]
+    for name in names:
+        if base >= UNITS[name].factor * 0.999:
+            return name
+    return names[-1]
+
+
+def round_quantity(quantity: float) -> float:
+    # 3 significant digits: 0.333 cup, 1.33 kg, 567 g
+    return float(f"{quantity:.3g}")
+
+
+def scale(
+    ingredients: Sequence[Ingredient],
+    factor: float,
+    system: UnitSystem | None = None,
+) -> list[Ingredient]:
+    """Multiplies every quantity, converting to a unit system if given."""
+    scaled = []
+    for entry in ingredients:
+        if entry.quantity is None:
+            scaled.append(entry)
+            continue
+        quantity = entry.quantity * factor
+        high = None if entry.quantity_max is None else entry.quantity_max * factor
+        unit = entry.unit
+        info = UNITS.get(unit) if unit else None
+        if system is not None and info is not None and info.dimension is not None:
+            unit = display_unit(quantity * info.factor, info.dimension, system)
+            ratio = info.factor / UNITS[unit].factor
+            quantity *= ratio
+            high = None if high is None else high * ratio
+        scaled.append(
+            entry._replace(
+                quantity=round_quantity(quantity),
+                quantity_max=None if high is None else round_quantity(high),
+                unit=unit,
+            )
+        )
+    return scaled
@@ -0,0 +1,303 @@
+import asyncio
+import inspect
+import json
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from sqlalchemy import Engine, func, or_, update
+from sqlmodel import Session, select
+
+from .metrics import metrics
+from .models import Job
+from .writer import write_lock
+
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict[str, Any]], Awaitable[None] | None]
+Periodic = Callable[[Engine], Awaitable[Any] | Any]
+
+
+class JobType:
+    def __init__(self, handler: Handler, concurrency: int, max_attempts: int):
+        self.handler: Handler = handler
+        self.concurrency: int = concurrency
+        self.max_attempts: int = max_attempts
+        self.running: int = 0
+
+
+class JobQueue:
+    """Durable outbox of post-commit work, drained by an asyncio worker.
+
+    enqueue() adds the job to the caller's session, so it is committed (or
+    rolled back) together with the write that produced it.
+
+    A claimed job is leased for `lease` seconds and the lease is renewed
+    while it runs, so a job is only taken back from a worker that stopped
+    renewing it, i.e. one that crashed or was killed.
+    """
+
+    def __init__(
+        self,
+        poll_interval: float = 1.0,
+        base_backoff: float = 1.0,
+        max_backoff: float = 300.0,
+        lease: float = 60.0,
+    ):
+        self.poll_interval: float = poll_interval
+        self.lease: float = lease
+        self.base_backoff: float = base_backoff
+        self.max_backoff: float = max_backoff
+        self.engine: Engine | None = None
+        self._types: dict[str, JobType] = {}
+        self._periodic: list[tuple[Periodic, float]] = []
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._timers: list[asyncio.Task[None]] = []
+        self._worker: asyncio.Task[None] | None = None
+        self._wake: asyncio.Event = asyncio.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopping: bool = False
+
+    def handler(
+        self, kind: str, concurrency: int = 1, max_attempts: int = 5
+    ) -> Callable[[Handler], Handler]:
+        def register(fn: Handler) -> Handler:
+            self._types[kind] = JobType(fn, concurrency, max_attempts)
+            return fn
+
+        return register
+
+    def periodic(self, interval: float) -> Callable[[Periodic], Periodic]:
+        """Run fn(engine) every `interval` seconds while the queue is started.
+
+        Periodic work is in-process and not persisted, so it has to be safe
+        to run from several workers at once.
+        """
+
+        def register(fn: Periodic) -> Periodic:
+            self._periodic.append((fn, interval))
+            return fn
+
+        return register
+
+    def enqueue(
+        self,
+        session: Session,
+        kind: str,
+        payload: dict[str, Any] | None = None,
+        delay: float = 0.0,
+    ) -> Job:
+        now = time.time()
+        job = Job(
+            kind=kind,
+            payload=json.dumps(payload or {}),
+            run_at=now + delay,
+            created_at=now,
+        )
+        session.add(job)
+        return job
+
+    def notify(self):
+        # safe to call from any thread, e.g. right after the enqueuing commit
+        if self._loop is not None and not self._loop.is_closed():
+            _ = self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def start(self, engine: Engine):
+        self.engine = engine
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        self._wake = asyncio.Event()
+        await asyncio.to_thread(self._recover)
+        self._worker = asyncio.create_task(self._run())
+        self._timers = [
+            asyncio.create_task(self._every(fn, interval))
+            for fn, interval in self._periodic
+        ]
+
+    async def stop(self, timeout: float = 10.0):
+        self._stopping = True
+        self._wake.set()
+        for timer in self._timers:
+            _ = timer.cancel()
+        _ = await asyncio.gather(*self._timers, return_exceptions=True)
+        self._timers = []
+        if self._worker is not None:
+            await self._worker
+            self._worker = None
+
+        # let in-flight jobs finish; whatever is cut off stays "running" and
+        # is picked up again once its lease expires
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                _ = task.cancel()
+            if pending:
+                _ = await asyncio.wait(pending)
+        self._loop = None
+
+    async def run_pending(self):
+        """Claim and run every due job once. Used by tests and scripts."""
+        for job in await asyncio.to_thread(self._claim):
+            await self._execute(job)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                jobs = await asyncio.to_thread(self._claim)
+            except Exception:
+                logger.exception("Failed to claim jobs")
+                jobs = []
+
+            for job in jobs:
+                task = asyncio.create_task(self._execute(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            if not jobs:
+                try:
+                    _ = await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def _every(self, fn: Periodic, interval: float):
+        name = getattr(fn, "__name__", "periodic")
+        while True:
+            await asyncio.sleep(interval)
+            start = time.perf_counter()
+            try:
+                async with write_lock.shared_async():
+                    if inspect.iscoroutinefunction(fn):
+                        await fn(self.engine)
+                    else:
+                        await asyncio.to_thread(fn, self.engine)
+            except Exception:
+                logger.exception("Periodic job %s failed", name)
+                metrics.inc(f"jobs_failed.{name}")
+            metrics.observe(f"job_run.{name}", time.perf_counter() - start)
+
+    def _recover(self):
+        with write_lock.shared(), Session(self.engine) as session:
+            self._release_expired(session, time.time())
+            session.commit()
+
+    def _release_expired(self, session: Session, now: float):
+        _ = session.exec(
+            update(Job)
+            .where(
+                Job.status == "running",
+                or_(
+                    Job.locked_until.is_(None),  # pyright: ignore
+                    Job.locked_until <= now,  # pyright: ignore
+                ),
+            )
+            .values(status="pending", locked_until=None)
+        )
+
+    def _renew(self, job: Job):
+        with write_lock.shared(), Session(self.engine) as session:
+            _ = session.exec(
+                update(Job)
+                .where(Job.id == job.id, Job.status == "running")
+                .values(locked_until=time.time() + self.lease)
+            )
+            session.commit()
+
+    async def _heartbeat(self, job: Job):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await asyncio.to_thread(self._renew, job)
+            except Exception:
+                logger.exception("Failed to renew the lease of job %s", job.id)
+
+    def _claim(self) -> list[Job]:
+        now = time.time()
+        claimed: list[Job] = []
+        with write_lock.shared(), Session(
+            self.engine, expire_on_commit=False
+        ) as session:
+            # jobs left behind by a worker that died since
+            self._release_expired(session, now)
+            for kind, job_type in self._types.items():
+                free = job_type.concurrency - job_type.running
+                if free <= 0:
+                    continue
+
+                due = (
+                    select(Job.id)
+                    .where(Job.status == "pending", Job.kind == kind, Job.run_at <= now)
+                    .order_by(Job.run_at)
+                    .limit(free)
+                )
+                # the status check makes the claim safe across worker processes
+                rows = session.exec(
+                    update(Job)
+                    .where(Job.id.in_(due), Job.status == "pending")
+                    .values(status="running", locked_until=now + self.lease)
+                    .returning(Job)
+                ).all()
+                job_type.running += len(rows)
+                claimed.extend(r[0] for r in rows)
+
+            depth = session.exec(
+                select(func.count()).select_from(Job).where(Job.status == "pending")
+            ).one()
+            session.commit()
+
+        metrics.set("jobs_queue_depth", depth)
+        return claimed
+
+    async def _execute(self, job: Job):
+        job_type = self._types[job.kind]
+        start = time.perf_counter()
+        # the job's writes wait while a POST /batch transaction is open
+        async with write_lock.shared_async():
+            heartbeat = asyncio.create_task(self._heartbeat(job))
+            try:
+                result = job_type.handler(json.loads(job.payload))
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.warning("Job %s (%s) failed: %r", job.id, job.kind, e)
+                metrics.inc(f"jobs_failed.{job.kind}")
+                await asyncio.to_thread(self._retry, job, job_type, repr(e))
+            else:
+                await asyncio.to_thread(self._complete, job)
+                metrics.inc(f"jobs_completed.{job.kind}")
+                metrics.observe(f"job_latency.{job.kind}", time.time() - job.created_at)
+            finally:
+                _ = heartbeat.cancel()
+                job_type.running -= 1
+                metrics.observe(f"job_run.{job.kind}", time.perf_counter() - start)
+
+    def _complete(self, job: Job):
+        with Session(self.engine) as session:
+            db_job = session.get(Job, job.id)
+            if db_job:
+                session.delete(db_job)
+                session.commit()
+
+    def _retry(self, job: Job, job_type: JobType, error: str):
+        with Session(self.engine) as session:
+            db_job = session.get(Job, job.id)
+            if not db_job:
+                return
+
+            db_job.attempts += 1
+            db_job.last_error = error
+            if db_job.attempts >= job_type.max_attempts:
+                db_job.status = "failed"
+            else:
+                backoff = self.base_backoff * 2 ** (db_job.attempts - 1)
+                delay = min(self.max_backoff, backoff) * random.uniform(0.5, 1.0)
+                db_job.status = "pending"
+                db_job.run_at = time.time() + delay
+            session.add(db_job)
+            session.commit()
+
+
+jobs = JobQueue()
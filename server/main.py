@@ -1,23 +1,65 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from sqlmodel import Session
 
-from .models import create_db_and_tables
+from .idempotency import IdempotencyMiddleware
+from .jobs import jobs
+from .models import create_db_and_tables, engine
+from .monitor import monitor
+from .nutrition import schedule_stats
+from .profiling import ProfilingMiddleware, continuous_profiler
+from .ratelimit import (
+    LoadSheddingMiddleware,
+    create_limiter,
+    install_rate_limit_handler,
+    shedder,
+)
+from .tracing import TracingMiddleware, instrument_serialization
+from .views import view_tracker
+from .writer import close_writers
 from .routes.categories import router as categories_router
 from .routes.recipes import router as recipes_router
 from .routes.comments import router as comments_router
 from .routes.auth import router as auth_router
+from .routes.metrics import router as metrics_router
+from .routes.batch import router as batch_router
+from .routes.shopping import router as shopping_router
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):  # pyright: ignore[reportUnusedParameter]
     create_db_and_tables()
+    # stats stored by an older release, or none yet on a new database
+    with Session(engine) as session:
+        schedule_stats(session, delay=0)
+        session.commit()
+    await jobs.start(engine)
+    await monitor.start()
+    await continuous_profiler.start()
+    await view_tracker.start(engine)
     yield
+    await view_tracker.stop()
+    await continuous_profiler.stop()
+    await monitor.stop()
+    await jobs.stop()
+    await asyncio.to_thread(close_writers)
 
 
 app = FastAPI(lifespan=lifespan)
+app.state.limiter = create_limiter(engine)
+install_rate_limit_handler(app)
+app.add_middleware(IdempotencyMiddleware, engine=engine)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(LoadSheddingMiddleware, shedder=shedder)
+app.add_middleware(TracingMiddleware)
+instrument_serialization()
 
 
 app.include_router(categories_router, prefix="/categories", tags=["categories"])
 app.include_router(recipes_router, prefix="/recipes", tags=["recipes"])
 app.include_router(comments_router, prefix="/comments", tags=["comments"])
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
+app.include_router(batch_router, prefix="/batch", tags=["batch"])
+app.include_router(shopping_router, prefix="/shopping-list", tags=["shopping-list"])
+app.include_router(metrics_router, prefix="/metrics", tags=["metrics"])
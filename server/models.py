@@ -1,12 +1,18 @@
+from collections.abc import Callable
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Annotated
+from typing import Annotated, Any, Literal
+import time
 from decimal import Decimal
-import os
 
-from fastapi import Depends
+from fastapi import Depends, Request
 from pydantic import BaseModel, EmailStr
+from sqlalchemy import Index, UniqueConstraint, event, text
 from sqlmodel import Field, Session, SQLModel, create_engine
 
+from .tracing import instrument_engine, span
+from .writer import write_lock
+
 
 class CategoryBase(SQLModel):
     name: str
@@ -42,9 +48,94 @@ class RecipeBase(SQLModel):
 
 
 class Recipe(RecipeBase, table=True):
+    # covers the "card" projection so list views never touch the wide rows
+    __table_args__ = (
+        Index(
+            "ix_recipe_card",
+            "category_id",
+            "id",
+            "name",
+            "slug",
+            "calories",
+            "prep_time",
+        ),
+        # one index per listing sort, alone and behind the equality filters;
+        # the implicit trailing rowid gives the id tiebreak for free
+        Index("ix_recipe_rating", "rating"),
+        Index("ix_recipe_prep_time", "prep_time"),
+        Index("ix_recipe_category_rating", "category_id", "rating"),
+        Index("ix_recipe_category_created", "category_id", "created_at"),
+        Index("ix_recipe_category_prep_time", "category_id", "prep_time"),
+        Index("ix_recipe_author_created", "author_id", "created_at"),
+        Index("ix_recipe_author_rating", "author_id", "rating"),
+        Index("ix_recipe_author_prep_time", "author_id", "prep_time"),
+        Index("ix_recipe_calories", "calories"),
+        Index("ix_recipe_servings", "servings"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     author_id: int | None = Field(default=None, foreign_key="user.id")
     slug: str = Field(unique=True)
+    rendered_instructions: str | None = Field(default=None)
+    created_at: float = Field(
+        default_factory=time.time,
+        index=True,
+        sa_column_kwargs={"server_default": text("(strftime('%s', 'now'))")},
+    )
+    # average comment rating, kept up to date by the comment routes
+    rating: float = Field(default=0, sa_column_kwargs={"server_default": text("0")})
+    # flushed in batches by views.py, so it lags reads by a few seconds
+    view_count: int = Field(default=0, sa_column_kwargs={"server_default": text("0")})
+
+
+class NutritionBase(SQLModel):
+    # per serving; grams except sodium, in milligrams
+    protein: float | None = Field(default=None, ge=0)
+    fat: float | None = Field(default=None, ge=0)
+    carbs: float | None = Field(default=None, ge=0)
+    fiber: float | None = Field(default=None, ge=0)
+    sugar: float | None = Field(default=None, ge=0)
+    sodium: float | None = Field(default=None, ge=0)
+
+
+NUTRIENTS: tuple[str, ...] = tuple(NutritionBase.model_fields)
+
+
+class Nutrition(NutritionBase, table=True):
+    # one index per range filter; the rowid (recipe_id) joins back to recipe
+    __table_args__ = tuple(Index(f"ix_nutrition_{n}", n) for n in NUTRIENTS)
+
+    recipe_id: int = Field(primary_key=True, foreign_key="recipe.id")
+
+
+class NutrientStats(BaseModel):
+    # recipes with a value for the nutrient
+    count: int
+    min: float | None
+    max: float | None
+    mean: float | None
+
+
+class CategoryNutrition(BaseModel):
+    category_id: int
+    recipes: int
+    nutrients: dict[str, NutrientStats]
+
+
+class CategoryNutritionStats(SQLModel, table=True):
+    """CategoryNutrition as last stored by nutrition.store_stats."""
+
+    category_id: int = Field(primary_key=True)
+    recipes: int
+    nutrients: str  # json format
+    computed_at: float
+
+
+class Counter(SQLModel, table=True):
+    """Maintained row counts; see counters.py for the names."""
+
+    name: str = Field(primary_key=True)
+    value: int = 0
 
 
 class RecipeUpdate(BaseModel):
@@ -56,6 +147,11 @@ class RecipeUpdate(BaseModel):
     prep_time: int | None = None
     servings: int | None = None
     category_id: int | None = None
+    nutrition: NutritionBase | None = None
+
+
+class RecipeCreate(RecipeBase):
+    nutrition: NutritionBase | None = None
 
 
 class RecipePublic(RecipeBase):
@@ -63,16 +159,205 @@ class RecipePublic(RecipeBase):
     id: int
 
 
+RECIPE_SORTS = {
+    "id": ("id", "asc"),
+    "rating": ("rating", "desc"),
+    "newest": ("created_at", "desc"),
+    "prep_time": ("prep_time", "asc"),
+}
+
+
+class IngredientQuantity(BaseModel):
+    item: str
+    quantity: float | None = None
+    quantity_max: float | None = None
+    unit: str | None = None
+    note: str | None = None
+
+
+class RecipeDetail(RecipePublic):
+    view_count: int = 0
+    nutrition: NutritionBase | None = None
+    # set when the request asks for other servings or units
+    scaled_servings: int | None = None
+    scaled_ingredients: list[IngredientQuantity] | None = None
+    instructions_html: str | None = None
+
+
+class RecipeImportError(BaseModel):
+    line: int
+    message: str
+
+
+class RecipeImportReport(BaseModel):
+    imported: int
+    failed: int
+    errors: list[RecipeImportError]
+    seconds: float
+    rows_per_second: float
+
+
+class RecipePartial(BaseModel):
+    id: int
+    name: str | None = None
+    slug: str | None = None
+    description: str | None = None
+    instructions: str | None = None
+    ingredients: str | None = None
+    calories: int | None = None
+    prep_time: int | None = None
+    servings: int | None = None
+    category_id: int | None = None
+
+
+RECIPE_EXPORT_FIELDS: tuple[str, ...] = (
+    *RecipePublic.model_fields,
+    "author_id",
+    "created_at",
+)
+
+
+RECIPE_VIEWS: dict[str, tuple[str, ...]] = {
+    "full": tuple(RecipePublic.model_fields),
+    "card": ("id", "name", "slug", "calories", "prep_time"),
+}
+
+
 class CommentBase(SQLModel):
     title: str
     text: str
     rating: Decimal = Field(default=0, max_digits=2, decimal_places=1)
-    recipe_id: int | None = Field(default=None, foreign_key="recipe.id")
+    recipe_id: int | None = Field(default=None, foreign_key="recipe.id", index=True)
 
 
 class Comment(CommentBase, table=True):
     user_id: int = Field(foreign_key="user.id")
     id: int | None = Field(default=None, primary_key=True)
+    created_at: float = Field(
+        default_factory=time.time,
+        sa_column_kwargs={"server_default": text("(strftime('%s', 'now'))")},
+    )
+
+
+class RecipeScore(SQLModel, table=True):
+    """Leaderboard scores of a recipe, maintained by scores.py."""
+
+    # one index per leaderboard; the rowid (recipe_id) breaks ties
+    __table_args__ = (
+        Index("ix_recipescore_top_week", "top_week"),
+        Index("ix_recipescore_top_month", "top_month"),
+        Index("ix_recipescore_top_all", "top_all"),
+        Index("ix_recipescore_trending", "trending"),
+    )
+
+    recipe_id: int = Field(primary_key=True, foreign_key="recipe.id")
+    comments: int = 0
+    rating_sum: float = 0
+    # sums of comment weights and weighted ratings, decayed up to decayed_at
+    week_weight: float = 0
+    week_rating: float = 0
+    month_weight: float = 0
+    month_rating: float = 0
+    velocity: float = 0
+    view_velocity: float = Field(
+        default=0, sa_column_kwargs={"server_default": text("0")}
+    )
+    decayed_at: float = Field(default_factory=time.time)
+    top_week: float = 0
+    top_month: float = 0
+    top_all: float = 0
+    trending: float = 0
+
+
+class RecipeSignature(SQLModel, table=True):
+    """MinHash signature of a recipe's text; see duplicates.py."""
+
+    recipe_id: int = Field(primary_key=True, foreign_key="recipe.id")
+    signature: bytes
+
+
+class RecipeBucket(SQLModel, table=True):
+    """One LSH band of a signature; recipes sharing a row are candidates."""
+
+    __table_args__ = (Index("ix_recipebucket_recipe_id", "recipe_id"),)
+
+    band: int = Field(primary_key=True)
+    bucket: int = Field(primary_key=True)
+    recipe_id: int = Field(primary_key=True, foreign_key="recipe.id")
+
+
+class RecipeCluster(SQLModel, table=True):
+    """A recipe's place in a near-duplicate cluster; see duplicates.py."""
+
+    __table_args__ = (Index("ix_recipecluster_recipe_id", "recipe_id"),)
+
+    # clusters are numbered largest first, so a page of them is a key range
+    cluster: int = Field(primary_key=True)
+    recipe_id: int = Field(primary_key=True, foreign_key="recipe.id")
+    # best estimated similarity of the recipe to another member
+    similarity: float
+    # lowest similarity of a pair linked in the cluster, on every member
+    cluster_similarity: float
+
+
+class RecipeDuplicate(BaseModel):
+    id: int
+    name: str
+    slug: str
+    similarity: float
+
+
+class RecipeCreated(RecipePublic):
+    possible_duplicates: list[RecipeDuplicate] = []
+
+
+class DuplicateCluster(BaseModel):
+    # lowest estimated similarity between two recipes linked in the cluster
+    similarity: float
+    recipes: list[RecipeDuplicate]
+
+
+class SimilarRecipe(SQLModel, table=True):
+    """Precomputed nearest neighbours of a recipe; see similarity.py."""
+
+    __table_args__ = (
+        Index("ix_similarrecipe_recipe_score", "recipe_id", "score"),
+        Index("ix_similarrecipe_similar_id", "similar_id"),
+    )
+
+    recipe_id: int = Field(primary_key=True, foreign_key="recipe.id")
+    similar_id: int = Field(primary_key=True, foreign_key="recipe.id")
+    score: float
+
+
+class SimilarChange(SQLModel, table=True):
+    """What a similar.refresh job changed, for the other workers to replay."""
+
+    id: int | None = Field(default=None, primary_key=True)
+    # None: the lists were rebuilt from scratch
+    recipe_id: int | None = None
+    # None: the recipe was created, changed or deleted. Otherwise its list
+    # was rewritten and this is the k-th best score, -inf if it is short.
+    floor: float | None = None
+    created_at: float
+
+
+class RecipeSimilarity(BaseModel):
+    id: int
+    name: str
+    slug: str
+    category_id: int | None
+    score: float
+
+
+class RecipeRanking(BaseModel):
+    id: int
+    name: str
+    slug: str
+    category_id: int | None
+    rating: float
+    comments: int
+    score: float
 
 
 class CommentUpdate(BaseModel):
@@ -100,11 +385,119 @@ class UserBase(SQLModel):
 
 
 class User(UserBase, table=True):
+    __table_args__ = (
+        Index("ix_user_email", "email"),
+        Index("ix_user_username", "username"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     refresh_token: str | None = Field(default=None)
     role: str
 
 
+class SlugRedirect(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("kind", "old_slug"),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    kind: str  # "recipe" | "category"
+    old_slug: str
+    target_id: int
+
+
+class Job(SQLModel, table=True):
+    __table_args__ = (Index("ix_job_due", "status", "kind", "run_at"),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    kind: str
+    payload: str  # json format
+    status: str = "pending"  # pending | running | failed
+    attempts: int = 0
+    run_at: float
+    created_at: float
+    # a running job whose lease has run out belongs to a dead worker
+    locked_until: float | None = None
+    last_error: str | None = None
+
+
+class RateLimitState(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    value: float
+    previous: float = 0.0
+    updated_at: float
+
+
+class IdempotencyKey(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("owner", "key"),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    owner: str  # "user:<id>" or "ip:<addr>", keys are only unique per client
+    key: str
+    request_hash: str
+    status: int | None = None  # None while the first request is still running
+    # renewed while it runs; a claim whose lease ran out was left by a crash
+    locked_until: float | None = None
+    headers: str | None = None  # json format
+    body: bytes | None = None
+    expires_at: float = Field(index=True)
+
+
+MAX_BATCH_OPERATIONS = 25
+
+
+class BatchOperation(BaseModel):
+    method: Literal["GET", "POST", "PATCH", "PUT", "DELETE"]
+    path: str
+    body: Any = None
+
+
+class BatchRequest(BaseModel):
+    mode: Literal["atomic", "best_effort"] = "atomic"
+    operations: list[BatchOperation] = Field(
+        min_length=1, max_length=MAX_BATCH_OPERATIONS
+    )
+
+
+class BatchResult(BaseModel):
+    status: int
+    body: Any = None
+
+
+class BatchResponse(BaseModel):
+    committed: bool
+    results: list[BatchResult]
+
+
+MAX_SHOPPING_RECIPES = 500
+
+
+class ShoppingRecipe(BaseModel):
+    recipe_id: int
+    # the recipe's own servings when left out
+    servings: int | None = Field(default=None, ge=1, le=1000)
+
+
+class ShoppingListRequest(BaseModel):
+    recipes: list[ShoppingRecipe] = Field(min_length=1, max_length=MAX_SHOPPING_RECIPES)
+    units: Literal["metric", "imperial"] = "metric"
+
+
+class ShoppingListItem(BaseModel):
+    item: str
+    quantity: float | None = None
+    quantity_max: float | None = None
+    unit: str | None = None
+    notes: list[str] = []
+    recipe_ids: list[int]
+
+
+class ShoppingList(BaseModel):
+    items: list[ShoppingListItem]
+
+
+class Count(BaseModel):
+    count: int
+
+
 class Message(BaseModel):
     message: str
 
@@ -116,12 +509,73 @@ connect_args = {"check_same_thread": False}
 engine = create_engine(sqlite_url, connect_args=connect_args)
 
 
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):  # pyright: ignore
+    # WAL lets readers run alongside the single writer (see writer.py)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+instrument_engine(engine)
+
+
+# one tuple of statements per schema version, run in order on a database
+# whose PRAGMA user_version is below it; databases from before the version
+# was tracked read 0. create_all only adds missing tables, so a column added
+# to an existing table needs a step here; a new table or index doesn't
+MIGRATIONS: tuple[tuple[str, ...], ...] = (
+    # 1: the columns added to recipe and comment since the first release
+    (
+        "ALTER TABLE recipe ADD COLUMN rendered_instructions VARCHAR",
+        # ALTER TABLE only takes constant defaults: rows already there count
+        # as created at the upgrade
+        "ALTER TABLE recipe ADD COLUMN created_at FLOAT NOT NULL DEFAULT 0",
+        "UPDATE recipe SET created_at = strftime('%s', 'now')",
+        "ALTER TABLE recipe ADD COLUMN rating FLOAT NOT NULL DEFAULT 0",
+        "UPDATE recipe SET rating = coalesce("
+        "(SELECT avg(rating) FROM comment WHERE comment.recipe_id = recipe.id), 0)",
+        "ALTER TABLE recipe ADD COLUMN view_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE comment ADD COLUMN created_at FLOAT NOT NULL DEFAULT 0",
+        "UPDATE comment SET created_at = strftime('%s', 'now')",
+    ),
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
 def create_db_and_tables():
-    if os.path.isfile(sqlite_file_name):
+    """Creates or upgrades the schema, and seeds a new database.
+
+    Derived tables start empty on an upgraded database: run
+    `python -m server.duplicates backfill` and `python -m server.similarity
+    build` once; counters catch up at their next reconcile, and leaderboards
+    only score comments written after the upgrade.
+    """
+    with engine.connect() as conn:
+        # one worker at a time; the others find the schema up to date
+        _ = conn.exec_driver_sql("BEGIN IMMEDIATE")
+        seeded = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'recipe'"
+        ).first()
+        # a new database is created at the current version
+        version = SCHEMA_VERSION
+        if seeded:
+            version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        for statements in MIGRATIONS[version:]:
+            for statement in statements:
+                _ = conn.exec_driver_sql(statement)
+        SQLModel.metadata.create_all(conn)
+        # create_all skips the indexes of tables that already existed
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                _ = index.create(conn, checkfirst=True)
+        _ = conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    if seeded:
         return
 
-    SQLModel.metadata.create_all(engine)
-
     seed_sql = Path("seed.sql").read_text()
 
     conn = engine.raw_connection()
@@ -132,9 +586,40 @@ def create_db_and_tables():
         conn.close()
 
 
-def get_session():
-    with Session(engine) as session:
-        yield session
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# set by POST /batch so every sub-request shares one session and transaction
+batch_session: ContextVar[Session | None] = ContextVar("batch_session", default=None)
+
+
+def after_commit(session: Session, fn: Callable[..., Any], *args: Any):
+    """Runs fn(*args) now, or after POST /batch commits the shared session.
+
+    Events, job wakeups and view counts of a batch that rolls back never
+    happen; POST /batch keeps the list in session.info["after_commit"].
+    """
+    pending = session.info.get("after_commit")
+    if pending is None:
+        fn(*args)
+    else:
+        pending.append((fn, args))
+
+
+async def get_session(request: Request):
+    shared = batch_session.get()
+    if shared is not None:
+        yield shared
+        return
+
+    with span("get_session"):
+        session = Session(engine)
+    with session:
+        if request.method in READ_METHODS:
+            yield session
+            return
+        # writes wait here while a POST /batch transaction is open
+        async with write_lock.shared_async():
+            yield session
 
 
 SessionDep = Annotated[Session, Depends(get_session)]
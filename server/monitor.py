@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from types import FrameType
+from typing import Any
+
+from .metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    """Measures event-loop lag and catches the code that blocks the loop.
+
+    A task on the loop ticks every `interval`. A watchdog thread notices
+    when a tick is more than `block_threshold` late, grabs the loop
+    thread's stack at that moment and attributes it to the request being
+    handled. The event is logged once the loop is responsive again.
+    """
+
+    def __init__(
+        self, interval: float = 0.05, block_threshold: float = 0.1, history: int = 20
+    ):
+        self.interval: float = interval
+        self.block_threshold: float = block_threshold
+        self.lag: float = 0.0
+        self.max_lag: float = 0.0
+        self.blocks: deque[dict[str, Any]] = deque(maxlen=history)
+        self._expected_tick: float = 0.0
+        self._captured: dict[str, Any] | None = None
+        self._loop_thread: int | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stop: threading.Event = threading.Event()
+
+    async def start(self):
+        self._loop_thread = threading.get_ident()
+        self._expected_tick = time.perf_counter() + self.interval
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            _ = self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    def recent_blocks(self) -> list[dict[str, Any]]:
+        return list(self.blocks)
+
+    async def _tick(self):
+        while True:
+            self._expected_tick = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - self._expected_tick)
+            self._record(lag)
+
+    def _record(self, lag: float):
+        # smoothed so a single slow tick does not look like sustained load
+        self.lag = 0.7 * self.lag + 0.3 * lag
+        self.max_lag = max(self.max_lag, lag)
+        metrics.set("event_loop_lag_seconds", self.lag)
+        metrics.set("event_loop_lag_max_seconds", self.max_lag)
+
+        captured, self._captured = self._captured, None
+        if captured is None:
+            return
+
+        captured["blocked_seconds"] = round(lag + self.interval, 4)
+        self.blocks.append(captured)
+        metrics.inc("loop_blocked")
+        metrics.inc(f"loop_blocked.{captured['route']}")
+        logger.warning(
+            "Event loop blocked for %.0fms in %s\n%s",
+            captured["blocked_seconds"] * 1000,
+            captured["route"],
+            "".join(captured["stack"]),
+        )
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            late = time.perf_counter() - self._expected_tick
+            if late < self.block_threshold or self._captured is not None:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)  # pyright: ignore
+            if frame is None:
+                continue
+            self._captured = {
+                "route": route_of(frame),
+                "stack": traceback.format_stack(frame),
+                "at": time.time(),
+            }
+
+
+def route_of(frame: FrameType | None) -> str:
+    # the innermost ASGI frame with an http scope tells us whose request it is
+    while frame is not None:
+        scope = frame.f_locals.get("scope")
+        if isinstance(scope, dict) and scope.get("type") == "http":
+            route = scope.get("route")
+            path = getattr(route, "path", None) or scope.get("path", "?")
+            return f"{scope.get('method', '?')} {path}"
+        frame = frame.f_back
+    return "unknown"
+
+
+monitor = LoopMonitor()
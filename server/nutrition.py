@@ -0,0 +1,166 @@
+"""Per-serving nutrition of recipes and its per-category statistics.
+
+The statistics read the whole catalogue, so GET /categories/nutrition
+serves the copy stored by a "nutrition.stats" job. Writes that change
+calories, category or nutrition schedule that job STATS_DELAY seconds
+ahead, unless one is already waiting, so a burst of writes shares a pass.
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any
+
+import numpy as np
+from sqlalchemy import Engine, delete, insert
+from sqlmodel import Session, select
+
+from .jobs import jobs
+from .metrics import metrics
+from .models import (
+    NUTRIENTS,
+    CategoryNutritionStats,
+    Job,
+    Nutrition,
+    NutritionBase,
+    Recipe,
+)
+
+STATS_BATCH_SIZE = 5000
+STATS_JOB = "nutrition.stats"
+STATS_DELAY = float(os.environ.get("NUTRITION_STATS_DELAY", "30"))
+# calories lives on recipe itself but is summarised with the rest
+STAT_COLUMNS = ("calories", *NUTRIENTS)
+
+
+def save_nutrition(
+    session: Session, recipe_id: int, nutrition: NutritionBase, partial: bool = False
+):
+    """Stores nutrition; partial (a PATCH) keeps the values it doesn't set."""
+    row = session.get(Nutrition, recipe_id) or Nutrition(recipe_id=recipe_id)
+    _ = row.sqlmodel_update(nutrition.model_dump(exclude_unset=partial))
+    session.add(row)
+
+
+def read_nutrition(session: Session, recipe_id: int) -> dict[str, Any] | None:
+    row = session.get(Nutrition, recipe_id)
+    return None if row is None else NutritionBase.model_validate(row).model_dump()
+
+
+def category_stats(session: Session) -> list[dict[str, Any]]:
+    """Count, min, max and mean of every nutrient, for every category.
+
+    One pass over the catalogue: values go into a float matrix (NaN where
+    unknown) and each category's rows are reduced with ufunc.reduceat.
+    """
+    result = session.exec(
+        select(
+            Recipe.category_id,
+            Recipe.calories,
+            *(getattr(Nutrition, n) for n in NUTRIENTS),
+        )
+        .outerjoin(Nutrition, Nutrition.recipe_id == Recipe.id)  # pyright: ignore
+        .where(Recipe.category_id.is_not(None))  # pyright: ignore
+        .execution_options(yield_per=STATS_BATCH_SIZE)
+    )
+    chunks = [
+        np.array(rows, dtype=np.float64).reshape(-1, len(STAT_COLUMNS) + 1)
+        for rows in result.partitions()
+    ]
+    if not chunks:
+        return []
+    # None -> NaN on the way in
+    table = np.concatenate(chunks)
+    table = table[np.argsort(table[:, 0], kind="stable")]
+    categories, starts, sizes = np.unique(
+        table[:, 0], return_index=True, return_counts=True
+    )
+    values = table[:, 1:]
+    known = ~np.isnan(values)
+
+    counts = np.add.reduceat(known, starts, axis=0)
+    sums = np.add.reduceat(np.where(known, values, 0), starts, axis=0)
+    lows = np.fmin.reduceat(values, starts, axis=0)
+    highs = np.fmax.reduceat(values, starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+
+    def stat(x: float) -> float | None:
+        return None if np.isnan(x) else float(x)
+
+    return [
+        {
+            "category_id": int(category_id),
+            "recipes": int(size),
+            "nutrients": {
+                name: {
+                    "count": int(counts[i, j]),
+                    "min": stat(lows[i, j]),
+                    "max": stat(highs[i, j]),
+                    "mean": stat(means[i, j]),
+                }
+                for j, name in enumerate(STAT_COLUMNS)
+            },
+        }
+        for i, (category_id, size) in enumerate(zip(categories, sizes))
+    ]
+
+
+_STATS = CategoryNutritionStats.__table__  # pyright: ignore
+
+
+def schedule_stats(session: Session, delay: float = STATS_DELAY):
+    """Enqueues a recompute of the stats, unless one is waiting already."""
+    waiting = session.exec(
+        select(Job.id).where(Job.status == "pending", Job.kind == STATS_JOB).limit(1)
+    ).first()
+    if waiting is None:
+        _ = jobs.enqueue(session, STATS_JOB, delay=delay)
+
+
+def store_stats(engine: Engine) -> int:
+    """Recomputes the stats GET /categories/nutrition serves, in one swap."""
+    with Session(engine) as session:
+        stats = category_stats(session)
+    now = time.time()
+    rows = [
+        {
+            "category_id": s["category_id"],
+            "recipes": s["recipes"],
+            "nutrients": json.dumps(s["nutrients"]),
+            "computed_at": now,
+        }
+        for s in stats
+    ]
+    with engine.connect() as conn:
+        _ = conn.exec_driver_sql("BEGIN IMMEDIATE")
+        _ = conn.execute(delete(_STATS))
+        if rows:
+            _ = conn.execute(insert(_STATS), rows)
+        conn.commit()
+    return len(rows)
+
+
+@jobs.handler(STATS_JOB)
+async def store_stats_job(
+    payload: dict[str, Any],
+):  # pyright: ignore[reportUnusedParameter]
+    start = time.perf_counter()
+    _ = await asyncio.to_thread(store_stats, jobs.engine)
+    metrics.observe("nutrition_stats_seconds", time.perf_counter() - start)
+
+
+def read_stats(session: Session) -> list[dict[str, Any]]:
+    return [
+        {
+            "category_id": row.category_id,
+            "recipes": row.recipes,
+            "nutrients": json.loads(row.nutrients),
+        }
+        for row in session.exec(
+            select(CategoryNutritionStats).order_by(
+                CategoryNutritionStats.category_id  # pyright: ignore
+            )
+        )
+    ]
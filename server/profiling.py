@@ -0,0 +1,227 @@
+import asyncio
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+
+import jwt
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .routes.auth import decode_jwt
+
+
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", "profiles"))
+# 0 disables the continuous profiler
+PROFILE_CONTINUOUS_MINUTES = float(os.environ.get("PROFILE_CONTINUOUS_MINUTES", "0"))
+
+
+def collapse(frame: FrameType | None) -> str:
+    stack: list[str] = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def write_collapsed(path: Path, samples: Counter[str]):
+    # "stack;frames count" lines, the format flamegraph.pl and speedscope read
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        for stack, count in samples.most_common():
+            _ = f.write(f"{stack} {count}\n")
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id: int = thread_id
+        self.interval: float = interval
+        self.samples: Counter[str] = Counter()
+        self._lock: threading.Lock = threading.Lock()
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def take(self) -> Counter[str]:
+        with self._lock:
+            samples, self.samples = self.samples, Counter()
+        return samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pyright: ignore
+            if frame is None:
+                continue
+            stack = collapse(frame)
+            with self._lock:
+                self.samples[stack] += 1
+
+
+def is_admin(scope: Scope) -> bool:
+    token = Request(scope).cookies.get("access_token")
+    if not token:
+        return False
+    try:
+        payload = decode_jwt(token)
+    except jwt.PyJWTError:
+        return False
+    # tokens carry their own "expires" claim, checked like get_current_user does;
+    # an expired one can only be rotated by a route, never honoured here
+    expires = payload.get("expires")
+    if not isinstance(expires, (int, float)) or expires < time.time():
+        return False
+    return payload.get("role") == "ADMIN"
+
+
+def requested_profiler(scope: Scope) -> str | None:
+    value = Request(scope).query_params.get("profile")
+    for name, header in scope.get("headers", ()):
+        if name == b"x-profile":
+            value = header.decode()
+    if value is None or value in ("0", "false"):
+        return None
+    return "cprofile" if value == "cprofile" else "sample"
+
+
+class ProfilingMiddleware:
+    """Profiles a single request when an admin asks for it.
+
+    `X-Profile: 1` (or `?profile=1`) samples the event-loop thread every
+    millisecond and writes a collapsed-stack file, `cprofile` runs the
+    deterministic profiler and writes a pstats dump. The file name is
+    returned in the `X-Profile-File` header.
+
+    Both profilers see everything on the event-loop thread, so one request
+    is profiled at a time; a request that asks while another is being
+    profiled is served without a profile.
+    """
+
+    def __init__(
+        self, app: ASGIApp, directory: Path = PROFILE_DIR, interval: float = 0.001
+    ):
+        self.app: ASGIApp = app
+        self.directory: Path = directory
+        self.interval: float = interval
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profiler = requested_profiler(scope)
+        if profiler is None or not is_admin(scope) or self._lock.locked():
+            await self.app(scope, receive, send)
+            return
+
+        async with self._lock:
+            await self._profile(profiler, scope, receive, send)
+
+    async def _profile(self, profiler: str, scope: Scope, receive: Receive, send: Send):
+        slug = re.sub(r"[^\w]+", "-", scope["path"]).strip("-") or "root"
+        suffix = "prof" if profiler == "cprofile" else "collapsed"
+        # workers may share the directory and a second holds many requests
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        name = f"{stamp}-{scope['method']}-{slug}.{suffix}"
+
+        async def send_with_header(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-profile-file", name.encode()),
+                ]
+            await send(message)
+
+        if profiler == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await self.app(scope, receive, send_with_header)
+            finally:
+                profile.disable()
+                self.directory.mkdir(parents=True, exist_ok=True)
+                await asyncio.to_thread(profile.dump_stats, self.directory / name)
+            return
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            await asyncio.to_thread(sampler.stop)
+            await asyncio.to_thread(
+                write_collapsed, self.directory / name, sampler.take()
+            )
+
+
+class ContinuousProfiler:
+    """Low-rate sampling of the event-loop thread, flushed every few minutes."""
+
+    def __init__(
+        self,
+        minutes: float = PROFILE_CONTINUOUS_MINUTES,
+        directory: Path = PROFILE_DIR,
+        interval: float = 0.01,
+    ):
+        self.minutes: float = minutes
+        self.directory: Path = directory
+        self.interval: float = interval
+        self._sampler: StackSampler | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self):
+        if self.minutes <= 0:
+            return
+        self._sampler = StackSampler(threading.get_ident(), self.interval)
+        self._sampler.start()
+        self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            _ = self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._sampler is not None:
+            await asyncio.to_thread(self._sampler.stop)
+            await self.flush()
+            self._sampler = None
+
+    async def flush(self) -> Path | None:
+        if self._sampler is None:
+            return None
+        samples = self._sampler.take()
+        if not samples:
+            return None
+        path = self.directory / f"continuous-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+        await asyncio.to_thread(write_collapsed, path, samples)
+        return path
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.minutes * 60)
+            _ = await self.flush()
+
+
+continuous_profiler = ContinuousProfiler()
@@ -0,0 +1,130 @@
+import asyncio
+import json
+from collections import deque
+from collections.abc import AsyncIterator, Hashable
+from typing import Any
+
+from .metrics import metrics
+
+
+QUEUE_SIZE = 32
+HEARTBEAT_SECONDS = 15.0
+
+
+def _wake(waiter: asyncio.Future[None]):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Subscription:
+    # thousands of these sit idle per worker: slots, and the buffer and waiter
+    # only exist while there is something to hold
+    __slots__ = ("topic", "dropped", "_maxsize", "_events", "_waiter")
+
+    def __init__(self, topic: Hashable, maxsize: int):
+        self.topic: Hashable = topic
+        self.dropped: int = 0
+        self._maxsize: int = maxsize
+        self._events: deque[tuple[str, Any]] | None = None
+        self._waiter: asyncio.Future[None] | None = None
+
+    def push(self, event: str, data: Any):
+        if self._events is None:
+            self._events = deque(maxlen=self._maxsize)
+        # a slow reader loses the oldest events instead of blocking publishers
+        elif len(self._events) == self._maxsize:
+            self.dropped += 1
+        self._events.append((event, data))
+
+        if self._waiter is not None:
+            _wake(self._waiter)
+
+    async def get(self, timeout: float) -> list[tuple[str, Any]] | None:
+        if not self._events:
+            # a bare future and timer handle instead of wait_for(), which
+            # costs an extra future and callbacks per idle connection
+            loop = asyncio.get_running_loop()
+            waiter = self._waiter = loop.create_future()
+            timer = loop.call_later(timeout, _wake, waiter)
+            try:
+                await waiter
+            finally:
+                _ = timer.cancel()
+                self._waiter = None
+            if not self._events:
+                return None
+
+        events = list(self._events or ())
+        self._events = None
+        return events
+
+
+class Broker:
+    """In-process fan-out. Publish from the event loop thread only."""
+
+    def __init__(self, queue_size: int = QUEUE_SIZE):
+        self.queue_size: int = queue_size
+        self._topics: dict[Hashable, set[Subscription]] = {}
+        self._count: int = 0
+
+    def subscribe(self, topic: Hashable) -> Subscription:
+        sub = Subscription(topic, self.queue_size)
+        self._topics.setdefault(topic, set()).add(sub)
+        self._count += 1
+        metrics.set("pubsub_subscribers", self._count)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        subs = self._topics.get(sub.topic)
+        if subs is None or sub not in subs:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self._topics[sub.topic]
+        self._count -= 1
+        metrics.set("pubsub_subscribers", self._count)
+
+    def publish(self, topic: Hashable, event: str, data: Any) -> int:
+        subs = self._topics.get(topic, ())
+        for sub in subs:
+            sub.push(event, data)
+        return len(subs)
+
+    def subscriber_count(self, topic: Hashable | None = None) -> int:
+        if topic is not None:
+            return len(self._topics.get(topic, ()))
+        return self._count
+
+
+def format_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def event_stream(
+    broker: Broker, topic: Hashable, heartbeat: float = HEARTBEAT_SECONDS
+) -> AsyncIterator[str]:
+    # subscribed only once the body is iterated: a response that is never
+    # sent (the client left, a middleware replaced it) never reaches the
+    # finally block, so it must not hold a subscription either. The response
+    # task is cancelled when the client disconnects; the finally block is
+    # what drops the subscription.
+    sub = broker.subscribe(topic)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            events = await sub.get(heartbeat)
+            if events is None:
+                yield ": keep-alive\n\n"
+                continue
+
+            if sub.dropped:
+                # tell the client to refetch over REST, it missed something
+                yield format_event("overflow", {"dropped": sub.dropped})
+                sub.dropped = 0
+            for event, data in events:
+                yield format_event(event, data)
+    finally:
+        broker.unsubscribe(sub)
+
+
+comment_events = Broker()
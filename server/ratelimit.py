@@ -0,0 +1,291 @@
+import asyncio
+import math
+import os
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any, Literal
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import Engine
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .metrics import metrics
+from .models import batch_session
+from .monitor import LoopMonitor, monitor
+from .writer import write_lock
+
+
+State = tuple[float, float, float]  # value, previous, updated_at
+KeyFunc = Callable[[Request], Awaitable[str] | str]
+
+
+class Decision:
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset: float):
+        self.allowed: bool = allowed
+        self.limit: int = limit
+        self.remaining: int = remaining
+        self.reset: float = reset
+
+    def headers(self) -> dict[str, str]:
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(math.ceil(self.reset)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(math.ceil(self.reset))
+        return headers
+
+
+class Limit:
+    """`limit` requests per `period` seconds.
+
+    "bucket" is a token bucket (bursts of up to `limit`, refilled evenly),
+    "window" a sliding window estimated from the current and previous
+    fixed windows.
+    """
+
+    def __init__(
+        self, algorithm: Literal["bucket", "window"], limit: int, period: float
+    ):
+        self.algorithm: Literal["bucket", "window"] = algorithm
+        self.limit: int = limit
+        self.period: float = period
+
+    def apply(self, state: State | None, now: float) -> tuple[State, Decision]:
+        if self.algorithm == "bucket":
+            return self._bucket(state, now)
+        return self._window(state, now)
+
+    def _bucket(self, state: State | None, now: float) -> tuple[State, Decision]:
+        rate = self.limit / self.period
+        tokens = self.limit if state is None else state[0]
+        if state is not None:
+            tokens = min(self.limit, tokens + (now - state[2]) * rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+            reset = (self.limit - tokens) / rate
+        else:
+            reset = (1 - tokens) / rate
+        return (tokens, 0.0, now), Decision(allowed, self.limit, int(tokens), reset)
+
+    def _window(self, state: State | None, now: float) -> tuple[State, Decision]:
+        start = now - now % self.period
+        current, previous = 0.0, 0.0
+        if state is not None:
+            if state[2] == start:
+                current, previous = state[0], state[1]
+            elif state[2] == start - self.period:
+                previous = state[0]
+
+        weight = 1 - (now - start) / self.period
+        estimate = previous * weight + current
+        allowed = estimate + 1 <= self.limit
+        if allowed:
+            current += 1
+            estimate += 1
+        remaining = max(0, int(self.limit - estimate))
+        reset = start + self.period - now
+        return (current, previous, start), Decision(
+            allowed, self.limit, remaining, reset
+        )
+
+
+# per-route limits, keyed by the name passed to rate_limit()
+LIMITS: dict[str, Limit] = {
+    "auth.register": Limit("window", 5, 3600),
+    "auth.login": Limit("bucket", 10, 60),
+    "comments.create": Limit("bucket", 20, 60),
+}
+
+
+class MemoryStore:
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys: int = max_keys
+        self._states: dict[str, State] = {}
+
+    async def hit(self, key: str, limit: Limit, now: float) -> Decision:
+        state, decision = limit.apply(self._states.get(key), now)
+        self._states[key] = state
+        if len(self._states) > self.max_keys:
+            self._prune(now)
+        return decision
+
+    def _prune(self, now: float):
+        # anything idle for an hour has refilled / slid out of its window
+        stale = [k for k, s in self._states.items() if now - s[2] > 3600]
+        for key in stale:
+            del self._states[key]
+
+
+class SqliteStore:
+    """Shares limiter state between worker processes through the database."""
+
+    def __init__(self, engine: Engine):
+        self.engine: Engine = engine
+
+    async def hit(self, key: str, limit: Limit, now: float) -> Decision:
+        return await asyncio.to_thread(self._hit, key, limit, now)
+
+    def _hit(self, key: str, limit: Limit, now: float) -> Decision:
+        session = batch_session.get()
+        if session is not None:
+            # a sub-request of POST /batch, which holds the write lock and a
+            # transaction on its session: the hit joins that transaction
+            cursor = session.connection().connection.cursor()
+            return self._apply(cursor, key, limit, now)
+
+        # a batch keeps its transaction open, so wait for it here rather
+        # than on SQLite's lock
+        with write_lock.shared():
+            conn = self.engine.raw_connection()
+            try:
+                cursor = conn.cursor()
+                _ = cursor.execute("BEGIN IMMEDIATE")
+                decision = self._apply(cursor, key, limit, now)
+                conn.commit()
+            finally:
+                conn.close()
+        return decision
+
+    @staticmethod
+    def _apply(cursor: Any, key: str, limit: Limit, now: float) -> Decision:
+        row = cursor.execute(
+            "SELECT value, previous, updated_at FROM ratelimitstate WHERE key = ?",
+            (key,),
+        ).fetchone()
+        state, decision = limit.apply(tuple(row) if row else None, now)
+        _ = cursor.execute(
+            "INSERT OR REPLACE INTO ratelimitstate "
+            "(key, value, previous, updated_at) VALUES (?, ?, ?, ?)",
+            (key, *state),
+        )
+        return decision
+
+
+class RateLimiter:
+    def __init__(self, store: MemoryStore | SqliteStore | None = None):
+        self.store: MemoryStore | SqliteStore = store or MemoryStore()
+
+    async def hit(self, name: str, key: str) -> Decision:
+        return await self.store.hit(f"{name}:{key}", LIMITS[name], time.time())
+
+
+def create_limiter(engine: Engine) -> RateLimiter:
+    if os.environ.get("RATE_LIMIT_STORE") == "sqlite":
+        return RateLimiter(SqliteStore(engine))
+    return RateLimiter()
+
+
+def get_limiter(request: Request) -> RateLimiter:
+    # state lives on the app so separate apps (and tests) never share buckets
+    limiter = getattr(request.app.state, "limiter", None)
+    if limiter is None:
+        limiter = request.app.state.limiter = RateLimiter()
+    return limiter
+
+
+def by_ip(request: Request) -> str:
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+class RateLimited(HTTPException):
+    """Raised by rate_limit(); rendered by rate_limited_handler."""
+
+    def __init__(self, headers: dict[str, str]):
+        super().__init__(status_code=429, detail="Too many requests", headers=headers)
+
+
+async def rate_limited_handler(request: Request, exc: Exception) -> JSONResponse:
+    assert isinstance(exc, RateLimited)
+    return JSONResponse(
+        status_code=429, content={"message": exc.detail}, headers=exc.headers
+    )
+
+
+def install_rate_limit_handler(app: FastAPI):
+    # dependencies can only raise, so the {"message"} body comes from here
+    app.add_exception_handler(RateLimited, rate_limited_handler)
+
+
+def rate_limit(name: str, key: KeyFunc = by_ip):
+    async def dependency(request: Request, response: Response):
+        client = key(request)
+        if not isinstance(client, str):
+            client = await client
+
+        decision = await get_limiter(request).hit(name, client)
+        headers = decision.headers()
+        if not decision.allowed:
+            metrics.inc(f"ratelimit_rejected.{name}")
+            raise RateLimited(headers)
+        response.headers.update(headers)
+
+    return dependency
+
+
+class LoadShedder:
+    def __init__(
+        self,
+        loop_monitor: LoopMonitor = monitor,
+        max_lag: float = 0.2,
+        max_queue_time: float = 1.0,
+    ):
+        self.monitor: LoopMonitor = loop_monitor
+        self.max_lag: float = max_lag
+        self.max_queue_time: float = max_queue_time
+
+    def should_shed(self, scope: Scope) -> bool:
+        if self.monitor.lag > self.max_lag:
+            return True
+        queue_time = request_queue_time(scope)
+        return queue_time is not None and queue_time > self.max_queue_time
+
+
+def request_queue_time(scope: Scope) -> float | None:
+    # set by the reverse proxy when it accepted the request, e.g. nginx
+    # `proxy_set_header X-Request-Start "t=${msec}";`
+    for name, value in scope.get("headers", ()):
+        if name == b"x-request-start":
+            try:
+                started = float(value.decode().removeprefix("t="))
+            except ValueError:
+                return None
+            if started > 1e12:  # sent in milliseconds
+                started /= 1000
+            return time.time() - started
+    return None
+
+
+class LoadSheddingMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        shedder: LoadShedder,
+        exempt: tuple[str, ...] = ("/metrics",),
+    ):
+        self.app: ASGIApp = app
+        self.shedder: LoadShedder = shedder
+        self.exempt: tuple[str, ...] = exempt
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] == "http"
+            and not scope["path"].startswith(self.exempt)
+            and self.shedder.should_shed(scope)
+        ):
+            metrics.inc("requests_shed")
+            response = JSONResponse(
+                status_code=503,
+                content={"message": "Server is overloaded, try again later"},
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+shedder = LoadShedder()
@@ -0,0 +1,45 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from markdown_it import MarkdownIt
+
+from .metrics import metrics
+
+
+# raw HTML in the source is escaped and unsafe link schemes (javascript:, ...)
+# are left unlinked, so the output can be inserted into the page as is
+_md = MarkdownIt("commonmark", {"html": False})
+
+CACHE_SIZE = 1024
+
+_cache: OrderedDict[str, str] = OrderedDict()
+_lock = threading.Lock()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("UTF-8")).hexdigest()
+
+
+def render_markdown(text: str) -> str:
+    key = content_hash(text)
+    with _lock:
+        html = _cache.get(key)
+        if html is not None:
+            _cache.move_to_end(key)
+            metrics.inc("markdown_cache_hits")
+            return html
+
+    with metrics.timer("markdown_render"):
+        html = _md.render(text)
+
+    with _lock:
+        _cache[key] = html
+        if len(_cache) > CACHE_SIZE:
+            _ = _cache.popitem(last=False)
+    return html
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
@@ -2,6 +2,8 @@ SECRET = "243a4c253de2af5447ae4abfe707dbb5a4b3080a59bcd8dd8ec459f493dfadad"
 ALGORITHM = "HS256"
 
 import time
+from collections.abc import Callable
+from contextvars import ContextVar
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import JSONResponse
 from fastapi.security import APIKeyCookie
@@ -9,9 +11,13 @@ import jwt
 import secrets
 
 import bcrypt
-from sqlmodel import select
+from sqlalchemy import or_
+from sqlmodel import Session, select
 
 from ..models import Message, SessionDep, User, UserBase, UserLoginSchema
+from ..ratelimit import by_ip, rate_limit
+from ..tracing import span
+from ..writer import write
 
 
 import re
@@ -42,14 +48,44 @@ def decode_jwt(token: str):
     return jwt.decode(token, SECRET, algorithms=[ALGORITHM])
 
 
+def store_refresh_token(user_id: int, refresh: str) -> Callable[[Session], User]:
+    def rotate(s: Session) -> User:
+        user = s.get(User, user_id)
+        user.refresh_token = refresh
+        s.add(user)
+        return user
+
+    return rotate
+
+
+# POST /batch authenticates once and hands the result to its sub-requests
+batch_user: ContextVar[tuple[User, str] | None] = ContextVar("batch_user", default=None)
+
+
+def by_user(request: Request) -> str:
+    resolved = batch_user.get()
+    if resolved is not None:
+        return f"user:{resolved[0].id}"
+
+    token = request.cookies.get("access_token")
+    if token:
+        try:
+            return f"user:{decode_jwt(token)['sub']}"
+        except jwt.PyJWTError:
+            pass
+    return by_ip(request)
+
+
 router = APIRouter()
 
 
 @router.post(
     "/register",
+    dependencies=[Depends(rate_limit("auth.register"))],
     responses={
         409: {"model": Message, "description": "Conflict Error"},
         400: {"model": Message, "description": "Bad Request Error"},
+        429: {"model": Message, "description": "Too Many Requests"},
     },
 )
 async def create_user(user: UserBase, session: SessionDep, response: Response):
@@ -60,7 +96,9 @@ async def create_user(user: UserBase, session: SessionDep, response: Response):
         )
 
     existing_user = session.exec(
-        select(User).where(User.email == user.email or User.username == user.username)
+        select(User).where(
+            or_(User.email == user.email, User.username == user.username)
+        )
     ).first()
 
     if existing_user:
@@ -69,22 +107,24 @@ async def create_user(user: UserBase, session: SessionDep, response: Response):
             content={"message": "User with this email or username already exists"},
         )
 
-    s = bcrypt.gensalt()
-    h = bcrypt.hashpw(bytes(user.password, "UTF-8"), s)
-
-    user_in_db = User(
-        username=user.username,
-        email=user.email,
-        password=h.decode("UTF-8"),
-        role="USER",
-    )
-    session.add(user_in_db)
-    session.commit()
-    session.refresh(user_in_db)
-    token, refresh = sign_jwt(user_in_db.id, user_in_db.role)
-    user_in_db.refresh_token = refresh
-    session.commit()
-    session.refresh(user_in_db)
+    with span("bcrypt.hashpw"):
+        s = bcrypt.gensalt()
+        h = bcrypt.hashpw(bytes(user.password, "UTF-8"), s)
+
+    def insert(s: Session) -> tuple[str, str]:
+        user_in_db = User(
+            username=user.username,
+            email=user.email,
+            password=h.decode("UTF-8"),
+            role="USER",
+        )
+        s.add(user_in_db)
+        s.flush()
+        token, refresh = sign_jwt(user_in_db.id, user_in_db.role)
+        user_in_db.refresh_token = refresh
+        return token, refresh
+
+    token, refresh = await write(session, insert)
     response.set_cookie(key="access_token", value=token)
     response.set_cookie(key="refresh_token", value=refresh)
     return {"message": "User created successfully"}
@@ -92,8 +132,10 @@ async def create_user(user: UserBase, session: SessionDep, response: Response):
 
 @router.post(
     "/login",
+    dependencies=[Depends(rate_limit("auth.login"))],
     responses={
         401: {"model": Message, "description": "Authorization Error"},
+        429: {"model": Message, "description": "Too Many Requests"},
     },
 )
 async def login_user(user: UserLoginSchema, session: SessionDep, response: Response):
@@ -104,15 +146,15 @@ async def login_user(user: UserLoginSchema, session: SessionDep, response: Respo
             content={"message": "Incorrect email or password"},
         )
 
-    if bcrypt.checkpw(
-        bytes(user.password, "UTF-8"), bytes(existing_user.password, "UTF-8")
-    ):
+    with span("bcrypt.checkpw"):
+        valid = bcrypt.checkpw(
+            bytes(user.password, "UTF-8"), bytes(existing_user.password, "UTF-8")
+        )
+    if valid:
         token, refresh = sign_jwt(existing_user.id, existing_user.role)
         response.set_cookie(key="access_token", value=token)
         response.set_cookie(key="refresh_token", value=refresh)
-        existing_user.refresh_token = refresh
-        session.commit()
-        session.refresh(existing_user)
+        _ = await write(session, store_refresh_token(existing_user.id, refresh))
         return {"message": "Logged in successfully"}
     else:
         return JSONResponse(
@@ -127,37 +169,40 @@ async def get_current_user(
     api_key: str = Depends(access_token_cookie),
     refresh_token: str = Depends(refresh_token_cookie),
 ) -> tuple[User, str] | JSONResponse:
-    access = api_key
-    if not access:
-        raise HTTPException(
-            status_code=401,
-            detail="Missing authorization tokens",
-        )
+    resolved = batch_user.get()
+    if resolved is not None:
+        return resolved
 
-    payload = decode_jwt(access)
-    user_id = payload["sub"]
-    role = payload["role"]
-    user = session.get(User, user_id)
-    if not user:
-        raise HTTPException(
-            status_code=401,
-            detail="Failed to login",
-        )
+    with span("get_current_user"):
+        access = api_key
+        if not access:
+            raise HTTPException(
+                status_code=401,
+                detail="Missing authorization tokens",
+            )
 
-    # use refresh token & rotate
-    if payload["expires"] < time.time():
-        if user.refresh_token == refresh_token:
-            token, refresh = sign_jwt(user.id, user.role)
-            response.set_cookie(key="access_token", value=token)
-            response.set_cookie(key="refresh_token", value=refresh)
-            user.refresh_token = refresh
-            session.commit()
-            session.refresh(user)
-        else:
+        payload = decode_jwt(access)
+        user_id = payload["sub"]
+        role = payload["role"]
+        user = session.get(User, user_id)
+        if not user:
             raise HTTPException(
                 status_code=401,
-                detail="Invalid refresh token",
+                detail="Failed to login",
             )
 
-    # Fetch from DB
-    return user, role
+        # use refresh token & rotate
+        if payload["expires"] < time.time():
+            if user.refresh_token == refresh_token:
+                token, refresh = sign_jwt(user.id, user.role)
+                response.set_cookie(key="access_token", value=token)
+                response.set_cookie(key="refresh_token", value=refresh)
+                user = await write(session, store_refresh_token(user.id, refresh))
+            else:
+                raise HTTPException(
+                    status_code=401,
+                    detail="Invalid refresh token",
+                )
+
+        # Fetch from DB
+        return user, role
@@ -0,0 +1,159 @@
+import json
+from collections.abc import Callable
+from typing import Any
+from urllib.parse import urlsplit
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import JSONResponse
+from sqlmodel import Session
+from starlette.types import Message as ASGIMessage
+
+from .auth import batch_user, get_current_user
+
+from ..metrics import metrics
+from ..models import (
+    BatchOperation,
+    BatchRequest,
+    BatchResponse,
+    BatchResult,
+    Message,
+    SessionDep,
+    User,
+    batch_session,
+)
+from ..writer import write_lock
+
+
+router = APIRouter()
+
+
+async def dispatch(request: Request, op: BatchOperation) -> BatchResult:
+    url = urlsplit(op.path)
+    body = b"" if op.body is None else json.dumps(op.body).encode()
+    headers = [(b"content-type", b"application/json")]
+    headers += [(k, v) for k, v in request.scope["headers"] if k == b"cookie"]
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": op.method,
+        "scheme": request.url.scheme,
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "root_path": request.scope.get("root_path", ""),
+        "headers": headers,
+        "client": request.scope.get("client"),
+        "server": request.scope.get("server"),
+    }
+
+    sent = False
+
+    async def receive() -> ASGIMessage:
+        nonlocal sent
+        if sent:
+            # lets streaming responses finish instead of waiting forever
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    status = 500
+    content_type = b""
+    chunks: list[bytes] = []
+
+    async def send(message: ASGIMessage):
+        nonlocal status, content_type
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await request.app(scope, receive, send)
+    except Exception:
+        # ServerErrorMiddleware re-raises after it has sent the 500
+        return BatchResult(status=500, body={"message": "Internal Server Error"})
+
+    raw = b"".join(chunks)
+    if not raw:
+        return BatchResult(status=status)
+    if content_type.startswith(b"application/json"):
+        return BatchResult(status=status, body=json.loads(raw))
+    return BatchResult(status=status, body=raw.decode(errors="replace"))
+
+
+@router.post(
+    "/",
+    response_model=BatchResponse,
+    responses={
+        400: {"model": Message, "description": "Bad Request Error"},
+    },
+)
+async def run_batch(
+    batch: BatchRequest,
+    request: Request,
+    session: SessionDep,
+    curr: tuple[User, str] = Depends(get_current_user),
+):
+    for op in batch.operations:
+        path = urlsplit(op.path).path
+        if not path.startswith("/") or path.rstrip("/") == request.scope["path"].rstrip(
+            "/"
+        ):
+            return JSONResponse(
+                status_code=400,
+                content={"message": f"Invalid batch operation path: {op.path}"},
+            )
+
+    # other writers wait for the batch instead of running into its open
+    # transaction on SQLite's lock
+    async with write_lock.exclusive():
+        with session.get_bind().connect() as conn:
+            # pysqlite only emits BEGIN before DML, which would let every
+            # SAVEPOINT release commit on its own; open the transaction ourselves
+            _ = conn.exec_driver_sql("BEGIN")
+            shared = Session(
+                bind=conn,
+                join_transaction_mode="create_savepoint",
+                expire_on_commit=False,
+            )
+            shared.info["batch"] = True
+            # side effects wait for the commit; see models.after_commit
+            pending: list[tuple[Callable[..., Any], tuple[Any, ...]]] = []
+            shared.info["after_commit"] = pending
+            session_token = batch_session.set(shared)
+            user_token = batch_user.set(curr)
+            results: list[BatchResult] = []
+            try:
+                for op in batch.operations:
+                    mark = len(pending)
+                    result = await dispatch(request, op)
+                    results.append(result)
+                    if result.status < 400:
+                        continue
+                    # drop whatever the failed operation left uncommitted
+                    shared.rollback()
+                    del pending[mark:]
+                    if batch.mode == "atomic":
+                        break
+            finally:
+                batch_user.reset(user_token)
+                batch_session.reset(session_token)
+                shared.close()
+
+            failed = any(r.status >= 400 for r in results)
+            committed = batch.mode == "best_effort" or not failed
+            if committed:
+                conn.commit()
+                for fn, args in pending:
+                    fn(*args)
+            else:
+                conn.rollback()
+                skipped = len(batch.operations) - len(results)
+                results += [
+                    BatchResult(status=424, body={"message": "Not executed"})
+                ] * skipped
+
+    metrics.inc("batch_operations", len(results))
+    return BatchResponse(committed=committed, results=results)
@@ -1,23 +1,33 @@
-from typing import Annotated
-from fastapi import APIRouter, Depends, Query, Response
-from fastapi.responses import JSONResponse
+from typing import Annotated, Literal
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse, RedirectResponse
 from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
 
 from .auth import get_current_user
 
+from ..counters import CATEGORIES, bump, category_recipes, read_count
 from ..models import (
     Category,
     CategoryBase,
+    CategoryNutrition,
     CategoryPublic,
     CategoryUpdate,
+    Count,
     Message,
+    RECIPE_VIEWS,
     Recipe,
-    RecipePublic,
+    RecipePartial,
     SessionDep,
     User,
 )
-from ..utils import slugify
+from ..nutrition import read_stats
+from ..utils import (
+    allocate_slug,
+    parse_fields,
+    record_slug_redirect,
+    resolve_slug_redirect,
+)
 
 
 router = APIRouter()
@@ -47,7 +57,7 @@ async def create_category(
         )
 
     try:
-        slug = slugify(cat.name)
+        slug = allocate_slug(session, Category, cat.name)
         cat_db = Category(
             name=cat.name,
             description=cat.description,
@@ -55,6 +65,7 @@ async def create_category(
             slug=slug,
         )
         session.add(cat_db)
+        bump(session, CATEGORIES)
         session.commit()
         session.refresh(cat_db)
         return cat_db
@@ -68,6 +79,34 @@ async def create_category(
             )
 
 
+@router.get(
+    "/by-slug/{slug}",
+    response_model=CategoryPublic,
+    responses={
+        301: {"description": "Slug was renamed"},
+        404: {"model": Message, "description": "Not Found Error"},
+    },
+)
+async def read_category_by_slug(slug: str, session: SessionDep, request: Request):
+    cat = session.exec(select(Category).where(Category.slug == slug)).first()
+    if cat:
+        return cat
+
+    target = resolve_slug_redirect(session, "category", Category, slug)
+    if not target:
+        return JSONResponse(status_code=404, content={"message": "Category not found"})
+    return RedirectResponse(
+        str(request.url_for("read_category_by_slug", slug=target.slug)),
+        status_code=301,
+    )
+
+
+@router.get("/nutrition", response_model=list[CategoryNutrition])
+async def read_nutrition_stats(session: SessionDep):
+    # stored by the nutrition.stats job; computing them reads every recipe
+    return read_stats(session)
+
+
 @router.get(
     "/{id}",
     response_model=CategoryPublic,
@@ -84,8 +123,12 @@ async def read_category(id: int, session: SessionDep):
 
 @router.get("/", response_model=list[CategoryPublic])
 async def read_categories(
-    session: SessionDep, offset: int = 0, limit: Annotated[int, Query(le=100)] = 100
+    session: SessionDep,
+    response: Response,
+    offset: int = 0,
+    limit: Annotated[int, Query(le=100)] = 100,
 ):
+    response.headers["X-Total-Count"] = str(read_count(session, CATEGORIES))
     categories = session.exec(select(Category).offset(offset).limit(limit)).all()
     return categories
 
@@ -125,7 +168,10 @@ async def update_category(
 
         cat_data = cat.model_dump(exclude_unset=True)
         if cat.name:
-            cat_data["slug"] = slugify(cat.name)
+            slug = allocate_slug(session, Category, cat.name, exclude_id=id)
+            if slug != cat_db.slug:
+                record_slug_redirect(session, "category", cat_db.slug, id)
+            cat_data["slug"] = slug
 
         _ = cat_db.sqlmodel_update(cat_data)
         session.add(cat_db)
@@ -173,18 +219,40 @@ async def delete_category(
         )
 
     session.delete(cat)
+    bump(session, CATEGORIES, -1)
     session.commit()
     return {"ok": True}
 
 
-@router.get("/{id}/recipes", response_model=list[RecipePublic])
+@router.get(
+    "/{id}/recipes",
+    response_model=list[RecipePartial],
+    response_model_exclude_unset=True,
+    responses={
+        400: {"model": Message, "description": "Bad Request Error"},
+    },
+)
 async def read_recipes(
     id: int,
     session: SessionDep,
+    response: Response,
     offset: int = 0,
     limit: Annotated[int, Query(le=100)] = 100,
+    fields: str | None = None,
+    view: Literal["full", "card"] = "full",
 ):
+    try:
+        columns = [getattr(Recipe, f) for f in parse_fields(fields, view, RECIPE_VIEWS)]
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+
+    response.headers["X-Total-Count"] = str(read_count(session, category_recipes(id)))
     recipes = session.exec(
-        select(Recipe).where(Recipe.category_id == id).offset(offset).limit(limit)
+        select(*columns).where(Recipe.category_id == id).offset(offset).limit(limit)
     ).all()
-    return recipes
+    return [r._asdict() for r in recipes]
+
+
+@router.get("/{id}/recipes/count", response_model=Count)
+async def count_recipes(id: int, session: SessionDep):
+    return Count(count=read_count(session, category_recipes(id)))
@@ -1,20 +1,28 @@
 from typing import Annotated
 from fastapi import APIRouter, Depends, Query, Response
 from fastapi.responses import JSONResponse
-from sqlmodel import select
+from sqlmodel import Session, select
 
-from .auth import get_current_user
+from .auth import by_user, get_current_user
 
+from ..counters import COMMENTS, bump_many, read_count, recipe_comments
 from ..models import (
     Comment,
     CommentBase,
     CommentPublic,
     CommentUpdate,
+    Count,
     Message,
     Recipe,
     SessionDep,
     User,
+    after_commit,
 )
+from ..pubsub import comment_events
+from ..scores import record_comment
+from ..ratelimit import rate_limit
+from ..utils import refresh_recipe_rating
+from ..writer import write
 
 
 router = APIRouter()
@@ -24,10 +32,12 @@ router = APIRouter()
     "/",
     status_code=201,
     response_model=CommentPublic,
+    dependencies=[Depends(rate_limit("comments.create", by_user))],
     responses={
         404: {"model": Message, "description": "Not Found Error"},
         403: {"model": Message, "description": "Forbidden Error"},
         400: {"model": Message, "description": "Bad Request Error"},
+        429: {"model": Message, "description": "Too Many Requests"},
     },
 )
 async def create_comment(
@@ -61,12 +71,33 @@ async def create_comment(
     )
 
     db_comment = Comment.model_validate(new_comment)
-    session.add(db_comment)
-    session.commit()
-    session.refresh(db_comment)
+
+    def insert(s: Session) -> Comment:
+        s.add(db_comment)
+        s.flush()
+        refresh_recipe_rating(s, db_comment.recipe_id)
+        record_comment(
+            s, db_comment.recipe_id, db_comment.rating, db_comment.created_at
+        )
+        bump_many(s, {COMMENTS: 1, recipe_comments(db_comment.recipe_id): 1})
+        return db_comment
+
+    db_comment = await write(session, insert)
+    after_commit(
+        session,
+        comment_events.publish,
+        db_comment.recipe_id,
+        "created",
+        CommentPublic.model_validate(db_comment).model_dump(mode="json"),
+    )
     return db_comment
 
 
+@router.get("/count", response_model=Count)
+async def count_comments(session: SessionDep):
+    return Count(count=read_count(session, COMMENTS))
+
+
 @router.get(
     "/{id}",
     response_model=CommentPublic,
@@ -83,8 +114,12 @@ async def read_comment(id: int, session: SessionDep):
 
 @router.get("/", response_model=list[CommentPublic])
 async def read_comments(
-    session: SessionDep, offset: int = 0, limit: Annotated[int, Query(le=100)] = 100
+    session: SessionDep,
+    response: Response,
+    offset: int = 0,
+    limit: Annotated[int, Query(le=100)] = 100,
 ):
+    response.headers["X-Total-Count"] = str(read_count(session, COMMENTS))
     comments = session.exec(select(Comment).offset(offset).limit(limit)).all()
     return comments
 
@@ -130,10 +165,36 @@ async def update_comment(
             )
 
     comment_data = comment.model_dump(exclude_unset=True)
-    _ = comment_db.sqlmodel_update(comment_data)
-    session.add(comment_db)
-    session.commit()
-    session.refresh(comment_db)
+
+    def apply(s: Session) -> Comment | None:
+        db = s.get(Comment, id)
+        if db is None:
+            # deleted between the check above and this write
+            return None
+        old_rating = db.rating
+        _ = db.sqlmodel_update(comment_data)
+        s.add(db)
+        s.flush()
+        if "rating" in comment_data:
+            refresh_recipe_rating(s, db.recipe_id)
+            record_comment(s, db.recipe_id, old_rating, db.created_at, -1)
+            record_comment(s, db.recipe_id, db.rating, db.created_at)
+        return db
+
+    comment_db = await write(session, apply)
+    if comment_db is None:
+        return JSONResponse(
+            status_code=404,
+            content={"message": "Comment not found"},
+            headers=res.headers,
+        )
+    after_commit(
+        session,
+        comment_events.publish,
+        comment_db.recipe_id,
+        "updated",
+        CommentPublic.model_validate(comment_db).model_dump(mode="json"),
+    )
     return comment_db
 
 
@@ -167,6 +228,17 @@ async def delete_comment(
             headers=res.headers,
         )
 
-    session.delete(comment)
-    session.commit()
+    recipe_id = comment.recipe_id
+
+    def remove(s: Session):
+        db = s.get(Comment, id)
+        if db:
+            s.delete(db)
+            s.flush()
+            refresh_recipe_rating(s, db.recipe_id)
+            record_comment(s, db.recipe_id, db.rating, db.created_at, -1)
+            bump_many(s, {COMMENTS: -1, recipe_comments(db.recipe_id): -1})
+
+    await write(session, remove)
+    after_commit(session, comment_events.publish, recipe_id, "deleted", {"id": id})
     return {"ok": True}
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+
+from ..metrics import metrics
+from ..monitor import monitor
+
+
+router = APIRouter()
+
+
+@router.get("/")
+async def read_metrics():
+    return {**metrics.snapshot(), "loop_blocks": monitor.recent_blocks()}
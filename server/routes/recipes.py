@@ -1,25 +1,87 @@
-from typing import Annotated
-from fastapi import APIRouter, Depends, Query, Response
-from fastapi.responses import JSONResponse
+import collections
+import csv
+import io
+import json
+import time
+from collections.abc import Iterator
+from datetime import datetime
+from typing import Annotated, Literal
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from sqlalchemy.exc import IntegrityError
-from sqlmodel import select
+from sqlalchemy import Engine, delete, insert, tuple_
+from sqlmodel import Session, select
 
-from .auth import get_current_user
+from .auth import by_user, get_current_user
 
+from ..counters import (
+    RECIPES,
+    bump_many,
+    category_recipes,
+    read_count,
+    recipe_comments,
+)
 from ..models import (
     Category,
     Comment,
     CommentPublic,
+    Count,
+    DuplicateCluster,
     Message,
+    Nutrition,
+    RECIPE_EXPORT_FIELDS,
+    RECIPE_SORTS,
+    RECIPE_VIEWS,
     Recipe,
     RecipeBase,
+    RecipeCluster,
+    RecipeCreate,
+    RecipeCreated,
+    RecipeDetail,
+    RecipeImportError,
+    RecipeImportReport,
+    RecipePartial,
     RecipePublic,
+    RecipeRanking,
+    RecipeScore,
+    RecipeSimilarity,
     RecipeUpdate,
     SessionDep,
+    SimilarRecipe,
     User,
+    after_commit,
 )
 
-from ..utils import slugify
+from ..duplicates import (
+    TEXT_COLUMNS,
+    describe,
+    find_duplicates,
+    index_recipes,
+    index_signatures,
+    read_clusters,
+    shingles,
+    signature,
+    unindex,
+)
+from ..ingredients import UnitSystem, parse_ingredients, scale
+from ..jobs import jobs
+from ..metrics import metrics
+from ..nutrition import read_nutrition, save_nutrition, schedule_stats
+from ..pubsub import comment_events, event_stream
+from ..rendering import render_markdown
+from ..similarity import K
+from ..views import view_tracker
+from ..writer import write_lock
+from ..utils import (
+    SlugAllocator,
+    allocate_slug,
+    parse_fields,
+    slugify,
+    record_slug_redirect,
+    resolve_slug_redirect,
+)
 
 
 router = APIRouter()
@@ -28,7 +90,7 @@ router = APIRouter()
 @router.post(
     "/",
     status_code=201,
-    response_model=RecipePublic,
+    response_model=RecipeCreated,
     responses={
         409: {"model": Message, "description": "Conflict Error"},
         404: {"model": Message, "description": "Not Found Error"},
@@ -36,7 +98,7 @@ router = APIRouter()
     },
 )
 async def create_recipe(
-    recipe: RecipeBase,
+    recipe: RecipeCreate,
     session: SessionDep,
     response: Response,
     curr: tuple[User, str] = Depends(get_current_user),
@@ -51,12 +113,13 @@ async def create_recipe(
                 headers=response.headers,
             )
 
-        slug = slugify(recipe.name)
+        slug = allocate_slug(session, Recipe, recipe.name)
         recipe_db = Recipe(
             name=recipe.name,
             slug=slug,
             description=recipe.description,
             instructions=recipe.instructions,
+            rendered_instructions=render_markdown(recipe.instructions),
             ingredients=recipe.ingredients,
             calories=recipe.calories,
             prep_time=recipe.prep_time,
@@ -65,9 +128,26 @@ async def create_recipe(
             author_id=user.id,
         )
         session.add(recipe_db)
+        bump_many(session, {RECIPES: 1, category_recipes(recipe.category_id): 1})
+        session.flush()
+        if recipe.nutrition is not None:
+            save_nutrition(session, recipe_db.id, recipe.nutrition)
+        sig = signature(shingles(recipe.name, recipe.ingredients, recipe.instructions))
+        duplicates = [] if sig is None else find_duplicates(session, sig)
+        index_signatures(
+            session,
+            [(recipe_db.id, None if sig is None else sig.tobytes())],
+            replace=False,
+        )
+        _ = jobs.enqueue(session, "similar.refresh", {"recipe_id": recipe_db.id})
+        schedule_stats(session)
         session.commit()
+        after_commit(session, jobs.notify)
         session.refresh(recipe_db)
-        return recipe_db
+        return {
+            **recipe_db.model_dump(),
+            "possible_duplicates": describe(session, dict(duplicates)),
+        }
     except IntegrityError as e:
         session.rollback()
         if "UNIQUE constraint failed" in str(e.orig):
@@ -78,25 +158,533 @@ async def create_recipe(
             )
 
 
+EXPORT_BATCH_SIZE = 500
+
+
+def export_rows(
+    engine: Engine, statement, format: Literal["ndjson", "csv"]  # pyright: ignore
+) -> Iterator[str]:
+    # runs after the request session is closed, so it opens its own; rows are
+    # fetched from the cursor a batch at a time and never held all at once
+    with Session(engine) as session:
+        result = session.exec(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(RECIPE_EXPORT_FIELDS)
+            for rows in result.partitions():
+                writer.writerows(rows)
+                yield buffer.getvalue()
+                _ = buffer.seek(0)
+                _ = buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            for rows in result.partitions():
+                yield "".join(json.dumps(r._asdict()) + "\n" for r in rows)
+
+
 @router.get(
-    "/{id}",
+    "/export",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"application/x-ndjson": {}, "text/csv": {}}},
+        403: {"model": Message, "description": "Forbidden Error"},
+    },
+)
+async def export_recipes(
+    session: SessionDep,
+    response: Response,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    category_id: int | None = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    curr: tuple[User, str] = Depends(get_current_user),
+):
+    _, role = curr
+    if role != "ADMIN":
+        return JSONResponse(
+            status_code=403,
+            content={"message": "You do not have rights to this resource"},
+            headers=response.headers,
+        )
+
+    statement = select(*[getattr(Recipe, f) for f in RECIPE_EXPORT_FIELDS])
+    if category_id is not None:
+        statement = statement.where(Recipe.category_id == category_id)
+    if created_after is not None:
+        statement = statement.where(Recipe.created_at >= created_after.timestamp())
+    if created_before is not None:
+        statement = statement.where(Recipe.created_at < created_before.timestamp())
+    statement = statement.order_by(Recipe.id)  # pyright: ignore
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    streaming = StreamingResponse(
+        export_rows(session.get_bind(), statement, format),  # pyright: ignore
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="recipes.{format}"',
+        },
+    )
+    # raw, so both Set-Cookie headers of a token rotation survive
+    streaming.raw_headers.extend(response.headers.raw)
+    return streaming
+
+
+IMPORT_BATCH_SIZE = 500
+
+
+def count_imported(session: Session, rows: list[dict]):  # pyright: ignore
+    per_category = collections.Counter(r["category_id"] for r in rows)
+    bump_many(
+        session,
+        {
+            RECIPES: len(rows),
+            **{category_recipes(c): count for c, count in per_category.items()},
+        },
+    )
+    inserted = session.exec(
+        select(*TEXT_COLUMNS).where(
+            Recipe.slug.in_([r["slug"] for r in rows])  # pyright: ignore
+        )
+    ).all()
+    index_recipes(session, inserted, replace=False)
+    # one job for the whole batch, so the worker refreshes the lists once
+    _ = jobs.enqueue(
+        session, "similar.refresh", {"recipe_ids": [r.id for r in inserted]}
+    )
+    schedule_stats(session)
+
+
+def import_batch(
+    session: Session,
+    batch: list[tuple[int, bytes]],
+    author_id: int | None,
+    slugs: SlugAllocator,
+    categories: set[int],
+    errors: list[RecipeImportError],
+) -> int:
+    valid: list[tuple[int, RecipeBase]] = []
+    for line, raw in batch:
+        try:
+            valid.append((line, RecipeBase.model_validate(json.loads(raw))))
+        except json.JSONDecodeError as e:
+            errors.append(RecipeImportError(line=line, message=f"Invalid JSON: {e}"))
+        except ValidationError as e:
+            message = "; ".join(
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}"
+                for err in e.errors()
+            )
+            errors.append(RecipeImportError(line=line, message=message))
+
+    unknown = {r.category_id for _, r in valid if r.category_id is not None}
+    unknown -= categories
+    if unknown:
+        categories.update(
+            session.exec(
+                select(Category.id).where(Category.id.in_(unknown))
+            ).all()  # pyright: ignore
+        )
+
+    rows: list[tuple[int, dict]] = []  # pyright: ignore
+    slugs.load(slugify(r.name) for _, r in valid)
+    now = time.time()
+    for line, recipe in valid:
+        if recipe.category_id not in categories:
+            errors.append(RecipeImportError(line=line, message="Category not found"))
+            continue
+        rows.append(
+            (
+                line,
+                {
+                    **recipe.model_dump(),
+                    "slug": slugs.allocate(recipe.name),
+                    "rendered_instructions": render_markdown(recipe.instructions),
+                    "author_id": author_id,
+                    "created_at": now,
+                },
+            )
+        )
+    if not rows:
+        return 0
+
+    try:
+        _ = session.exec(insert(Recipe), params=[r for _, r in rows])  # pyright: ignore
+        count_imported(session, [r for _, r in rows])
+        session.commit()
+        after_commit(session, jobs.notify)
+        return len(rows)
+    except IntegrityError:
+        session.rollback()
+
+    # somebody took one of the slugs meanwhile: fall back to row by row
+    imported = 0
+    for line, row in rows:
+        row["slug"] = allocate_slug(session, Recipe, row["name"])
+        try:
+            _ = session.exec(insert(Recipe), params=[row])  # pyright: ignore
+            count_imported(session, [row])
+            session.commit()
+            after_commit(session, jobs.notify)
+            imported += 1
+        except IntegrityError as e:
+            session.rollback()
+            errors.append(RecipeImportError(line=line, message=str(e.orig)))
+    return imported
+
+
+@router.post(
+    "/import",
+    response_model=RecipeImportReport,
+    responses={
+        403: {"model": Message, "description": "Forbidden Error"},
+    },
+)
+async def import_recipes(
+    request: Request,
+    session: SessionDep,
+    curr: tuple[User, str] = Depends(get_current_user),
+):
+    user, _ = curr
+    start = time.perf_counter()
+    slugs = SlugAllocator(session, Recipe)
+    categories: set[int] = set()
+    errors: list[RecipeImportError] = []
+    imported = 0
+    total = 0
+
+    batch: list[tuple[int, bytes]] = []
+    pending = b""
+    line = 0
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        # a single chunk can hold many batches worth of lines
+        for raw in lines:
+            line += 1
+            if raw.strip():
+                batch.append((line, raw))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                total += len(batch)
+                imported += await run_in_threadpool(
+                    import_batch, session, batch, user.id, slugs, categories, errors
+                )
+                batch = []
+    if pending.strip():
+        batch.append((line + 1, pending))
+    if batch:
+        total += len(batch)
+        imported += await run_in_threadpool(
+            import_batch, session, batch, user.id, slugs, categories, errors
+        )
+
+    seconds = time.perf_counter() - start
+    metrics.inc("recipes_imported", imported)
+    return RecipeImportReport(
+        imported=imported,
+        failed=total - imported,
+        errors=sorted(errors, key=lambda e: e.line),
+        seconds=round(seconds, 3),
+        rows_per_second=round(total / seconds, 1) if seconds else 0.0,
+    )
+
+
+@router.get("/count", response_model=Count)
+async def count_recipes(session: SessionDep, category_id: int | None = None):
+    name = RECIPES if category_id is None else category_recipes(category_id)
+    return Count(count=read_count(session, name))
+
+
+@router.get(
+    "/duplicates",
+    response_model=list[DuplicateCluster],
+    responses={
+        403: {"model": Message, "description": "Forbidden Error"},
+    },
+)
+async def read_duplicate_clusters(
+    session: SessionDep,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    curr: tuple[User, str] = Depends(get_current_user),
+):
+    _, role = curr
+    if role != "ADMIN":
+        return JSONResponse(
+            status_code=403,
+            content={"message": "You do not have rights to this resource"},
+        )
+
+    # stored by the duplicates periodic job; members deleted since drop out
+    page = read_clusters(session, offset, limit)
+    described = {
+        d["id"]: d
+        for d in describe(session, {r: s for _, m in page for r, s in m.items()})
+    }
+    clusters = []
+    for low, members in page:
+        recipes = [described[r] for r in members if r in described]
+        if len(recipes) > 1:
+            recipes.sort(key=lambda d: (-d["similarity"], d["id"]))
+            clusters.append({"similarity": low, "recipes": recipes})
+    return clusters
+
+
+LEADERBOARDS = {
+    "week": RecipeScore.top_week,
+    "month": RecipeScore.top_month,
+    "all": RecipeScore.top_all,
+    "trending": RecipeScore.trending,
+}
+
+
+def read_leaderboard(
+    session: Session, response: Response, board: str, limit: int, cursor: str | None
+):
+    column = LEADERBOARDS[board]
+    query = (
+        select(
+            Recipe.id,
+            Recipe.name,
+            Recipe.slug,
+            Recipe.category_id,
+            Recipe.rating,
+            RecipeScore.comments,
+            column.label("score"),
+        )
+        .join(Recipe, Recipe.id == RecipeScore.recipe_id)  # pyright: ignore
+        .order_by(column.desc(), RecipeScore.recipe_id.desc())  # pyright: ignore
+        .limit(limit)
+    )
+    if cursor is not None:
+        # keyset pagination: every page is one seek on the score index
+        score, _, last_id = cursor.rpartition(":")
+        try:
+            after = (float(score), int(last_id))
+        except ValueError:
+            return JSONResponse(status_code=400, content={"message": "Invalid cursor"})
+        query = query.where(tuple_(column, RecipeScore.recipe_id) < after)
+
+    rows = session.exec(query).all()
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = f"{rows[-1].score!r}:{rows[-1].id}"
+    return [r._asdict() for r in rows]
+
+
+@router.get(
+    "/top",
+    response_model=list[RecipeRanking],
+    responses={
+        400: {"model": Message, "description": "Bad Request Error"},
+    },
+)
+async def read_top_recipes(
+    session: SessionDep,
+    response: Response,
+    window: Literal["week", "month", "all"] = "week",
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    cursor: str | None = None,
+):
+    return read_leaderboard(session, response, window, limit, cursor)
+
+
+@router.get(
+    "/trending",
+    response_model=list[RecipeRanking],
+    responses={
+        400: {"model": Message, "description": "Bad Request Error"},
+    },
+)
+async def read_trending_recipes(
+    session: SessionDep,
+    response: Response,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    cursor: str | None = None,
+):
+    return read_leaderboard(session, response, "trending", limit, cursor)
+
+
+@router.get(
+    "/by-slug/{slug}",
     response_model=RecipePublic,
     responses={
+        301: {"description": "Slug was renamed"},
         404: {"model": Message, "description": "Not Found Error"},
     },
 )
-async def read_recipe(id: int, session: SessionDep):
+async def read_recipe_by_slug(slug: str, session: SessionDep, request: Request):
+    recipe = session.exec(select(Recipe).where(Recipe.slug == slug)).first()
+    if recipe:
+        after_commit(session, view_tracker.record, recipe.id, by_user(request))
+        return recipe
+
+    target = resolve_slug_redirect(session, "recipe", Recipe, slug)
+    if not target:
+        return JSONResponse(status_code=404, content={"message": "Recipe not found"})
+    return RedirectResponse(
+        str(request.url_for("read_recipe_by_slug", slug=target.slug)),
+        status_code=301,
+    )
+
+
+@router.get(
+    "/{id}",
+    response_model=RecipeDetail,
+    responses={
+        404: {"model": Message, "description": "Not Found Error"},
+    },
+)
+async def read_recipe(
+    id: int,
+    session: SessionDep,
+    request: Request,
+    html: bool = False,
+    servings: Annotated[int | None, Query(ge=1, le=1000)] = None,
+    units: UnitSystem | None = None,
+):
     recipe = session.get(Recipe, id)
     if not recipe:
         return JSONResponse(status_code=404, content={"message": "Recipe not found"})
-    return recipe
 
+    after_commit(session, view_tracker.record, id, by_user(request))
+    detail = {**recipe.model_dump(), "nutrition": read_nutrition(session, id)}
+    if servings is not None or units is not None:
+        servings = servings or recipe.servings
+        factor = servings / recipe.servings if recipe.servings > 0 else 1
+        detail["scaled_servings"] = servings
+        detail["scaled_ingredients"] = [
+            e._asdict()
+            for e in scale(parse_ingredients(recipe.ingredients), factor, units)
+        ]
+
+    if not html:
+        return detail
+
+    if recipe.rendered_instructions is None:
+        # rows written before rendering existed are filled in on first read
+        recipe.rendered_instructions = render_markdown(recipe.instructions)
+        # a GET doesn't take the write lock through its session
+        async with write_lock.shared_async():
+            session.add(recipe)
+            session.commit()
+        session.refresh(recipe)
+    else:
+        metrics.inc("markdown_served_prerendered")
 
-@router.get("/", response_model=list[RecipePublic])
+    return {**detail, "instructions_html": recipe.rendered_instructions}
+
+
+@router.get(
+    "/",
+    response_model=list[RecipePartial],
+    response_model_exclude_unset=True,
+    responses={
+        400: {"model": Message, "description": "Bad Request Error"},
+    },
+)
 async def read_recipes(
-    session: SessionDep, offset: int = 0, limit: Annotated[int, Query(le=100)] = 100
+    session: SessionDep,
+    response: Response,
+    offset: int = 0,
+    limit: Annotated[int, Query(le=100)] = 100,
+    fields: str | None = None,
+    view: Literal["full", "card"] = "full",
+    category_id: int | None = None,
+    author_id: int | None = None,
+    calories_min: int | None = None,
+    calories_max: int | None = None,
+    prep_time_min: int | None = None,
+    prep_time_max: int | None = None,
+    servings_min: int | None = None,
+    servings_max: int | None = None,
+    protein_min: float | None = None,
+    protein_max: float | None = None,
+    fat_min: float | None = None,
+    fat_max: float | None = None,
+    carbs_min: float | None = None,
+    carbs_max: float | None = None,
+    fiber_min: float | None = None,
+    fiber_max: float | None = None,
+    sugar_min: float | None = None,
+    sugar_max: float | None = None,
+    sodium_min: float | None = None,
+    sodium_max: float | None = None,
+    sort: Literal["id", "rating", "newest", "prep_time"] = "id",
+    cursor: str | None = None,
 ):
-    recipes = session.exec(select(Recipe).offset(offset).limit(limit)).all()
+    try:
+        columns = [getattr(Recipe, f) for f in parse_fields(fields, view, RECIPE_VIEWS)]
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+
+    query = select(*columns)
+    if category_id is not None:
+        query = query.where(Recipe.category_id == category_id)
+    if author_id is not None:
+        query = query.where(Recipe.author_id == author_id)
+    ranged: set[str] = set()
+    nutrition_ranges = (
+        (Nutrition.protein, protein_min, protein_max),
+        (Nutrition.fat, fat_min, fat_max),
+        (Nutrition.carbs, carbs_min, carbs_max),
+        (Nutrition.fiber, fiber_min, fiber_max),
+        (Nutrition.sugar, sugar_min, sugar_max),
+        (Nutrition.sodium, sodium_min, sodium_max),
+    )
+    if any(low is not None or high is not None for _, low, high in nutrition_ranges):
+        # an inner join: recipes without nutrition never match a range
+        query = query.join(
+            Nutrition, Nutrition.recipe_id == Recipe.id  # pyright: ignore
+        )
+    # pages walk the sort index and check the ranges row by row until they
+    # have LIMIT rows, so the ranges are kept off their own indexes: searching
+    # one would leave every match to be sorted; a cursor then seeks past the
+    # previous page instead of walking it again
+    field, direction = RECIPE_SORTS[sort]
+    sort_column = getattr(Recipe, field)
+    for column, low, high in (
+        (Recipe.calories, calories_min, calories_max),
+        (Recipe.prep_time, prep_time_min, prep_time_max),
+        (Recipe.servings, servings_min, servings_max),
+        *nutrition_ranges,
+    ):
+        checked = column if column is sort_column else column + 0
+        if low is not None:
+            query = query.where(checked >= low)
+        if high is not None:
+            query = query.where(checked <= high)
+        if low is not None or high is not None:
+            ranged.add(column.key)
+
+    # the id tiebreak runs in the same direction so the sort index serves both
+    order = [sort_column] if field == "id" else [sort_column, Recipe.id]
+    query = query.order_by(*(c.desc() if direction == "desc" else c for c in order))
+    # the next cursor needs the sort value even when the fields leave it out
+    hidden = field not in {c.key for c in columns}
+    if hidden:
+        query = query.add_columns(sort_column)
+    if cursor is not None:
+        value, _, last_id = cursor.rpartition(":")
+        try:
+            after = (float(value), int(last_id)) if field != "id" else int(last_id)
+        except ValueError:
+            return JSONResponse(status_code=400, content={"message": "Invalid cursor"})
+        key = tuple_(*order) if field != "id" else sort_column
+        query = query.where(key < after if direction == "desc" else key > after)
+
+    # totals are only maintained per category; other filters get no header
+    if author_id is None and not ranged:
+        name = RECIPES if category_id is None else category_recipes(category_id)
+        response.headers["X-Total-Count"] = str(read_count(session, name))
+
+    recipes = [r._asdict() for r in session.exec(query.offset(offset).limit(limit))]
+    if recipes and len(recipes) == limit:
+        last = recipes[-1]
+        value = "" if field == "id" else f"{last[field]!r}:"
+        response.headers["X-Next-Cursor"] = f"{value}{last['id']}"
+    if hidden:
+        for r in recipes:
+            del r[field]
     return recipes
 
 
@@ -142,12 +730,50 @@ async def update_recipe(
             )
 
         recipe_data = recipe.model_dump(exclude_unset=True)
+        _ = recipe_data.pop("nutrition", None)
+        if recipe.nutrition is not None:
+            save_nutrition(session, id, recipe.nutrition, partial=True)
         if recipe.name:
-            recipe_data["slug"] = slugify(recipe.name)
+            slug = allocate_slug(session, Recipe, recipe.name, exclude_id=id)
+            if slug != recipe_db.slug:
+                record_slug_redirect(session, "recipe", recipe_db.slug, id)
+            recipe_data["slug"] = slug
+        if recipe.instructions is not None:
+            recipe_data["rendered_instructions"] = render_markdown(recipe.instructions)
+
+        if recipe_db.category_id != category.id:
+            bump_many(
+                session,
+                {
+                    category_recipes(recipe_db.category_id): -1,
+                    category_recipes(category.id): 1,
+                },
+            )
 
         _ = recipe_db.sqlmodel_update(recipe_data)
         session.add(recipe_db)
+        if {"name", "ingredients", "instructions"} & set(recipe_data):
+            index_recipes(
+                session,
+                [
+                    (
+                        id,
+                        recipe_db.name,
+                        recipe_db.ingredients,
+                        recipe_db.instructions,
+                    )
+                ],
+            )
+        if {"ingredients", "category_id", "calories", "prep_time", "servings"} & set(
+            recipe_data
+        ):
+            _ = jobs.enqueue(session, "similar.refresh", {"recipe_id": id})
+        if recipe.nutrition is not None or {"calories", "category_id"} & set(
+            recipe_data
+        ):
+            schedule_stats(session)
         session.commit()
+        after_commit(session, jobs.notify)
         session.refresh(recipe_db)
         return recipe_db
 
@@ -191,18 +817,85 @@ async def delete_recipe(
         )
 
     session.delete(recipe)
+    unindex(session, [id])
+    _ = session.exec(
+        delete(RecipeCluster).where(RecipeCluster.recipe_id == id)  # pyright: ignore
+    )
+    for row in (session.get(RecipeScore, id), session.get(Nutrition, id)):
+        if row:
+            session.delete(row)
+    bump_many(session, {RECIPES: -1, category_recipes(recipe.category_id): -1})
+    _ = jobs.enqueue(session, "similar.refresh", {"recipe_id": id})
+    schedule_stats(session)
     session.commit()
+    after_commit(session, jobs.notify)
     return {"ok": True}
 
 
+@router.get(
+    "/{id}/similar",
+    response_model=list[RecipeSimilarity],
+    responses={
+        404: {"model": Message, "description": "Not Found Error"},
+    },
+)
+async def read_similar_recipes(
+    id: int, session: SessionDep, limit: Annotated[int, Query(ge=1, le=K)] = K
+):
+    if not session.get(Recipe, id):
+        return JSONResponse(status_code=404, content={"message": "Recipe not found"})
+
+    rows = session.exec(
+        select(
+            Recipe.id,
+            Recipe.name,
+            Recipe.slug,
+            Recipe.category_id,
+            SimilarRecipe.score,
+        )
+        .join(Recipe, Recipe.id == SimilarRecipe.similar_id)  # pyright: ignore
+        .where(SimilarRecipe.recipe_id == id)
+        .order_by(SimilarRecipe.score.desc())  # pyright: ignore
+        .limit(limit)
+    ).all()
+    return [r._asdict() for r in rows]
+
+
 @router.get("/{id}/comments", response_model=list[CommentPublic])
 async def read_comments(
     id: int,
     session: SessionDep,
+    response: Response,
     offset: int = 0,
     limit: Annotated[int, Query(le=100)] = 100,
 ):
+    response.headers["X-Total-Count"] = str(read_count(session, recipe_comments(id)))
     comments = session.exec(
         select(Comment).where(Comment.recipe_id == id).offset(offset).limit(limit)
     ).all()
     return comments
+
+
+@router.get("/{id}/comments/count", response_model=Count)
+async def count_comments(id: int, session: SessionDep):
+    return Count(count=read_count(session, recipe_comments(id)))
+
+
+@router.get(
+    "/{id}/comments/stream",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"text/event-stream": {}}},
+        404: {"model": Message, "description": "Not Found Error"},
+    },
+)
+async def stream_comments(id: int, session: SessionDep):
+    recipe = session.get(Recipe, id)
+    if not recipe:
+        return JSONResponse(status_code=404, content={"message": "Recipe not found"})
+
+    return StreamingResponse(
+        event_stream(comment_events, id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
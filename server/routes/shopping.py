@@ -0,0 +1,50 @@
+from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlmodel import select
+
+from ..models import (
+    Message,
+    Recipe,
+    SessionDep,
+    ShoppingList,
+    ShoppingListRequest,
+)
+from ..shopping import aggregate
+
+
+router = APIRouter()
+
+
+@router.post(
+    "/",
+    response_model=ShoppingList,
+    responses={
+        404: {"model": Message, "description": "Not Found Error"},
+    },
+)
+async def create_shopping_list(body: ShoppingListRequest, session: SessionDep):
+    ids = {r.recipe_id for r in body.recipes}
+    found = {
+        r.id: r
+        for r in session.exec(
+            select(Recipe.id, Recipe.servings, Recipe.ingredients).where(
+                Recipe.id.in_(ids)  # pyright: ignore
+            )
+        ).all()
+    }
+    missing = sorted(ids - found.keys())
+    if missing:
+        return JSONResponse(
+            status_code=404,
+            content={"message": f"Recipes not found: {', '.join(map(str, missing))}"},
+        )
+
+    recipes = []
+    for requested in body.recipes:
+        row = found[requested.recipe_id]
+        servings = requested.servings or row.servings
+        factor = servings / row.servings if row.servings > 0 else 1
+        recipes.append((row.id, row.ingredients, factor))
+    items = await run_in_threadpool(aggregate, recipes, body.units)
+    return {"items": items}
@@ -0,0 +1,146 @@
+import math
+import os
+import time
+from decimal import Decimal
+
+from sqlalchemy import Engine
+from sqlmodel import Session, select
+
+from .jobs import jobs
+from .models import Recipe, RecipeScore
+
+
+DAY = 24 * 3600
+# a comment counts half as much after one half-life
+HALF_LIVES = {"week": 7 * DAY, "month": 30 * DAY, "velocity": DAY}
+# ratings are pulled towards PRIOR_RATING as if every recipe had
+# PRIOR_WEIGHT extra comments, so one 5.0 doesn't top the board
+PRIOR_WEIGHT = 5.0
+PRIOR_RATING = 3.0
+# how many comments one view is worth on the trending board
+VIEW_WEIGHT = 0.05
+
+DECAY_INTERVAL = float(os.environ.get("SCORE_DECAY_INTERVAL", "900"))
+DECAY_BATCH_SIZE = 500
+
+
+def decay_factor(seconds: float, half_life: float) -> float:
+    return 0.5 ** (max(seconds, 0.0) / half_life)
+
+
+def bayesian(rating: float, weight: float) -> float:
+    return (rating + PRIOR_WEIGHT * PRIOR_RATING) / (weight + PRIOR_WEIGHT)
+
+
+def decay(score: RecipeScore, now: float):
+    elapsed = now - score.decayed_at
+    week = decay_factor(elapsed, HALF_LIVES["week"])
+    month = decay_factor(elapsed, HALF_LIVES["month"])
+    score.week_weight *= week
+    score.week_rating *= week
+    score.month_weight *= month
+    score.month_rating *= month
+    velocity = decay_factor(elapsed, HALF_LIVES["velocity"])
+    score.velocity *= velocity
+    score.view_velocity *= velocity
+    score.decayed_at = now
+
+
+def rescore(score: RecipeScore):
+    score.top_week = bayesian(score.week_rating, score.week_weight)
+    score.top_month = bayesian(score.month_rating, score.month_weight)
+    score.top_all = bayesian(score.rating_sum, score.comments)
+    # comments and views per day, favouring well-rated recipes
+    activity = score.velocity + VIEW_WEIGHT * score.view_velocity
+    score.trending = activity * score.top_week / 5
+
+
+def record_comment(
+    session: Session,
+    recipe_id: int | None,
+    rating: Decimal | float,
+    created_at: float,
+    delta: int = 1,
+):
+    """Adds (delta=1) or takes back (delta=-1) one comment's contribution."""
+    now = time.time()
+    score = session.get(RecipeScore, recipe_id) or RecipeScore(
+        recipe_id=recipe_id, decayed_at=now
+    )
+    decay(score, now)
+
+    rating = float(rating)
+    age = now - created_at
+    week = delta * decay_factor(age, HALF_LIVES["week"])
+    month = delta * decay_factor(age, HALF_LIVES["month"])
+    score.comments = max(score.comments + delta, 0)
+    score.rating_sum = max(score.rating_sum + delta * rating, 0.0)
+    # subtracting a decayed float can leave dust just below zero
+    score.week_weight = max(score.week_weight + week, 0.0)
+    score.week_rating = max(score.week_rating + week * rating, 0.0)
+    score.month_weight = max(score.month_weight + month, 0.0)
+    score.month_rating = max(score.month_rating + month * rating, 0.0)
+    score.velocity = max(
+        score.velocity + delta * decay_factor(age, HALF_LIVES["velocity"]), 0.0
+    )
+    rescore(score)
+    session.add(score)
+
+
+def record_views(session: Session, views: dict[int, int], chunk_size: int = 500):
+    now = time.time()
+    ids = list(views)
+    for i in range(0, len(ids), chunk_size):
+        # a recipe deleted since its views were counted gets no score row
+        chunk = session.exec(
+            select(Recipe.id).where(
+                Recipe.id.in_(ids[i : i + chunk_size])  # pyright: ignore
+            )
+        ).all()
+        scores = {
+            s.recipe_id: s
+            for s in session.exec(
+                select(RecipeScore).where(
+                    RecipeScore.recipe_id.in_(chunk)  # pyright: ignore
+                )
+            ).all()
+        }
+        for recipe_id in chunk:
+            score = scores.get(recipe_id) or RecipeScore(
+                recipe_id=recipe_id, decayed_at=now
+            )
+            decay(score, now)
+            score.view_velocity += views[recipe_id]
+            rescore(score)
+            session.add(score)
+
+
+@jobs.periodic(DECAY_INTERVAL)
+def decay_scores(engine: Engine) -> int:
+    """Decays every score to now, a batch per transaction.
+
+    Rows nobody commented on since the last run drift at most one
+    interval's worth of decay from their true score.
+    """
+    last, decayed = 0, 0
+    while True:
+        with engine.connect() as conn:
+            _ = conn.exec_driver_sql("BEGIN IMMEDIATE")
+            with Session(bind=conn) as session:
+                batch = session.exec(
+                    select(RecipeScore)
+                    .where(RecipeScore.recipe_id > last)
+                    .order_by(RecipeScore.recipe_id)  # pyright: ignore
+                    .limit(DECAY_BATCH_SIZE)
+                ).all()
+                now = time.time()
+                for score in batch:
+                    decay(score, now)
+                    rescore(score)
+                    session.add(score)
+                session.flush()
+            conn.commit()
+        if not batch:
+            return decayed
+        decayed += len(batch)
+        last = batch[-1].recipe_id
@@ -129,3 +129,37 @@ INSERT INTO comment (title, text, rating, user_id, recipe_id) VALUES
 ('Amazing!', 'Best chocolate cake I have ever made', 5.0, 1, 42),
 ('Kids loved it', 'These cookies disappeared fast', 5.0, 2, 48),
 ('Needs seasoning', 'Good base recipe but add more salt and pepper', 3.5, 3, 16);
+
+-- Average comment ratings onto recipes
+UPDATE recipe SET rating = (
+    SELECT COALESCE(AVG(comment.rating), 0) FROM comment WHERE comment.recipe_id = recipe.id
+);
+
+-- Maintained counts (see counters.py)
+INSERT INTO counter (name, value)
+SELECT 'recipes', COUNT(*) FROM recipe
+UNION ALL SELECT 'comments', COUNT(*) FROM comment
+UNION ALL SELECT 'categories', COUNT(*) FROM category
+UNION ALL
+SELECT 'category:' || category_id || ':recipes', COUNT(*) FROM recipe
+WHERE category_id IS NOT NULL GROUP BY category_id
+UNION ALL
+SELECT 'recipe:' || recipe_id || ':comments', COUNT(*) FROM comment
+WHERE recipe_id IS NOT NULL GROUP BY recipe_id;
+
+-- Leaderboard scores (see scores.py); every seeded comment is brand new,
+-- so each one weighs 1 and the scores are the PRIOR_WEIGHT = 5,
+-- PRIOR_RATING = 3 Bayesian average
+INSERT INTO recipescore (
+    recipe_id, comments, rating_sum, week_weight, week_rating,
+    month_weight, month_rating, velocity, decayed_at,
+    top_week, top_month, top_all, trending
+)
+SELECT
+    recipe_id, n, total, n, total, n, total, n, strftime('%s', 'now'),
+    (total + 15.0) / (n + 5), (total + 15.0) / (n + 5), (total + 15.0) / (n + 5),
+    n * (total + 15.0) / (n + 5) / 5
+FROM (
+    SELECT recipe_id, COUNT(*) AS n, SUM(rating) AS total
+    FROM comment WHERE recipe_id IS NOT NULL GROUP BY recipe_id
+);
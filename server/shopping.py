@@ -0,0 +1,185 @@
+"""Shopping lists: the ingredients of many recipes, scaled and merged.
+
+An item is merged across recipes per dimension: "1 cup milk" and "200 ml
+milk" add up in millilitres, "2 cloves garlic" and "1 head garlic" stay
+apart. Every recipe's ingredients are compiled once into arrays of
+(merge key, base quantity) and cached by the text's hash, so a list is a
+concatenation, one multiply by the servings factors and a bincount per
+total, however many recipes it spans.
+"""
+
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from .ingredients import (
+    UNITS,
+    UnitSystem,
+    display_unit,
+    parse_ingredients,
+    round_quantity,
+)
+from .metrics import metrics
+from .rendering import content_hash
+
+CACHE_SIZE = 4096
+
+# (item, dimension or counted unit); "" for a bare count like "2 eggs"
+Key = tuple[str, str]
+
+
+class Form(NamedTuple):
+    """A recipe's ingredients at its own servings, in base units."""
+
+    # the recipe's distinct merge keys; keys holds an index into them per entry
+    names: tuple[Key, ...]
+    keys: np.ndarray
+    low: np.ndarray
+    high: np.ndarray
+    # False for entries without an amount, e.g. "salt: to taste"
+    known: np.ndarray
+    notes: tuple[tuple[int, str], ...]
+
+
+_forms: OrderedDict[str, Form] = OrderedDict()
+_lock = threading.Lock()
+
+
+def compile_form(ingredients: str) -> Form:
+    # keys are numbered per form, so nothing outlives the form in the cache
+    names: dict[Key, int] = {}
+    keys: list[int] = []
+    low, high, known, notes = [], [], [], []
+    for entry in parse_ingredients(ingredients):
+        item = " ".join(entry.item.lower().split())
+        if not item:
+            # a bare amount such as "½ cup": nothing to put on the list
+            continue
+        unit = UNITS.get(entry.unit) if entry.unit else None
+        factor = 1.0
+        if unit is None:
+            kind = entry.unit or ""
+        elif unit.dimension is None:
+            kind = unit.name
+        else:
+            kind, factor = unit.dimension, unit.factor
+        keys.append(names.setdefault((item, kind), len(names)))
+        quantity = entry.quantity
+        low.append(0.0 if quantity is None else quantity * factor)
+        high.append(
+            0.0 if quantity is None else (entry.quantity_max or quantity) * factor
+        )
+        known.append(quantity is not None)
+        if entry.note:
+            notes.append((len(keys) - 1, entry.note))
+    return Form(
+        tuple(names),
+        np.array(keys, dtype=np.int64),
+        np.array(low, dtype=np.float64),
+        np.array(high, dtype=np.float64),
+        np.array(known, dtype=bool),
+        tuple(notes),
+    )
+
+
+def shopping_form(ingredients: str) -> Form:
+    key = content_hash(ingredients)
+    with _lock:
+        form = _forms.get(key)
+        if form is not None:
+            _forms.move_to_end(key)
+            metrics.inc("shopping_form_cache_hits")
+            return form
+
+    form = compile_form(ingredients)
+
+    with _lock:
+        _forms[key] = form
+        if len(_forms) > CACHE_SIZE:
+            _ = _forms.popitem(last=False)
+    return form
+
+
+def clear_cache():
+    with _lock:
+        _forms.clear()
+
+
+def aggregate(
+    recipes: Sequence[tuple[int, str, float]], system: UnitSystem = "metric"
+) -> list[dict[str, Any]]:
+    """Merged totals of (recipe_id, ingredients, servings factor) triples."""
+    forms = [shopping_form(ingredients) for _, ingredients, _ in recipes]
+    sizes = [len(f.keys) for f in forms]
+    if not sum(sizes):
+        return []
+    factors = np.repeat([factor for _, _, factor in recipes], sizes)
+    owners = np.repeat([recipe_id for recipe_id, _, _ in recipes], sizes)
+    # number every key of the request once, then translate each form's own ids
+    ids: dict[Key, int] = {}
+    translated = []
+    for form in forms:
+        local = [ids.setdefault(k, len(ids)) for k in form.names]
+        translated.append(np.array(local, dtype=np.int64)[form.keys])
+    keys = np.concatenate(translated)
+
+    groups, inverse = np.unique(keys, return_inverse=True)
+    count = len(groups)
+    low = np.bincount(
+        inverse,
+        weights=np.concatenate([f.low for f in forms]) * factors,
+        minlength=count,
+    )
+    high = np.bincount(
+        inverse,
+        weights=np.concatenate([f.high for f in forms]) * factors,
+        minlength=count,
+    )
+    known = np.bincount(
+        inverse, weights=np.concatenate([f.known for f in forms]), minlength=count
+    )
+
+    # which recipes need each group: sort once by (group, recipe), dedupe
+    order = np.lexsort((owners, inverse))
+    pairs = np.stack([inverse[order], owners[order]], axis=1)
+    pairs = pairs[np.r_[True, np.any(pairs[1:] != pairs[:-1], axis=1)]]
+    bounds = np.searchsorted(pairs[:, 0], np.arange(count + 1))
+
+    notes: list[list[str]] = [[] for _ in range(count)]
+    offset = 0
+    for form, size in zip(forms, sizes):
+        for position, note in form.notes:
+            group = notes[inverse[offset + position]]
+            if note not in group:
+                group.append(note)
+        offset += size
+
+    names = list(ids)
+    named = [names[k] for k in groups.tolist()]
+    items = []
+    for g, (item, kind) in enumerate(named):
+        entry: dict[str, Any] = {
+            "item": item,
+            "quantity": None,
+            "quantity_max": None,
+            "unit": kind or None,
+            "notes": notes[g],
+            "recipe_ids": pairs[bounds[g] : bounds[g + 1], 1].tolist(),
+        }
+        if known[g]:
+            total, most = float(low[g]), float(high[g])
+            if kind in ("mass", "volume"):
+                unit = display_unit(total, kind, system)
+                total /= UNITS[unit].factor
+                most /= UNITS[unit].factor
+                entry["unit"] = unit
+            entry["quantity"] = round_quantity(total)
+            if most > total * (1 + 1e-9):
+                entry["quantity_max"] = round_quantity(most)
+        elif kind in ("mass", "volume"):
+            entry["unit"] = None
+        items.append(entry)
+    return sorted(items, key=lambda e: (e["item"], e["unit"] or ""))
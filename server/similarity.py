@@ -0,0 +1,450 @@
+"""Precomputed "similar recipes" from ingredients, category and nutrition.
+
+Every recipe is a feature vector: hashed ingredient names and words, a
+hashed category and three log-scaled nutrition values, L2-normalised so
+a dot product is the cosine similarity. The K nearest neighbours of every
+recipe are stored in the similarrecipe table, so GET /recipes/{id}/similar
+is one index range scan whatever the catalogue size.
+
+python -m server.similarity build   # (re)compute every list
+
+Creating, updating or deleting a recipe enqueues a "similar.refresh" job,
+and an import enqueues one per batch. The job updates those recipes' lists
+and the lists they enter or leave using the in-memory matrix of the job
+worker. Every worker process keeps its own matrix, so each job also logs
+what it changed in similarchange; a worker replays the rows added since it
+last looked before it refreshes anything, and reloads the whole matrix
+when it fell behind the pruned log or the lists were rebuilt.
+
+The matrix holds 4 * DIMS bytes (~1.1 KiB) per recipe in every worker
+process: ~1.1 GiB at a million recipes, which is where this design stops
+fitting and an approximate nearest-neighbour index should take over.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections.abc import Iterable, Sequence
+from typing import Any
+
+import numpy as np
+from sqlalchemy import Engine, delete, func, insert
+from sqlmodel import Session, select
+
+from .jobs import jobs
+from .metrics import metrics
+from .models import Recipe, SimilarChange, SimilarRecipe
+
+K = 10
+INGREDIENT_DIMS = 256
+CATEGORY_DIMS = 32
+DIMS = INGREDIENT_DIMS + CATEGORY_DIMS + 3
+CATEGORY_WEIGHT = 0.5
+NUTRITION_WEIGHT = 0.5
+# calories, prep_time, servings of a typical recipe: the nutrition origin
+TYPICAL = np.log1p(np.array([400, 30, 4], dtype=np.float32))
+# similarity scores held at once while computing neighbour lists (64 MiB)
+BLOCK_CELLS = 1 << 24
+LOAD_BATCH_SIZE = 5000
+# how long similarchange rows are kept for workers to catch up with
+CHANGE_RETENTION = float(os.environ.get("SIMILAR_CHANGE_RETENTION", "86400"))
+
+FEATURE_COLUMNS = (
+    Recipe.id,
+    Recipe.ingredients,
+    Recipe.category_id,
+    Recipe.calories,
+    Recipe.prep_time,
+    Recipe.servings,
+)
+
+Row = Sequence[Any]
+
+
+def ingredient_names(ingredients: str) -> list[str]:
+    # JSON objects map names to quantities; anything else is a plain list
+    try:
+        parsed = json.loads(ingredients)
+    except ValueError:
+        parsed = ingredients
+    if isinstance(parsed, dict):
+        names = [str(name) for name in parsed]
+    elif isinstance(parsed, list):
+        names = [
+            str(i.get("name", "")) if isinstance(i, dict) else str(i) for i in parsed
+        ]
+    else:
+        names = re.split(r"[,;\n]", str(parsed))
+    words = (re.sub(r"[^a-z\s]", " ", name.lower()).split() for name in names)
+    return [" ".join(w) for w in words if w]
+
+
+def bucket(token: str, dims: int) -> int:
+    # crc32 rather than hash(): vectors must agree across processes
+    return zlib.crc32(token.encode()) % dims
+
+
+def featurize(rows: Sequence[Row]) -> np.ndarray:
+    matrix = np.zeros((len(rows), DIMS), dtype=np.float32)
+    for i, (_, ingredients, category_id, *_) in enumerate(rows):
+        for name in ingredient_names(ingredients):
+            matrix[i, bucket(name, INGREDIENT_DIMS)] += 1.0
+            # "cheddar cheese" still shares something with "cheese"
+            for word in name.split():
+                matrix[i, bucket(word, INGREDIENT_DIMS)] += 0.5
+        if category_id is not None:
+            column = INGREDIENT_DIMS + bucket(str(category_id), CATEGORY_DIMS)
+            matrix[i, column] = CATEGORY_WEIGHT
+
+    ingredients = matrix[:, :INGREDIENT_DIMS]
+    norms = np.linalg.norm(ingredients, axis=1, keepdims=True)
+    np.divide(ingredients, norms, out=ingredients, where=norms > 0)
+
+    nutrition = np.array([row[3:6] for row in rows], dtype=np.float32).reshape(-1, 3)
+    nutrition = np.log1p(np.maximum(nutrition, 0)) - TYPICAL
+    matrix[:, -3:] = np.clip(nutrition / 2, -1, 1) * NUTRITION_WEIGHT / np.sqrt(3)
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+class SimilarityIndex:
+    """Feature vectors of every recipe, plus the score each list must beat."""
+
+    def __init__(self, k: int = K):
+        self.k: int = k
+        self.size: int = 0
+        self.ids: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.vectors: np.ndarray = np.zeros((0, DIMS), dtype=np.float32)
+        # k-th best score of each stored list, -inf while it has fewer than k
+        self.floors: np.ndarray = np.zeros(0, dtype=np.float32)
+        self.positions: dict[int, int] = {}
+        # the last similarchange row reflected here
+        self.version: int = 0
+
+    def load(self, session: Session):
+        # read first: a change committed while loading is replayed, harmlessly
+        self.version = session.exec(select(func.max(SimilarChange.id))).one() or 0
+        result = session.exec(
+            select(*FEATURE_COLUMNS)
+            .order_by(Recipe.id)  # pyright: ignore
+            .execution_options(yield_per=LOAD_BATCH_SIZE)
+        )
+        for rows in result.partitions():
+            self.extend([r[0] for r in rows], featurize(rows))
+
+        self.floors[: self.size] = -np.inf
+        for recipe_id, floor, count in session.exec(
+            select(
+                SimilarRecipe.recipe_id,
+                func.min(SimilarRecipe.score),
+                func.count(),
+            ).group_by(SimilarRecipe.recipe_id)
+        ):
+            position = self.positions.get(recipe_id)
+            if position is not None and count >= self.k:
+                self.floors[position] = floor
+
+    def replay(self, session: Session) -> bool:
+        """Applies the changes logged since this index last looked.
+
+        This worker's own rows come back too; applying them again is a
+        no-op. False when the index has to be loaded again instead.
+        """
+        oldest, newest = session.exec(
+            select(func.min(SimilarChange.id), func.max(SimilarChange.id))
+        ).one()
+        if newest is None or newest <= self.version:
+            return True
+        if oldest > self.version + 1:
+            # rows this index never saw were pruned
+            return False
+        changed: set[int] = set()
+        floors: dict[int, float] = {}
+        for change_id, recipe_id, floor in session.exec(
+            select(SimilarChange.id, SimilarChange.recipe_id, SimilarChange.floor)
+            .where(SimilarChange.id > self.version)
+            .order_by(SimilarChange.id)  # pyright: ignore
+        ):
+            if recipe_id is None:
+                return False
+            if floor is None:
+                changed.add(recipe_id)
+            else:
+                floors[recipe_id] = floor
+            self.version = change_id
+
+        ordered = sorted(changed)
+        for i in range(0, len(ordered), LOAD_BATCH_SIZE):
+            chunk = ordered[i : i + LOAD_BATCH_SIZE]
+            rows = session.exec(
+                select(*FEATURE_COLUMNS).where(Recipe.id.in_(chunk))  # pyright: ignore
+            ).all()
+            if rows:
+                for row, vector in zip(rows, featurize(rows)):
+                    self.upsert(row[0], vector)
+            for recipe_id in set(chunk) - {row[0] for row in rows}:
+                self.remove(recipe_id)
+        for recipe_id, floor in floors.items():
+            position = self.positions.get(recipe_id)
+            if position is not None:
+                self.floors[position] = floor
+        metrics.inc("similar_changes_replayed", len(changed) + len(floors))
+        return True
+
+    def extend(self, ids: Sequence[int], vectors: np.ndarray):
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(needed, 2 * len(self.ids), 1024)
+            self.ids = np.resize(self.ids, capacity)
+            self.floors = np.resize(self.floors, capacity)
+            grown = np.zeros((capacity, DIMS), dtype=np.float32)
+            grown[: self.size] = self.vectors[: self.size]
+            self.vectors = grown
+        end = self.size + len(ids)
+        self.ids[self.size : end] = ids
+        self.vectors[self.size : end] = vectors
+        self.floors[self.size : end] = -np.inf
+        for offset, recipe_id in enumerate(ids):
+            self.positions[recipe_id] = self.size + offset
+        self.size = end
+
+    def upsert(self, recipe_id: int, vector: np.ndarray):
+        position = self.positions.get(recipe_id)
+        if position is None:
+            self.extend([recipe_id], vector[None, :])
+        else:
+            self.vectors[position] = vector
+
+    def remove(self, recipe_id: int):
+        position = self.positions.pop(recipe_id, None)
+        if position is None:
+            return
+        last = self.size - 1
+        if position != last:
+            # the last row moves into the hole
+            moved = int(self.ids[last])
+            self.ids[position] = moved
+            self.vectors[position] = self.vectors[last]
+            self.floors[position] = self.floors[last]
+            self.positions[moved] = position
+        self.size = last
+
+    def neighbours(
+        self, positions: np.ndarray
+    ) -> Iterable[tuple[int, list[tuple[int, float]]]]:
+        """Top-k lists for the given rows, a block of rows per matmul."""
+        vectors = self.vectors[: self.size]
+        k = min(self.k, self.size - 1)
+        block = max(1, BLOCK_CELLS // max(self.size, 1))
+        for start in range(0, len(positions), block):
+            rows = positions[start : start + block]
+            scores = self.vectors[rows] @ vectors.T
+            scores[np.arange(len(rows)), rows] = -np.inf
+            if k <= 0:
+                for row in rows:
+                    yield int(self.ids[row]), []
+                continue
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            for row, columns, values in zip(rows, top, top_scores):
+                self.floors[row] = values[-1] if k == self.k else -np.inf
+                yield int(self.ids[row]), [
+                    (int(self.ids[c]), float(v)) for c, v in zip(columns, values)
+                ]
+
+
+def write_lists(session: Session, lists: list[tuple[int, list[tuple[int, float]]]]):
+    _ = session.exec(
+        delete(SimilarRecipe).where(
+            SimilarRecipe.recipe_id.in_([r for r, _ in lists])  # pyright: ignore
+        )
+    )
+    rows = [
+        {"recipe_id": recipe_id, "similar_id": similar_id, "score": score}
+        for recipe_id, neighbours in lists
+        for similar_id, score in neighbours
+    ]
+    if rows:
+        _ = session.exec(insert(SimilarRecipe), params=rows)  # pyright: ignore
+
+
+_index: SimilarityIndex | None = None
+_lock = threading.Lock()
+
+
+def build(engine: Engine, k: int = K, chunk_size: int = 1000) -> SimilarityIndex:
+    """Recomputes every list; quadratic in the number of recipes."""
+    global _index
+    with _lock:
+        index = SimilarityIndex(k)
+        with Session(engine) as session:
+            index.load(session)
+        with Session(engine) as session:
+            # lists of deleted recipes
+            _ = session.exec(
+                delete(SimilarRecipe).where(
+                    SimilarRecipe.recipe_id.not_in(select(Recipe.id))  # pyright: ignore
+                )
+            )
+            lists = []
+            for item in index.neighbours(np.arange(index.size)):
+                lists.append(item)
+                if len(lists) == chunk_size:
+                    write_lists(session, lists)
+                    session.commit()
+                    lists = []
+            if lists:
+                write_lists(session, lists)
+            # every worker's matrix and floors predate this; make them reload
+            reset = SimilarChange(created_at=time.time())
+            session.add(reset)
+            session.flush()
+            _ = session.exec(
+                delete(SimilarChange).where(
+                    SimilarChange.id < reset.id  # pyright: ignore
+                )
+            )
+            session.commit()
+            index.version = reset.id or 0
+        _index = index
+        return index
+
+
+def refresh(engine: Engine, recipe_ids: Sequence[int]) -> int:
+    """Brings the lists in line with created, changed or deleted recipes.
+
+    Returns how many lists were rewritten.
+    """
+    global _index
+    with _lock:
+        with Session(engine) as session:
+            if _index is None or not _index.replay(session):
+                metrics.inc("similar_index_loads")
+                _index = SimilarityIndex()
+                _index.load(session)
+        index = _index
+
+        with Session(engine) as session:
+            rows = {
+                row[0]: row
+                for row in session.exec(
+                    select(*FEATURE_COLUMNS).where(
+                        Recipe.id.in_(recipe_ids)  # pyright: ignore
+                    )
+                ).all()
+            }
+            # lists that hold the recipes may have to let them go
+            holders = set(
+                session.exec(
+                    select(SimilarRecipe.recipe_id).where(
+                        SimilarRecipe.similar_id.in_(recipe_ids)  # pyright: ignore
+                    )
+                ).all()
+            )
+
+            gone = [r for r in recipe_ids if r not in rows]
+            for recipe_id in gone:
+                index.remove(recipe_id)
+            if gone:
+                _ = session.exec(
+                    delete(SimilarRecipe).where(
+                        SimilarRecipe.recipe_id.in_(gone)  # pyright: ignore
+                    )
+                )
+
+            positions: set[int] = set()
+            if rows:
+                vectors = featurize(list(rows.values()))
+                for recipe_id, vector in zip(rows, vectors):
+                    index.upsert(recipe_id, vector)
+                changed = np.array([index.positions[r] for r in rows], dtype=np.int64)
+                scores = index.vectors[: index.size] @ vectors.T
+                scores[changed, np.arange(len(changed))] = -np.inf
+                # lists the recipes now get into
+                positions.update(
+                    np.flatnonzero(
+                        (scores > index.floors[: index.size, None]).any(axis=1)
+                    ).tolist()
+                )
+                positions.update(changed.tolist())
+            positions.update(
+                index.positions[h] for h in holders if h in index.positions
+            )
+
+            lists = list(index.neighbours(np.array(sorted(positions), dtype=np.int64)))
+            if lists:
+                write_lists(session, lists)
+            # for the other workers: which vectors to reload, which floors moved
+            now = time.time()
+            changes = [
+                {"recipe_id": r, "floor": None, "created_at": now} for r in recipe_ids
+            ]
+            changes.extend(
+                {
+                    "recipe_id": r,
+                    "floor": float(index.floors[index.positions[r]]),
+                    "created_at": now,
+                }
+                for r, _ in lists
+            )
+            if changes:
+                _ = session.exec(
+                    insert(SimilarChange), params=changes  # pyright: ignore
+                )
+            session.commit()
+        return len(lists)
+
+
+@jobs.periodic(CHANGE_RETENTION / 24)
+def prune_changes(engine: Engine) -> int:
+    """Drops old similarchange rows; a worker behind them reloads instead.
+
+    The newest row always stays, so ids keep growing.
+    """
+    with Session(engine) as session:
+        result = session.exec(
+            delete(SimilarChange).where(
+                SimilarChange.created_at < time.time() - CHANGE_RETENTION,
+                SimilarChange.id  # pyright: ignore
+                < select(func.max(SimilarChange.id)).scalar_subquery(),
+            )
+        )
+        session.commit()
+    return result.rowcount
+
+
+@jobs.handler("similar.refresh")
+async def refresh_job(payload: dict[str, Any]):
+    # imports send a batch; single writes send one id
+    recipe_ids = payload.get("recipe_ids") or [payload["recipe_id"]]
+    start = time.perf_counter()
+    rewritten = await asyncio.to_thread(refresh, jobs.engine, recipe_ids)
+    metrics.observe("similar_refresh_seconds", time.perf_counter() - start)
+    metrics.inc("similar_lists_rewritten", rewritten)
+
+
+def main():
+    from . import models
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    _ = sub.add_parser("build", help="recompute every neighbour list")
+    _ = parser.parse_args()
+
+    start = time.perf_counter()
+    index = build(models.engine)
+    print(f"{index.size} recipes in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient, ASGITransport
+from sqlmodel import SQLModel, create_engine
+
+from .. import models
+from ..writer import close_writers
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(tmp_path, monkeypatch):
+    """An empty database on disk, used by server.models for the test.
+
+    A module that needs rows overrides the fixture, asks for this one and
+    seeds it.
+    """
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False}
+    )
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(models, "engine", engine)
+    yield engine
+    close_writers()
+
+
+@pytest_asyncio.fixture(name="client")
+async def client_fixture(app):
+    """A client for the module's `app` fixture, which wires its routers."""
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        yield ac
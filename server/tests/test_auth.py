@@ -0,0 +1,101 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+from fastapi import FastAPI
+from sqlmodel import SQLModel, Session, create_engine, select
+
+from ..models import get_session, User
+from ..routes import auth as auth_router
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(tmp_path):
+    db_path = tmp_path / "test.db"
+    engine = create_engine(
+        f"sqlite:///{db_path}", connect_args={"check_same_thread": False}
+    )
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture(name="session")
+def session_fixture(engine):
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="app")
+def app_fixture(session):
+    app = FastAPI()
+
+    def get_session_override():
+        yield session
+
+    app.dependency_overrides[get_session] = get_session_override
+    app.include_router(auth_router.router, prefix="/auth")
+    return app
+
+
+USER = {"email": "bob@example.com", "username": "bob", "password": "secret"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_register_sets_tokens(app, engine):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.post("/auth/register", json=USER)
+    assert resp.status_code == 200
+    assert "access_token" in resp.cookies
+    with Session(engine) as s:
+        user = s.exec(select(User)).one()
+    assert user.refresh_token == resp.cookies["refresh_token"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_register_invalid_email(app):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.post("/auth/register", json={**USER, "email": "nope"})
+    assert resp.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_login_rotates_refresh_token(app, engine):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        first = await ac.post("/auth/register", json=USER)
+        resp = await ac.post(
+            "/auth/login", json={"email": USER["email"], "password": "secret"}
+        )
+    assert resp.status_code == 200
+    refresh = resp.cookies["refresh_token"]
+    assert refresh != first.cookies["refresh_token"]
+    with Session(engine) as s:
+        assert s.exec(select(User)).one().refresh_token == refresh
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_login_wrong_password(app):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json=USER)
+        resp = await ac.post(
+            "/auth/login", json={"email": USER["email"], "password": "wrong"}
+        )
+    assert resp.status_code == 401
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_register_is_rate_limited(app):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        responses = [
+            await ac.post("/auth/register", json={**USER, "email": "bad"})
+            for _ in range(6)
+        ]
+    assert [r.status_code for r in responses] == [400] * 5 + [429]
+    assert "RateLimit-Reset" in responses[-1].headers
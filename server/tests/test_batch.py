@@ -0,0 +1,246 @@
+import asyncio
+import time
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from fastapi import FastAPI
+from sqlmodel import Session, select
+
+from .. import models
+from ..jobs import jobs
+from ..models import Category, Comment, Recipe, User
+from ..pubsub import comment_events
+from ..routes import auth
+from ..routes.auth import sign_jwt
+from ..routes.batch import router as batch_router
+from ..routes.comments import router as comments_router
+from ..routes.recipes import router as recipes_router
+
+
+RECIPE = {
+    "name": "Soup",
+    "description": "Warm",
+    "instructions": "Boil",
+    "ingredients": "water",
+    "calories": 100,
+    "prep_time": 10,
+    "servings": 2,
+    "category_id": 1,
+}
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    with Session(engine) as session:
+        session.add(Category(name="Soups", slug="soups", description=None))
+        session.add(User(username="cook", password="x", role="USER"))
+        session.commit()
+    return engine
+
+
+@pytest.fixture(name="app")
+def app_fixture(engine):
+    app = FastAPI()
+    app.include_router(recipes_router, prefix="/recipes")
+    app.include_router(comments_router, prefix="/comments")
+    app.include_router(batch_router, prefix="/batch")
+    return app
+
+
+@pytest.fixture(name="client")
+def client_fixture(client):
+    # sub-requests get the batch's cookies, not a dependency override
+    token, refresh = sign_jwt(1, "USER")
+    client.cookies.update({"access_token": token, "refresh_token": refresh})
+    return client
+
+
+@pytest.fixture(name="effects")
+def effects_fixture(engine, monkeypatch):
+    """Events and job wakeups, each with the comments committed at the time."""
+    effects = []
+
+    def committed():
+        with Session(engine) as session:
+            return len(session.exec(select(Comment)).all())
+
+    monkeypatch.setattr(
+        comment_events,
+        "publish",
+        lambda topic, event, data: effects.append((event, committed())),
+    )
+    monkeypatch.setattr(jobs, "notify", lambda: effects.append(("notify", committed())))
+    return effects
+
+
+def comment(recipe_id, title="Nice"):
+    return {
+        "method": "POST",
+        "path": "/comments/",
+        "body": {"title": title, "text": "t", "rating": 4, "recipe_id": recipe_id},
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_batch_runs_operations_in_one_transaction(
+    engine, client, monkeypatch, effects
+):
+    decoded = []
+    decode_jwt = auth.decode_jwt
+    monkeypatch.setattr(
+        auth, "decode_jwt", lambda t: decoded.append(t) or decode_jwt(t)
+    )
+
+    resp = await client.post(
+        "/batch/",
+        json={
+            "operations": [
+                {"method": "POST", "path": "/recipes/", "body": RECIPE},
+                comment(1),
+                comment(1, "Great"),
+                {"method": "GET", "path": "/recipes/1/comments?limit=1"},
+            ]
+        },
+    )
+
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["committed"] is True
+    assert [r["status"] for r in data["results"]] == [201, 201, 201, 200]
+    assert data["results"][0]["body"]["slug"] == "soup"
+    assert [c["title"] for c in data["results"][3]["body"]] == ["Nice"]
+    assert len(decoded) == 1  # sub-requests reuse the batch's user
+
+    with Session(engine) as session:
+        assert len(session.exec(select(Comment)).all()) == 2
+    # released only once the batch committed
+    assert effects == [("notify", 2), ("created", 2), ("created", 2)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_atomic_batch_rolls_back_on_failure(engine, client, effects):
+    resp = await client.post(
+        "/batch/",
+        json={
+            "operations": [
+                {"method": "POST", "path": "/recipes/", "body": RECIPE},
+                comment(1),
+                comment(999),
+                comment(1, "Never"),
+            ]
+        },
+    )
+
+    data = resp.json()
+    assert data["committed"] is False
+    assert [r["status"] for r in data["results"]] == [201, 201, 404, 424]
+    with Session(engine) as session:
+        assert session.exec(select(Recipe)).all() == []
+        assert session.exec(select(Comment)).all() == []
+    # no events or wakeups for rows that never existed
+    assert effects == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_best_effort_batch_keeps_successes(engine, client, effects):
+    resp = await client.post(
+        "/batch/",
+        json={
+            "mode": "best_effort",
+            "operations": [
+                {"method": "POST", "path": "/recipes/", "body": RECIPE},
+                comment(999),
+                comment(1),
+            ],
+        },
+    )
+
+    data = resp.json()
+    assert data["committed"] is True
+    assert [r["status"] for r in data["results"]] == [201, 404, 201]
+    with Session(engine) as session:
+        assert len(session.exec(select(Recipe)).all()) == 1
+        assert len(session.exec(select(Comment)).all()) == 1
+    assert effects == [("notify", 1), ("created", 1)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_batch_limits(client):
+    too_many = await client.post(
+        "/batch/",
+        json={"operations": [comment(1)] * (models.MAX_BATCH_OPERATIONS + 1)},
+    )
+    nested = await client.post(
+        "/batch/",
+        json={"operations": [{"method": "POST", "path": "/batch/", "body": {}}]},
+    )
+    assert too_many.status_code == 422
+    assert nested.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_batch_requires_auth(engine):
+    app = FastAPI()
+    app.include_router(batch_router, prefix="/batch")
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        resp = await ac.post(
+            "/batch/", json={"operations": [{"method": "GET", "path": "/"}]}
+        )
+    assert resp.status_code == 403
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_concurrent_write_waits_for_batch(engine):
+    app = FastAPI()
+    app.include_router(batch_router, prefix="/batch")
+    started, release = asyncio.Event(), asyncio.Event()
+
+    @app.post("/slow")
+    async def slow(session: models.SessionDep):
+        session.add(Category(name="Slow", slug="slow", description=None))
+        session.commit()  # only releases a savepoint, the batch stays open
+        started.set()
+        await release.wait()
+        return {"ok": True}
+
+    @app.post("/direct")
+    async def direct(session: models.SessionDep):
+        session.add(Category(name="Direct", slug="direct", description=None))
+        session.commit()
+        return {"ok": True}
+
+    token, refresh = sign_jwt(1, "USER")
+    async with AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url="http://test",
+        cookies={"access_token": token, "refresh_token": refresh},
+    ) as ac:
+        batch = asyncio.create_task(
+            ac.post(
+                "/batch/", json={"operations": [{"method": "POST", "path": "/slow"}]}
+            )
+        )
+        await started.wait()
+        write = asyncio.create_task(ac.post("/direct"))
+
+        # the write waits for the batch without blocking the loop
+        start = time.perf_counter()
+        await asyncio.sleep(0.05)
+        assert time.perf_counter() - start < 0.5
+        assert not write.done()
+
+        release.set()
+        assert (await batch).json()["committed"] is True
+        assert (await write).status_code == 200
+
+    with Session(engine) as session:
+        slugs = session.exec(select(Category.slug)).all()
+    assert sorted(slugs) == ["direct", "slow", "soups"]
@@ -0,0 +1,53 @@
+import json
+import random
+
+import pytest
+
+from ..bench.micro import betainc, compare, main, welch
+
+
+def test_betainc_matches_known_values():
+    assert betainc(1, 1, 0.3) == pytest.approx(0.3)
+    assert betainc(2, 3, 0.4) == pytest.approx(0.5248)
+    assert betainc(0.5, 0.5, 0.5) == pytest.approx(0.5)
+
+
+def test_welch_p_value():
+    # equal variances and sizes give 10 degrees of freedom, where t = 2.228
+    # is the two-sided 5% critical value
+    a = [-1.0, 1.0] * 3
+    b = [x + 2.228 * 0.4**0.5 for x in a]
+    t, p = welch(a, b)
+    assert t == pytest.approx(2.228)
+    assert p == pytest.approx(0.05, abs=1e-3)
+    _, same = welch([1.0, 2.0, 3.0], [1.0, 2.0, 3.0])
+    assert same == pytest.approx(1.0)
+
+
+def run(means, spread=0.02, n=15, seed=0):
+    rng = random.Random(seed)
+    benchmarks = {}
+    for name, mean in means.items():
+        samples = [mean * (1 + rng.uniform(-spread, spread)) for _ in range(n)]
+        benchmarks[name] = {
+            "mean": sum(samples) / n,
+            "samples": samples,
+            "normalized": samples,
+        }
+    return {"benchmarks": benchmarks}
+
+
+def test_compare_flags_only_significant_changes():
+    baseline = run({"a": 1.0, "b": 1.0, "c": 1.0, "gone": 1.0})
+    current = run({"a": 1.3, "b": 1.01, "c": 0.7, "new": 1.0}, seed=1)
+
+    verdicts = {name: verdict for name, _, _, verdict in compare(baseline, current)}
+    assert verdicts == {"a": "slower", "b": "same", "c": "faster", "new": "missing"}
+
+
+def test_compare_cli_fails_on_missing_baseline(tmp_path, capsys):
+    baseline, current = tmp_path / "baseline.json", tmp_path / "current.json"
+    _ = baseline.write_text(json.dumps(run({"a": 1.0})))
+    _ = current.write_text(json.dumps(run({"a": 1.0, "new": 1.0})))
+    assert main(["compare", str(baseline), str(current)]) == 1
+    assert "1 benchmark(s) without a baseline: new" in capsys.readouterr().out
@@ -3,8 +3,9 @@ from httpx import AsyncClient, ASGITransport
 from fastapi import FastAPI
 from sqlmodel import SQLModel, Session, create_engine
 
-from ..models import get_session
+from ..models import get_session, User
 from ..routes import categories as categories_router
+from ..routes.auth import get_current_user
 
 
 @pytest.fixture(name="engine")
@@ -35,6 +36,17 @@ def app_fixture(session):
     return app
 
 
+@pytest.fixture(name="admin")
+def admin_fixture(app, session):
+    """Create an admin and authenticate every request as them."""
+    user = User(username="admin", password="x", role="ADMIN")
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+    app.dependency_overrides[get_current_user] = lambda: (user, user.role)
+    return user
+
+
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore::ResourceWarning")
 async def test_create_category_success(app):
@@ -55,7 +67,7 @@ async def test_create_category_success(app):
 
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore::ResourceWarning")
-async def test_create_category_conflict(app):
+async def test_create_category_duplicate_name_gets_suffix(app, admin):
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
         # create once
@@ -63,13 +75,13 @@ async def test_create_category_conflict(app):
             "/categories/",
             json={"name": "Drinks", "description": None, "parent_category": None},
         )
-        # duplicate slug
+        # same name gets the next free slug instead of a conflict
         resp = await ac.post(
             "/categories/",
             json={"name": "Drinks", "description": None, "parent_category": None},
         )
-    assert resp.status_code == 409
-    assert "already exists" in resp.json()["message"]
+    assert resp.status_code == 201
+    assert resp.json()["slug"] == "drinks-2"
 
 
 @pytest.mark.asyncio
@@ -169,7 +181,7 @@ async def test_update_category_not_found(app):
 
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore::DeprecationWarning")
-async def test_update_category_conflict(app):
+async def test_update_category_duplicate_name_gets_suffix(app, admin):
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
         # Create first category
@@ -183,10 +195,10 @@ async def test_update_category_conflict(app):
             json={"name": "Category B", "description": None, "parent_category": None},
         )
         cid = post.json()["id"]
-        # Try to update to duplicate name
+        # Renaming onto an existing name picks a free suffix
         resp = await ac.patch(f"/categories/{cid}", json={"name": "Category A"})
-    assert resp.status_code == 409
-    assert "already exists" in resp.json()["message"]
+    assert resp.status_code == 200
+    assert resp.json()["slug"] == "category-a-2"
 
 
 @pytest.mark.asyncio
@@ -314,3 +326,72 @@ async def test_read_recipes_pagination(app, session):
         resp = await ac.get(f"/categories/{cid}/recipes?offset=2&limit=2")
     assert resp.status_code == 200
     assert len(resp.json()) == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_recipes_card_view(app, session):
+    from ..models import Category, Recipe
+
+    category = Category(name="Cards", description=None, slug="cards")
+    session.add(category)
+    session.commit()
+    session.refresh(category)
+    session.add(
+        Recipe(
+            name="Recipe 1",
+            slug="recipe-1",
+            description="Test",
+            instructions="Test",
+            ingredients="Test",
+            calories=100,
+            prep_time=10,
+            servings=2,
+            category_id=category.id,
+        )
+    )
+    session.commit()
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get(f"/categories/{category.id}/recipes?view=card")
+    assert resp.status_code == 200
+    assert resp.json() == [
+        {
+            "id": 1,
+            "name": "Recipe 1",
+            "slug": "recipe-1",
+            "calories": 100,
+            "prep_time": 10,
+        }
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_category_by_slug_and_redirect(app, session):
+    from ..models import Category, User
+    from ..routes.auth import get_current_user
+
+    admin = User(username="admin", password="x", role="ADMIN")
+    session.add(admin)
+    session.commit()
+    app.dependency_overrides[get_current_user] = lambda: (admin, "ADMIN")
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        post = await ac.post(
+            "/categories/",
+            json={"name": "Soups", "description": None, "parent_category": None},
+        )
+        cid = post.json()["id"]
+        found = await ac.get("/categories/by-slug/soups")
+        await ac.patch(f"/categories/{cid}", json={"name": "Stews"})
+        moved = await ac.get("/categories/by-slug/soups")
+        missing = await ac.get("/categories/by-slug/salads")
+    assert found.json()["id"] == cid
+    assert moved.status_code == 301
+    assert moved.headers["location"].endswith("/categories/by-slug/stews")
+    assert missing.status_code == 404
+    assert session.get(Category, cid).slug == "stews"
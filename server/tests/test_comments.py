@@ -4,7 +4,9 @@ from fastapi import FastAPI
 from sqlmodel import SQLModel, Session, create_engine
 
 from ..models import get_session, Category, Recipe, User
+from ..pubsub import comment_events
 from ..routes import comments as comments_router
+from ..routes.auth import get_current_user
 
 
 @pytest.fixture(name="engine")
@@ -50,6 +52,13 @@ def user_fixture(session):
     return user
 
 
+@pytest.fixture(name="authed")
+def authed_fixture(app, user):
+    """Authenticate every request as the test user."""
+    app.dependency_overrides[get_current_user] = lambda: (user, user.role)
+    return user
+
+
 @pytest.fixture(name="recipe")
 def recipe_fixture(session):
     category = Category(
@@ -410,3 +419,91 @@ async def test_delete_comment_not_found(app):
         resp = await ac.delete("/comments/999")
     assert resp.status_code == 404
     assert resp.json()["message"] == "Comment not found"
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_comment_writes_publish_events(app, recipe, authed):
+    sub = comment_events.subscribe(recipe.id)
+    transport = ASGITransport(app=app)
+    try:
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            post = await ac.post(
+                "/comments/",
+                json={
+                    "title": "Live",
+                    "text": "Hello",
+                    "rating": 4.0,
+                    "recipe_id": recipe.id,
+                },
+            )
+            comment_id = post.json()["id"]
+            await ac.patch(f"/comments/{comment_id}", json={"title": "Edited"})
+            await ac.delete(f"/comments/{comment_id}")
+        events = await sub.get(0.1)
+    finally:
+        comment_events.unsubscribe(sub)
+
+    assert [e for e, _ in events] == ["created", "updated", "deleted"]
+    assert events[0][1]["title"] == "Live"
+    assert events[1][1]["title"] == "Edited"
+    assert events[2][1] == {"id": comment_id}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_comment_writes_keep_recipe_rating(app, session, recipe, authed):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        ids = []
+        for rating in (4.0, 2.0):
+            post = await ac.post(
+                "/comments/",
+                json={
+                    "title": "t",
+                    "text": "t",
+                    "rating": rating,
+                    "recipe_id": recipe.id,
+                },
+            )
+            ids.append(post.json()["id"])
+        session.refresh(recipe)
+        assert recipe.rating == 3.0
+
+        await ac.patch(f"/comments/{ids[1]}", json={"rating": 5.0})
+        session.refresh(recipe)
+        assert recipe.rating == 4.5
+
+        await ac.delete(f"/comments/{ids[0]}")
+        await ac.delete(f"/comments/{ids[1]}")
+        session.refresh(recipe)
+        assert recipe.rating == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_update_comment_deleted_concurrently(app, recipe, authed, monkeypatch):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        post = await ac.post(
+            "/comments/",
+            json={"title": "t", "text": "t", "rating": 4.0, "recipe_id": recipe.id},
+        )
+        comment_id = post.json()["id"]
+
+        write = comments_router.write
+
+        async def delete_first(session, fn):
+            # another request removes the comment while this one is queued
+            db = session.get(comments_router.Comment, comment_id)
+            session.delete(db)
+            session.commit()
+            return await write(session, fn)
+
+        monkeypatch.setattr(comments_router, "write", delete_first)
+        resp = await ac.patch(f"/comments/{comment_id}", json={"rating": 5.0})
+    assert resp.status_code == 404
+    assert resp.json() == {"message": "Comment not found"}
@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from sqlmodel import Session
+
+from ..counters import (
+    COMMENTS,
+    RECIPES,
+    bump,
+    bump_many,
+    category_recipes,
+    read_count,
+    reconcile_counters,
+    recipe_comments,
+)
+from ..jobs import JobQueue
+from ..models import Category, Comment, Counter, Recipe, User
+from ..routes import categories, comments, recipes
+from ..routes.auth import get_current_user
+
+
+@pytest.fixture(name="user")
+def user_fixture(engine):
+    with Session(engine, expire_on_commit=False) as session:
+        user = User(username="u", email="u@x.io", password="x", role="ADMIN")
+        session.add(user)
+        session.add(Category(name="Soup", description=None, slug="soup"))
+        session.add(Category(name="Cake", description=None, slug="cake"))
+        session.commit()
+        return user
+
+
+@pytest.fixture(name="app")
+def app_fixture(user):
+    app = FastAPI()
+    app.include_router(categories.router, prefix="/categories")
+    app.include_router(recipes.router, prefix="/recipes")
+    app.include_router(comments.router, prefix="/comments")
+    app.dependency_overrides[get_current_user] = lambda: (user, "ADMIN")
+    return app
+
+
+def recipe(category_id=1, name="Soup"):
+    return {
+        "name": name,
+        "description": None,
+        "instructions": "Boil",
+        "ingredients": "water",
+        "calories": 100,
+        "prep_time": 10,
+        "servings": 2,
+        "category_id": category_id,
+    }
+
+
+def test_bump_creates_and_adds(engine):
+    with Session(engine) as session:
+        bump(session, RECIPES)
+        bump(session, RECIPES, 4)
+        bump(session, category_recipes(1), -1)
+        session.rollback()
+        bump(session, COMMENTS, 2)
+        session.commit()
+        assert read_count(session, RECIPES) == 0
+        assert read_count(session, COMMENTS) == 2
+
+
+def test_bump_many_adds_every_delta(engine):
+    with Session(engine) as session:
+        bump(session, RECIPES, 2)
+        bump_many(session, {RECIPES: -1, category_recipes(1): 3})
+        bump_many(session, {})
+        session.commit()
+        assert read_count(session, RECIPES) == 1
+        assert read_count(session, category_recipes(1)) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+async def test_write_routes_maintain_counts(client, engine):
+    for i in range(3):
+        resp = await client.post("/recipes/", json=recipe(name=f"Soup {i}"))
+        assert resp.status_code == 201
+    resp = await client.patch("/recipes/3", json={"category_id": 2})
+    assert resp.status_code == 200
+    for _ in range(2):
+        resp = await client.post(
+            "/comments/", json={"title": "t", "text": "t", "rating": 4, "recipe_id": 1}
+        )
+        assert resp.status_code == 201
+    assert (await client.delete("/comments/2")).status_code == 200
+    assert (await client.delete("/recipes/2")).status_code == 200
+
+    resp = await client.get("/recipes/?limit=1")
+    assert resp.headers["X-Total-Count"] == "2"
+    resp = await client.get("/recipes/?category_id=1")
+    assert resp.headers["X-Total-Count"] == "1"
+    resp = await client.get("/recipes/?calories_max=50")
+    assert "X-Total-Count" not in resp.headers
+    resp = await client.get("/categories/2/recipes")
+    assert resp.headers["X-Total-Count"] == "1"
+    resp = await client.get("/categories/")
+    assert resp.headers["X-Total-Count"] == "0"
+    resp = await client.get("/comments/")
+    assert resp.headers["X-Total-Count"] == "1"
+    resp = await client.get("/recipes/1/comments")
+    assert resp.headers["X-Total-Count"] == "1"
+
+    assert (await client.get("/recipes/count")).json() == {"count": 2}
+    assert (await client.get("/categories/1/recipes/count")).json() == {"count": 1}
+    assert (await client.get("/recipes/1/comments/count")).json() == {"count": 1}
+    assert (await client.get("/comments/count")).json() == {"count": 1}
+
+    # the categories were seeded without going through the routes
+    assert reconcile_counters(engine) == 1
+    assert (await client.get("/categories/")).headers["X-Total-Count"] == "2"
+
+
+def test_reconcile_corrects_drift(engine, user):
+    with Session(engine) as session:
+        session.add(
+            Recipe(
+                **recipe(category_id=2),
+                slug="soup",
+                author_id=user.id,
+            )
+        )
+        session.add(Comment(title="t", text="t", rating=3, recipe_id=1, user_id=1))
+        session.add(Counter(name=RECIPES, value=7))
+        session.add(Counter(name=category_recipes(1), value=3))
+        session.commit()
+
+    assert reconcile_counters(engine) == 6
+    with Session(engine) as session:
+        assert read_count(session, RECIPES) == 1
+        assert read_count(session, COMMENTS) == 1
+        assert read_count(session, category_recipes(1)) == 0
+        assert session.get(Counter, category_recipes(1)) is None
+        assert read_count(session, category_recipes(2)) == 1
+        assert read_count(session, recipe_comments(1)) == 1
+    assert reconcile_counters(engine) == 0
+
+
+@pytest.mark.asyncio
+async def test_periodic_runs_until_stopped(engine):
+    queue = JobQueue(poll_interval=0.01)
+    runs = []
+
+    @queue.periodic(0.01)
+    def tick(engine):
+        runs.append(engine)
+
+    await queue.start(engine)
+    await asyncio.sleep(0.1)
+    await queue.stop()
+    seen = len(runs)
+    await asyncio.sleep(0.05)
+    assert seen >= 2
+    assert len(runs) == seen
+    assert runs[0] is engine
@@ -0,0 +1,226 @@
+import random
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from sqlmodel import Session, select
+
+from .. import duplicates
+from ..duplicates import (
+    backfill,
+    band_keys,
+    duplicate_clusters,
+    estimate,
+    find_duplicates,
+    shingles,
+    signature,
+    store_clusters,
+)
+from ..models import (
+    Category,
+    Recipe,
+    RecipeBucket,
+    RecipeCluster,
+    RecipeSignature,
+    User,
+)
+from ..routes import recipes
+from ..routes.auth import get_current_user
+
+
+WORDS = [f"word{i}" for i in range(400)]
+
+
+def instructions(seed, length=60):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def recipe(name, steps, ingredients='{"flour": "1 cup", "eggs": 2}'):
+    return {
+        "name": name,
+        "description": None,
+        "instructions": steps,
+        "ingredients": ingredients,
+        "calories": 300,
+        "prep_time": 20,
+        "servings": 2,
+        "category_id": 1,
+    }
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b)
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    with Session(engine) as session:
+        session.add(User(username="u", email="u@x.io", password="x", role="USER"))
+        session.add(Category(name="Cake", description=None, slug="cake"))
+        session.commit()
+    return engine
+
+
+@pytest.fixture(name="role")
+def role_fixture():
+    return {"value": "ADMIN"}
+
+
+@pytest.fixture(name="app")
+def app_fixture(engine, role):
+    app = FastAPI()
+    app.include_router(recipes.router, prefix="/recipes")
+    with Session(engine, expire_on_commit=False) as session:
+        user = session.get(User, 1)
+    app.dependency_overrides[get_current_user] = lambda: (user, role["value"])
+    return app
+
+
+def test_signature_estimates_jaccard():
+    base = shingles("Sponge cake", '{"flour": 1, "eggs": 2}', instructions(1, 200))
+    words = instructions(1, 200).split()
+    words[100:140] = instructions(2, 40).split()
+    edited = shingles("Sponge cake", '{"flour": 1, "eggs": 2}', " ".join(words))
+    sig_a, sig_b = signature(base), signature(edited)
+    assert sig_a.dtype == np.uint32 and len(sig_a) == 128
+    assert estimate(sig_a, sig_b) == pytest.approx(jaccard(base, edited), abs=0.12)
+    assert estimate(sig_a, signature(base)) == 1
+    assert signature(set()) is None
+
+
+def test_pairs_near_the_threshold_share_a_band():
+    rng = random.Random(7)
+    found = 0
+    for _ in range(300):
+        # 70 shared shingles and 15 of its own on each side: Jaccard 0.7
+        tokens = [f"t{rng.getrandbits(48)}" for _ in range(100)]
+        a, b = set(tokens[:85]), set(tokens[:70] + tokens[85:])
+        assert jaccard(a, b) == pytest.approx(0.7)
+        keys_a, keys_b = band_keys(np.stack([signature(a), signature(b)]))
+        found += bool(np.any(keys_a == keys_b))
+    assert found >= 297
+
+
+def test_shingles_cover_name_ingredients_and_instructions():
+    tokens = shingles("Sponge Cake", '{"Flour": 1}', "Whisk the eggs.")
+    assert tokens == {
+        "sponge cake whisk",
+        "cake whisk the",
+        "whisk the eggs",
+        "ingredient:flour",
+    }
+    assert shingles("Tea", "", "") == {"tea"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+async def test_create_warns_about_near_duplicates(client, engine):
+    steps = instructions(1)
+    resp = await client.post("/recipes/", json=recipe("Sponge cake", steps))
+    assert resp.status_code == 201
+    assert resp.json()["possible_duplicates"] == []
+
+    resp = await client.post("/recipes/", json=recipe("Sponge cake", steps + " Enjoy"))
+    assert resp.status_code == 201
+    body = resp.json()
+    assert body["slug"] == "sponge-cake-2"
+    [duplicate] = body["possible_duplicates"]
+    assert duplicate["id"] == 1 and duplicate["slug"] == "sponge-cake"
+    assert duplicate["similarity"] >= 0.7
+
+    other = recipe("Rice", instructions(2), '{"rice": 1}')
+    resp = await client.post("/recipes/", json=other)
+    assert resp.json()["possible_duplicates"] == []
+
+    # a rewritten recipe stops matching; a deleted one is forgotten
+    resp = await client.patch(
+        "/recipes/2", json={"instructions": instructions(3), "category_id": 1}
+    )
+    assert resp.status_code == 200
+    resp = await client.delete("/recipes/1")
+    assert resp.status_code == 200
+    with Session(engine) as session:
+        assert set(session.exec(select(RecipeSignature.recipe_id)).all()) == {2, 3}
+        assert set(session.exec(select(RecipeBucket.recipe_id)).all()) == {2, 3}
+        sig = signature(shingles("Sponge cake", recipe("", "")["ingredients"], steps))
+        assert find_duplicates(session, sig) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+async def test_read_duplicate_clusters(client, engine, role):
+    for name, seed in [("A", 1), ("B", 2), ("C", 3)]:
+        for suffix in ["", " Serve", " Serve warm"]:
+            _ = await client.post(
+                "/recipes/", json=recipe(f"Cake {name}", instructions(seed) + suffix)
+            )
+    _ = await client.post("/recipes/", json=recipe("Cake D", instructions(1) + " x"))
+    _ = await client.post("/recipes/", json=recipe("Bread", instructions(9)))
+
+    # nothing is served until the periodic job has stored the clusters
+    assert (await client.get("/recipes/duplicates")).json() == []
+    assert store_clusters(engine) == 3
+    with Session(engine) as session:
+        assert len(session.exec(select(RecipeCluster)).all()) == 10
+
+    resp = await client.get("/recipes/duplicates")
+    assert resp.status_code == 200
+    clusters = resp.json()
+    assert [len(c["recipes"]) for c in clusters] == [4, 3, 3]
+    assert {r["id"] for r in clusters[0]["recipes"]} == {1, 2, 3, 10}
+    assert all(c["similarity"] >= 0.7 for c in clusters)
+
+    resp = await client.get("/recipes/duplicates?offset=1&limit=1")
+    assert [{r["id"] for r in c["recipes"]} for c in resp.json()] == [{4, 5, 6}]
+
+    # deleted members drop out before the next run; a lone survivor too
+    assert (await client.delete("/recipes/5")).status_code == 200
+    assert (await client.delete("/recipes/6")).status_code == 200
+    resp = await client.get("/recipes/duplicates")
+    assert [len(c["recipes"]) for c in resp.json()] == [4, 3]
+
+    role["value"] = "USER"
+    assert (await client.get("/recipes/duplicates")).status_code == 403
+
+
+def test_backfill_indexes_unsigned_recipes(engine):
+    with Session(engine) as session:
+        for i in range(30):
+            session.add(
+                Recipe(**recipe(f"Cake {i}", instructions(i % 12)), slug=f"cake-{i}")
+            )
+        session.commit()
+
+    assert backfill(engine, workers=2, chunk_size=8) == 30
+    assert backfill(engine, workers=2) == 0
+    assert backfill(engine, workers=2, reindex=True) == 30
+    with Session(engine) as session:
+        clusters = duplicate_clusters(session)
+    assert sorted(sorted(members) for _, members in clusters) == sorted(
+        [i + 1 for i in range(30) if i % 12 == seed] for seed in range(12)
+    )
+
+
+def test_crowded_buckets_pair_linearly(engine, monkeypatch):
+    monkeypatch.setattr(duplicates, "MAX_BUCKET_PAIRS", 3)
+    with Session(engine) as session:
+        for i in range(8):
+            session.add(Recipe(**recipe("Cake", instructions(1)), slug=f"cake-{i}"))
+        session.add(Recipe(**recipe("Bread", instructions(2)), slug="bread"))
+        session.commit()
+    assert backfill(engine, workers=1) == 9
+
+    pairs = []
+    estimate_pair = duplicates.estimate
+
+    def counting(a, b):
+        pairs.append(1)
+        return estimate_pair(a, b)
+
+    monkeypatch.setattr(duplicates, "estimate", counting)
+    with Session(engine) as session:
+        [(low, members)] = duplicate_clusters(session)
+    assert low == 1.0 and sorted(members) == list(range(1, 9))
+    # 3 pairs among the first 3 members, then 1 per further member, not 28
+    assert len(pairs) == 3 + 5
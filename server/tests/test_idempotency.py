@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import time
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from sqlmodel import Session, select
+
+from ..idempotency import IdempotencyMiddleware
+from ..models import IdempotencyKey
+
+
+def make_app(engine, ttl=3600, lease=60):
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.post("/comments/", status_code=201)
+    async def create(payload: dict):
+        app.state.calls += 1
+        await asyncio.sleep(payload.get("sleep", 0))
+        if payload.get("fail"):
+            return JSONResponse(status_code=payload["fail"], content={"message": "no"})
+        if payload.get("cookie"):
+            response = JSONResponse(status_code=201, content={"n": app.state.calls})
+            response.set_cookie("access_token", payload["cookie"])
+            return response
+        return {"n": app.state.calls, **payload}
+
+    app.add_middleware(IdempotencyMiddleware, engine=engine, ttl=ttl, lease=lease)
+    return app
+
+
+@pytest.fixture(name="app")
+def app_fixture(engine):
+    return make_app(engine)
+
+
+def key(value):
+    return {"Idempotency-Key": value}
+
+
+@pytest.mark.asyncio
+async def test_retry_replays_stored_response(client, app):
+    first = await client.post("/comments/", json={"a": 1}, headers=key("k1"))
+    retry = await client.post("/comments/", json={"a": 1}, headers=key("k1"))
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.json() == first.json() == {"n": 1, "a": 1}
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    assert app.state.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_replay_carries_no_cookies(client):
+    first = await client.post("/comments/", json={"cookie": "t"}, headers=key("k1"))
+    client.cookies.clear()
+    retry = await client.post("/comments/", json={"cookie": "t"}, headers=key("k1"))
+
+    assert first.headers["set-cookie"].startswith("access_token=t")
+    assert "set-cookie" not in retry.headers
+    assert retry.json() == first.json() == {"n": 1}
+    assert retry.headers["content-type"] == "application/json"
+
+
+@pytest.mark.asyncio
+async def test_key_reused_with_other_body_is_rejected(client, app):
+    _ = await client.post("/comments/", json={"a": 1}, headers=key("k1"))
+    resp = await client.post("/comments/", json={"a": 2}, headers=key("k1"))
+    assert resp.status_code == 422
+    assert app.state.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_requests_without_key_always_run(client, app):
+    _ = await client.post("/comments/", json={"a": 1})
+    _ = await client.post("/comments/", json={"a": 1})
+    assert app.state.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_wait_for_the_first(client, app):
+    body = {"sleep": 0.1}
+    responses = await asyncio.gather(
+        *(client.post("/comments/", json=body, headers=key("k2")) for _ in range(3))
+    )
+    assert app.state.calls == 1
+    assert {r.json()["n"] for r in responses} == {1}
+    assert sum(r.headers.get("idempotent-replayed") == "true" for r in responses) == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", [503, 401, 403, 408, 409, 429])
+async def test_retryable_errors_are_not_stored(client, app, status):
+    body = {"fail": status}
+    first = await client.post("/comments/", json=body, headers=key("k3"))
+    retry = await client.post("/comments/", json=body, headers=key("k3"))
+    assert first.status_code == retry.status_code == status
+    assert app.state.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_stored(client, app):
+    first = await client.post("/comments/", json={"fail": 404}, headers=key("k5"))
+    retry = await client.post("/comments/", json={"fail": 404}, headers=key("k5"))
+    assert first.status_code == retry.status_code == 404
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert app.state.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_keys_run_again(engine):
+    app = make_app(engine, ttl=0)
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        _ = await ac.post("/comments/", json={"a": 1}, headers=key("k4"))
+        resp = await ac.post("/comments/", json={"a": 1}, headers=key("k4"))
+    assert resp.status_code == 201
+    assert app.state.calls == 2
+
+
+BODY = b'{"a": 1}'
+
+
+def leftover_claim(engine, key, locked_until):
+    # what a request that died mid-way leaves behind
+    with Session(engine) as session:
+        session.add(
+            IdempotencyKey(
+                owner="ip:127.0.0.1",
+                key=key,
+                request_hash=hashlib.sha256(b"POST /comments/\n" + BODY).hexdigest(),
+                expires_at=time.time() + 3600,
+                locked_until=locked_until,
+            )
+        )
+        session.commit()
+
+
+@pytest.mark.asyncio
+async def test_claim_of_a_dead_request_is_taken_over(engine, client, app):
+    headers = {"Content-Type": "application/json"}
+    leftover_claim(engine, "k6", time.time() - 1)
+    resp = await client.post("/comments/", content=BODY, headers=headers | key("k6"))
+    assert resp.status_code == 201
+    assert app.state.calls == 1
+
+    leftover_claim(engine, "k7", time.time() + 60)
+    resp = await client.post("/comments/", content=BODY, headers=headers | key("k7"))
+    assert resp.status_code == 409
+    assert app.state.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_lease_is_renewed_while_running(engine):
+    app = make_app(engine, lease=0.03)
+    seen = []
+
+    async def watch():
+        while True:
+            await asyncio.sleep(0.02)
+            with Session(engine) as session:
+                row = session.exec(select(IdempotencyKey)).first()
+            if row is not None and row.status is None:
+                seen.append(row.locked_until)
+
+    watcher = asyncio.create_task(watch())
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        resp = await ac.post("/comments/", json={"sleep": 0.2}, headers=key("k8"))
+    _ = watcher.cancel()
+    assert resp.status_code == 201
+    assert len(set(seen)) > 1
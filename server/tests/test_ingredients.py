@@ -0,0 +1,220 @@
+import json
+
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient, ASGITransport
+from fastapi import FastAPI
+from sqlmodel import SQLModel, Session, create_engine
+
+from .. import ingredients as parser
+from .. import models
+from ..ingredients import Ingredient, parse_ingredients, parse_number, scale
+from ..metrics import metrics
+from ..models import Recipe
+from ..routes import recipes
+from ..writer import close_writers
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("2", 2),
+        ("1.5", 1.5),
+        ("1,5", 1.5),
+        ("3/4", 0.75),
+        ("1 1/2", 1.5),
+        ("1-1/2", 1.5),
+        ("½", 0.5),
+        ("1½", 1.5),
+        ("2 ¼", 2.25),
+    ],
+)
+def test_parse_number(text, expected):
+    assert parse_number(text) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize(
+    "ingredients, expected",
+    [
+        (
+            '{"eggs": 3, "butter": "1 tbsp", "salt": "to taste", "soy_sauce": "2 Tbsp."}',
+            [
+                Ingredient("eggs", 3),
+                Ingredient("butter", 1, unit="tbsp"),
+                Ingredient("salt", note="to taste"),
+                Ingredient("soy sauce", 2, unit="tbsp"),
+            ],
+        ),
+        (
+            '["1 1/2 cups of flour", "2-3 cloves garlic", "2 to 3 carrots",'
+            ' "1 fl oz rum", "a pinch of salt"]',
+            [
+                Ingredient("flour", 1.5, unit="cup"),
+                Ingredient("garlic", 2, 3, "clove"),
+                Ingredient("carrots", 2, 3),
+                Ingredient("rum", 1, unit="fl oz"),
+                Ingredient("a pinch of salt"),
+            ],
+        ),
+        (
+            '[{"name": "milk", "quantity": "1/2", "unit": "cups"}, {"name": "egg"}]',
+            [Ingredient("milk", 0.5, unit="cup"), Ingredient("egg")],
+        ),
+        (
+            '["1-1/2 cups sugar", "1/2-3/4 cup milk", "5-3 cloves garlic",'
+            ' "½ cup", "1/2"]',
+            [
+                Ingredient("sugar", 1.5, unit="cup"),
+                Ingredient("milk", 0.5, 0.75, "cup"),
+                # a falling range isn't an amount
+                Ingredient("5-3 cloves garlic"),
+                # bare amounts name no item
+                Ingredient("", 0.5, unit="cup"),
+                Ingredient("", 0.5),
+            ],
+        ),
+        (
+            '{"flour": "1-1/2 cups", "eggs": "3-2"}',
+            [Ingredient("flour", 1.5, unit="cup"), Ingredient("eggs", note="3-2")],
+        ),
+        (
+            "water, salt;\n200 g rice\n1,5 l stock",
+            [
+                Ingredient("water"),
+                Ingredient("salt"),
+                Ingredient("rice", 200, unit="g"),
+                Ingredient("stock", 1.5, unit="l"),
+            ],
+        ),
+    ],
+)
+def test_parse_ingredients(ingredients, expected):
+    parser.clear_cache()
+    assert list(parse_ingredients(ingredients)) == expected
+
+
+def test_parsed_ingredients_are_cached():
+    parser.clear_cache()
+    text = json.dumps({"flour": "2 cups"})
+    hits = metrics.counters.get("ingredient_cache_hits", 0)
+    first = parse_ingredients(text)
+    assert parse_ingredients(text) is first
+    assert metrics.counters["ingredient_cache_hits"] == hits + 1
+    # an edited recipe is a new entry
+    assert parse_ingredients(json.dumps({"flour": "3 cups"}))[0].quantity == 3
+
+
+def test_scale_and_convert():
+    parsed = [
+        Ingredient("flour", 2, unit="cup"),
+        Ingredient("garlic", 2, 3, "clove"),
+        Ingredient("beef", 600, unit="g"),
+        Ingredient("salt", note="to taste"),
+    ]
+    assert scale(parsed, 1.5) == [
+        Ingredient("flour", 3, unit="cup"),
+        Ingredient("garlic", 3, 4.5, "clove"),
+        Ingredient("beef", 900, unit="g"),
+        Ingredient("salt", note="to taste"),
+    ]
+    assert scale(parsed, 2, "metric")[:3] == [
+        Ingredient("flour", 946, unit="ml"),
+        Ingredient("garlic", 4, 6, "clove"),
+        Ingredient("beef", 1.2, unit="kg"),
+    ]
+    assert scale(parsed, 1, "imperial")[::2] == [
+        Ingredient("flour", 2, unit="cup"),
+        Ingredient("beef", 1.32, unit="lb"),
+    ]
+    assert scale([Ingredient("oil", 1, unit="tbsp")], 1 / 3, "imperial") == [
+        Ingredient("oil", 1, unit="tsp")
+    ]
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(tmp_path, monkeypatch):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False}
+    )
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(models, "engine", engine)
+    with Session(engine) as session:
+        session.add(
+            Recipe(
+                name="Pancakes",
+                slug="pancakes",
+                description=None,
+                instructions="Mix",
+                ingredients=json.dumps(
+                    {
+                        "flour": "2 cups",
+                        "eggs": 2,
+                        "milk": "1 1/2 cups",
+                        "salt": "pinch",
+                    }
+                ),
+                calories=300,
+                prep_time=20,
+                servings=4,
+            )
+        )
+        session.commit()
+    yield engine
+    close_writers()
+
+
+@pytest_asyncio.fixture(name="client")
+async def client_fixture(engine):
+    app = FastAPI()
+    app.include_router(recipes.router, prefix="/recipes")
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        yield ac
+
+
+@pytest.mark.asyncio
+async def test_read_recipe_scaled(client):
+    body = (await client.get("/recipes/1")).json()
+    assert body["scaled_servings"] is None and body["scaled_ingredients"] is None
+
+    body = (await client.get("/recipes/1?servings=6")).json()
+    assert body["servings"] == 4 and body["scaled_servings"] == 6
+    assert body["scaled_ingredients"] == [
+        {
+            "item": "flour",
+            "quantity": 3,
+            "quantity_max": None,
+            "unit": "cup",
+            "note": None,
+        },
+        {
+            "item": "eggs",
+            "quantity": 3,
+            "quantity_max": None,
+            "unit": None,
+            "note": None,
+        },
+        {
+            "item": "milk",
+            "quantity": 2.25,
+            "quantity_max": None,
+            "unit": "cup",
+            "note": None,
+        },
+        # no amount to scale
+        {
+            "item": "salt",
+            "quantity": None,
+            "quantity_max": None,
+            "unit": None,
+            "note": "pinch",
+        },
+    ]
+
+    body = (await client.get("/recipes/1?units=metric&html=true")).json()
+    assert body["scaled_servings"] == 4
+    assert body["scaled_ingredients"][0]["unit"] == "ml"
+    assert body["instructions_html"] == "<p>Mix</p>\n"
+
+    assert (await client.get("/recipes/1?servings=0")).status_code == 422
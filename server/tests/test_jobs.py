@@ -0,0 +1,217 @@
+import asyncio
+import time
+
+import pytest
+from sqlmodel import Session, select
+
+from ..jobs import JobQueue
+from ..metrics import metrics
+from ..models import Job
+
+
+@pytest.fixture(name="queue")
+def queue_fixture(engine):
+    queue = JobQueue(poll_interval=0.01, base_backoff=0)
+    queue.engine = engine
+    return queue
+
+
+def enqueue(engine, queue, kind, payload=None):
+    with Session(engine) as session:
+        job = queue.enqueue(session, kind, payload)
+        session.commit()
+        return job.id
+
+
+def all_jobs(engine):
+    with Session(engine) as session:
+        return session.exec(select(Job)).all()
+
+
+@pytest.mark.asyncio
+async def test_job_runs_and_is_removed(engine, queue):
+    seen = []
+
+    @queue.handler("index")
+    async def index(payload):
+        seen.append(payload)
+
+    _ = enqueue(engine, queue, "index", {"recipe_id": 1})
+    await queue.run_pending()
+    assert seen == [{"recipe_id": 1}]
+    assert all_jobs(engine) == []
+
+
+@pytest.mark.asyncio
+async def test_rolled_back_enqueue_is_not_run(engine, queue):
+    @queue.handler("index")
+    def index(payload):
+        raise AssertionError("should not run")
+
+    with Session(engine) as session:
+        _ = queue.enqueue(session, "index")
+        session.rollback()
+    await queue.run_pending()
+    assert all_jobs(engine) == []
+
+
+@pytest.mark.asyncio
+async def test_failing_job_retries_then_fails(engine, queue):
+    calls = []
+
+    @queue.handler("flaky", max_attempts=3)
+    def flaky(payload):
+        calls.append(payload)
+        raise RuntimeError("boom")
+
+    _ = enqueue(engine, queue, "flaky")
+    for _ in range(5):
+        await queue.run_pending()
+    assert len(calls) == 3
+    [job] = all_jobs(engine)
+    assert job.status == "failed"
+    assert job.attempts == 3
+    assert "boom" in job.last_error
+
+
+@pytest.mark.asyncio
+async def test_retry_is_delayed_by_backoff(engine, queue):
+    queue.base_backoff = 60
+
+    @queue.handler("flaky")
+    def flaky(payload):
+        raise RuntimeError("boom")
+
+    _ = enqueue(engine, queue, "flaky")
+    await queue.run_pending()
+    await queue.run_pending()
+    [job] = all_jobs(engine)
+    assert job.status == "pending"
+    assert job.attempts == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_per_kind(engine, queue):
+    active = 0
+    peak = 0
+
+    @queue.handler("slow", concurrency=2)
+    async def slow(payload):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.02)
+        active -= 1
+
+    for _ in range(6):
+        _ = enqueue(engine, queue, "slow")
+    await queue.start(engine)
+    for _ in range(100):
+        if not all_jobs(engine):
+            break
+        await asyncio.sleep(0.01)
+    await queue.stop()
+    assert all_jobs(engine) == []
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_in_flight_jobs(engine, queue):
+    done = []
+
+    @queue.handler("slow")
+    async def slow(payload):
+        await asyncio.sleep(0.05)
+        done.append(payload)
+
+    _ = enqueue(engine, queue, "slow", {"n": 1})
+    await queue.start(engine)
+    await asyncio.sleep(0.02)
+    await queue.stop()
+    assert done == [{"n": 1}]
+    assert all_jobs(engine) == []
+
+
+@pytest.mark.asyncio
+async def test_interrupted_jobs_are_recovered_on_start(engine, queue):
+    seen = []
+
+    @queue.handler("index")
+    def index(payload):
+        seen.append(payload)
+
+    with Session(engine) as session:
+        job = queue.enqueue(session, "index", {"n": 1})
+        job.status = "running"
+        session.commit()
+
+    await queue.start(engine)
+    for _ in range(100):
+        if seen:
+            break
+        await asyncio.sleep(0.01)
+    await queue.stop()
+    assert seen == [{"n": 1}]
+
+
+@pytest.mark.asyncio
+async def test_jobs_with_a_live_lease_are_not_recovered(engine, queue):
+    @queue.handler("index")
+    def index(payload):
+        raise AssertionError("another worker still runs this job")
+
+    with Session(engine) as session:
+        job = queue.enqueue(session, "index")
+        job.status = "running"
+        job.locked_until = time.time() + 60
+        session.commit()
+
+    queue._recover()
+    await queue.run_pending()
+    [job] = all_jobs(engine)
+    assert job.status == "running"
+
+    # the owner died: once the lease runs out the job is claimed again
+    with Session(engine) as session:
+        db_job = session.get(Job, job.id)
+        db_job.locked_until = time.time() - 1
+        session.add(db_job)
+        session.commit()
+    seen = []
+    queue._types["index"].handler = seen.append
+    await queue.run_pending()
+    assert seen == [{}]
+    assert all_jobs(engine) == []
+
+
+@pytest.mark.asyncio
+async def test_lease_is_renewed_while_running(engine, queue):
+    queue.lease = 0.03
+    leases = []
+
+    @queue.handler("slow")
+    async def slow(payload):
+        for _ in range(3):
+            await asyncio.sleep(0.03)
+            leases.append(all_jobs(engine)[0].locked_until)
+
+    _ = enqueue(engine, queue, "slow")
+    await queue.run_pending()
+    assert leases == sorted(leases) and len(set(leases)) == 3
+    assert all_jobs(engine) == []
+
+
+@pytest.mark.asyncio
+async def test_metrics_record_depth_and_latency(engine, queue):
+    metrics.reset()
+
+    @queue.handler("index")
+    def index(payload):
+        pass
+
+    _ = enqueue(engine, queue, "index")
+    _ = enqueue(engine, queue, "unhandled")
+    await queue.run_pending()
+    snap = metrics.snapshot()
+    assert snap["gauges"]["jobs_queue_depth"] == 1
+    assert snap["timings"]["job_latency.index"]["count"] == 1
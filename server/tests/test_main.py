@@ -1,6 +1,6 @@
 import pytest
 from httpx import AsyncClient, ASGITransport
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from sqlmodel import SQLModel, Session, create_engine
 
 from ..main import app, lifespan
@@ -40,12 +40,30 @@ def test_app_fixture(session):
 @pytest.mark.asyncio
 async def test_lifespan_creates_db():
     """Test that lifespan context manager creates database tables."""
-    with patch("server.main.create_db_and_tables") as mock_create_db:
+    with (
+        patch("server.main.create_db_and_tables") as mock_create_db,
+        patch("server.main.schedule_stats"),
+        patch("server.main.jobs", new=AsyncMock()),
+    ):
         async with lifespan(app):
             pass
         mock_create_db.assert_called_once()
 
 
+@pytest.mark.asyncio
+async def test_lifespan_starts_and_drains_jobs():
+    """Test that the job worker runs for the lifetime of the app."""
+    with (
+        patch("server.main.create_db_and_tables"),
+        patch("server.main.schedule_stats"),
+        patch("server.main.jobs", new=AsyncMock()) as mock_jobs,
+    ):
+        async with lifespan(app):
+            mock_jobs.start.assert_awaited_once()
+            mock_jobs.stop.assert_not_awaited()
+        mock_jobs.stop.assert_awaited_once()
+
+
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore::ResourceWarning")
 async def test_app_has_categories_router(test_app):
@@ -0,0 +1,46 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+from fastapi import FastAPI
+
+from ..metrics import Metrics, metrics
+from ..routes import metrics as metrics_router
+
+
+@pytest.fixture(name="app")
+def app_fixture():
+    app = FastAPI()
+    app.include_router(metrics_router.router, prefix="/metrics")
+    metrics.reset()
+    yield app
+    metrics.reset()
+
+
+def test_metrics_counters_and_gauges():
+    m = Metrics()
+    m.inc("requests")
+    m.inc("requests", 2)
+    m.set("depth", 5)
+    snap = m.snapshot()
+    assert snap["counters"]["requests"] == 3
+    assert snap["gauges"]["depth"] == 5
+
+
+def test_metrics_timer_records_observation():
+    m = Metrics()
+    with m.timer("work"):
+        pass
+    m.observe("work", 0.5)
+    timing = m.snapshot()["timings"]["work"]
+    assert timing["count"] == 2
+    assert timing["max_seconds"] == 0.5
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_metrics(app):
+    metrics.inc("hits")
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/metrics/")
+    assert resp.status_code == 200
+    assert resp.json()["counters"]["hits"] == 1
@@ -1,5 +1,6 @@
 import pytest
 from decimal import Decimal
+from pathlib import Path
 from sqlalchemy.pool import StaticPool
 from sqlmodel import Session, select, SQLModel, create_engine
 from sqlalchemy import inspect
@@ -72,6 +73,72 @@ def test_create_db_and_tables_creates_tables(tmp_path):
         assert table in tables
 
 
+# the schema of the first release, before PRAGMA user_version was kept
+FIRST_RELEASE = """
+CREATE TABLE category (name VARCHAR NOT NULL, description VARCHAR,
+    parent_category INTEGER, slug VARCHAR NOT NULL, id INTEGER NOT NULL,
+    PRIMARY KEY (id), UNIQUE (slug));
+CREATE TABLE user (email VARCHAR, username VARCHAR NOT NULL,
+    password VARCHAR NOT NULL, id INTEGER NOT NULL, refresh_token VARCHAR,
+    role VARCHAR NOT NULL, PRIMARY KEY (id));
+CREATE TABLE recipe (name VARCHAR NOT NULL, description VARCHAR,
+    instructions VARCHAR NOT NULL, ingredients VARCHAR NOT NULL,
+    calories INTEGER NOT NULL, prep_time INTEGER NOT NULL,
+    servings INTEGER NOT NULL, category_id INTEGER, id INTEGER NOT NULL,
+    author_id INTEGER, slug VARCHAR NOT NULL, PRIMARY KEY (id), UNIQUE (slug));
+CREATE TABLE comment (title VARCHAR NOT NULL, text VARCHAR NOT NULL,
+    rating NUMERIC(2, 1) NOT NULL, recipe_id INTEGER, user_id INTEGER NOT NULL,
+    id INTEGER NOT NULL, PRIMARY KEY (id));
+INSERT INTO user VALUES ('a@x.io', 'a', 'x', 1, NULL, 'USER');
+INSERT INTO recipe VALUES ('Soup', NULL, 'Boil', 'water', 100, 10, 2, NULL, 1,
+    1, 'soup');
+INSERT INTO comment VALUES ('t', 't', 4, 1, 1, 1), ('t', 't', 2, 1, 1, 2);
+"""
+
+
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+def test_create_db_and_tables_upgrades_an_old_database(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    conn = engine.raw_connection()
+    conn.executescript(FIRST_RELEASE)
+    conn.close()
+    monkeypatch.setattr(models, "engine", engine)
+
+    models.create_db_and_tables()
+    models.create_db_and_tables()
+
+    inspector = inspect(engine)
+    assert set(SQLModel.metadata.tables) <= set(inspector.get_table_names())
+    for table in SQLModel.metadata.sorted_tables:
+        columns = {c["name"] for c in inspector.get_columns(table.name)}
+        assert columns == set(table.columns.keys()), table.name
+        indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        assert {i.name for i in table.indexes} <= indexes, table.name
+    with Session(engine) as session:
+        recipe = session.get(models.Recipe, 1)
+        assert recipe.rating == 3 and recipe.view_count == 0
+        assert recipe.created_at > 0 and recipe.rendered_instructions is None
+        version = session.connection().exec_driver_sql("PRAGMA user_version")
+        assert version.scalar() == models.SCHEMA_VERSION
+        # nothing was seeded into a database that had data
+        assert session.exec(select(models.Category)).all() == []
+    engine.dispose()
+
+
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+def test_create_db_and_tables_seeds_a_new_database(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    monkeypatch.setattr(models, "engine", engine)
+    monkeypatch.chdir(Path(models.__file__).parent)
+
+    models.create_db_and_tables()
+    with Session(engine) as session:
+        assert session.exec(select(models.Category)).all()
+        version = session.connection().exec_driver_sql("PRAGMA user_version")
+        assert version.scalar() == models.SCHEMA_VERSION
+    engine.dispose()
+
+
 @pytest.mark.filterwarnings("ignore::ResourceWarning")
 def test_get_session_yields_session(tmp_path):
     db_path = tmp_path / "test.db"
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient, ASGITransport
+from fastapi import FastAPI
+
+from ..metrics import metrics
+from ..monitor import LoopMonitor, route_of
+
+
+@pytest_asyncio.fixture(name="monitor")
+async def monitor_fixture():
+    metrics.reset()
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.05)
+    await monitor.start()
+    yield monitor
+    await monitor.stop()
+
+
+@pytest.mark.asyncio
+async def test_lag_stays_low_when_idle(monitor):
+    await asyncio.sleep(0.1)
+    assert monitor.lag < 0.05
+    assert monitor.recent_blocks() == []
+    assert "event_loop_lag_seconds" in metrics.snapshot()["gauges"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_blocking_handler_is_captured_and_attributed(monitor):
+    app = FastAPI()
+
+    @app.get("/slow/{id}")
+    async def slow(id: int):
+        time.sleep(0.2)  # the bug we want to catch
+        return {"id": id}
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/slow/1")
+    await asyncio.sleep(0.05)
+
+    assert resp.status_code == 200
+    [block] = monitor.recent_blocks()
+    assert block["route"] == "GET /slow/{id}"
+    assert block["blocked_seconds"] >= 0.1
+    assert any("time.sleep(0.2)" in line for line in block["stack"])
+    assert metrics.snapshot()["counters"]["loop_blocked.GET /slow/{id}"] == 1
+
+
+def test_route_of_without_request():
+    assert route_of(None) == "unknown"
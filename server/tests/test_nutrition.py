@@ -0,0 +1,192 @@
+import pytest
+from fastapi import FastAPI
+from sqlmodel import Session, select
+
+from .. import models
+from ..models import Category, Job, Nutrition, User
+from ..nutrition import STATS_JOB, category_stats, store_stats
+from ..routes import categories, recipes
+from ..routes.auth import get_current_user
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    with Session(engine) as session:
+        session.add(User(username="u", email="u@x.io", password="x", role="USER"))
+        session.add(Category(name="Soup", description=None, slug="soup"))
+        session.add(Category(name="Cake", description=None, slug="cake"))
+        session.commit()
+    return engine
+
+
+@pytest.fixture(name="app")
+def app_fixture(engine):
+    app = FastAPI()
+    app.include_router(categories.router, prefix="/categories")
+    app.include_router(recipes.router, prefix="/recipes")
+    with Session(engine, expire_on_commit=False) as session:
+        user = session.get(User, 1)
+    app.dependency_overrides[get_current_user] = lambda: (user, "USER")
+    return app
+
+
+def recipe(name, category_id=1, calories=300, **nutrition):
+    return {
+        "name": name,
+        "description": None,
+        "instructions": "Cook",
+        "ingredients": "water",
+        "calories": calories,
+        "prep_time": 10,
+        "servings": 2,
+        "category_id": category_id,
+        "nutrition": nutrition or None,
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+async def test_nutrition_is_stored_and_returned(client, engine):
+    resp = await client.post("/recipes/", json=recipe("Stew", protein=32, fat=10))
+    assert resp.status_code == 201
+    resp = await client.post("/recipes/", json=recipe("Broth"))
+    assert resp.status_code == 201
+
+    body = (await client.get("/recipes/1")).json()
+    assert body["nutrition"] == {
+        "protein": 32,
+        "fat": 10,
+        "carbs": None,
+        "fiber": None,
+        "sugar": None,
+        "sodium": None,
+    }
+    assert (await client.get("/recipes/2")).json()["nutrition"] is None
+    assert (await client.get("/recipes/1?html=true")).json()["nutrition"]["fat"] == 10
+
+    resp = await client.patch(
+        "/recipes/2", json={"category_id": 1, "nutrition": {"sodium": 800}}
+    )
+    assert resp.status_code == 200
+    assert (await client.get("/recipes/2")).json()["nutrition"]["sodium"] == 800
+
+    # a partial PATCH keeps the nutrients it doesn't mention
+    resp = await client.patch(
+        "/recipes/1", json={"category_id": 1, "nutrition": {"carbs": 40}}
+    )
+    assert resp.status_code == 200
+    nutrition = (await client.get("/recipes/1")).json()["nutrition"]
+    assert (nutrition["protein"], nutrition["fat"], nutrition["carbs"]) == (32, 10, 40)
+    resp = await client.patch(
+        "/recipes/1", json={"category_id": 1, "nutrition": {"fat": None}}
+    )
+    assert (await client.get("/recipes/1")).json()["nutrition"]["fat"] is None
+
+    resp = await client.post("/recipes/", json=recipe("Bad", protein=-1))
+    assert resp.status_code == 422
+
+    assert (await client.delete("/recipes/1")).status_code == 200
+    with Session(engine) as session:
+        assert session.get(Nutrition, 1) is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+async def test_filter_recipes_by_nutrition_ranges(client):
+    for name, protein, carbs in [
+        ("Steak", 45, 5),
+        ("Omelette", 30, 20),
+        ("Pasta", 30, 80),
+        ("Salad", 8, 10),
+    ]:
+        _ = await client.post(
+            "/recipes/", json=recipe(name, protein=protein, carbs=carbs)
+        )
+    _ = await client.post("/recipes/", json=recipe("Water"))
+
+    async def names(query):
+        resp = await client.get(f"/recipes/?fields=name&{query}")
+        assert resp.status_code == 200
+        return [r["name"] for r in resp.json()]
+
+    assert await names("protein_min=30&carbs_max=20") == ["Steak", "Omelette"]
+    assert await names("carbs_min=10&carbs_max=20") == ["Omelette", "Salad"]
+    assert await names("sodium_max=100") == []
+    assert len(await names("")) == 5
+
+
+def test_category_stats(engine):
+    with Session(engine) as session:
+        rows = [
+            (1, 200, {"protein": 10, "fat": 4}),
+            (1, 400, {"protein": 30}),
+            (1, 600, None),
+            (2, 500, {"sugar": 40}),
+        ]
+        for i, (category_id, calories, nutrition) in enumerate(rows, 1):
+            session.add(
+                models.Recipe(
+                    name=f"R{i}",
+                    slug=f"r{i}",
+                    description=None,
+                    instructions="x",
+                    ingredients="x",
+                    calories=calories,
+                    prep_time=1,
+                    servings=1,
+                    category_id=category_id,
+                )
+            )
+            if nutrition:
+                session.add(Nutrition(recipe_id=i, **nutrition))
+        session.commit()
+
+        stats = {s["category_id"]: s for s in category_stats(session)}
+    assert stats.keys() == {1, 2}
+    soup = stats[1]
+    assert soup["recipes"] == 3
+    assert soup["nutrients"]["calories"] == {
+        "count": 3,
+        "min": 200,
+        "max": 600,
+        "mean": 400,
+    }
+    assert soup["nutrients"]["protein"] == {
+        "count": 2,
+        "min": 10,
+        "max": 30,
+        "mean": 20,
+    }
+    assert soup["nutrients"]["sugar"] == {
+        "count": 0,
+        "min": None,
+        "max": None,
+        "mean": None,
+    }
+    assert stats[2]["nutrients"]["sugar"]["mean"] == 40
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+async def test_read_nutrition_stats(client, engine):
+    resp = await client.get("/categories/nutrition")
+    assert resp.status_code == 200
+    assert resp.json() == []
+
+    for name, category_id, protein in [("Stew", 1, 30), ("Broth", 1, 10)]:
+        body = recipe(name, category_id, protein=protein)
+        assert (await client.post("/recipes/", json=body)).status_code == 201
+    # a burst of writes waits on one job
+    with Session(engine) as session:
+        assert len(session.exec(select(Job).where(Job.kind == STATS_JOB)).all()) == 1
+    assert (await client.get("/categories/nutrition")).json() == []
+
+    assert store_stats(engine) == 1
+    [soup] = (await client.get("/categories/nutrition")).json()
+    assert soup["category_id"] == 1 and soup["recipes"] == 2
+    assert soup["nutrients"]["protein"] == {
+        "count": 2,
+        "min": 10,
+        "max": 30,
+        "mean": 20,
+    }
@@ -0,0 +1,130 @@
+import asyncio
+import pstats
+import time
+
+import jwt
+import pytest
+from httpx import AsyncClient, ASGITransport
+from fastapi import FastAPI
+
+from ..profiling import ContinuousProfiler, ProfilingMiddleware
+from ..routes.auth import ALGORITHM, SECRET, sign_jwt
+
+
+def make_app(directory):
+    app = FastAPI()
+
+    @app.get("/busy")
+    async def busy():
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        return {"ok": True}
+
+    @app.get("/slow")
+    async def slow():
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    app.add_middleware(ProfilingMiddleware, directory=directory)
+    return app
+
+
+def client(app, role: str | None):
+    cookies = {"access_token": sign_jwt(1, role)[0]} if role else None
+    return AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test", cookies=cookies
+    )
+
+
+@pytest.mark.asyncio
+async def test_admin_sampling_profile_writes_collapsed_stacks(tmp_path):
+    async with client(make_app(tmp_path), "ADMIN") as ac:
+        response = await ac.get("/busy", headers={"X-Profile": "1"})
+
+    assert response.status_code == 200
+    path = tmp_path / response.headers["x-profile-file"]
+    lines = path.read_text().splitlines()
+    assert lines
+    assert any("busy (" in line for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0 and ";" in stack
+
+
+@pytest.mark.asyncio
+async def test_profiles_one_request_at_a_time(tmp_path):
+    async with client(make_app(tmp_path), "ADMIN") as ac:
+        first, second = await asyncio.gather(
+            ac.get("/slow?profile=cprofile"), ac.get("/slow?profile=cprofile")
+        )
+        # files written within the same second still get their own names
+        names = {
+            (await ac.get("/busy", headers={"X-Profile": "1"})).headers[
+                "x-profile-file"
+            ]
+            for _ in range(3)
+        }
+
+    assert first.status_code == second.status_code == 200
+    assert ("x-profile-file" in first.headers) != ("x-profile-file" in second.headers)
+    assert len(names) == 3
+    assert len(list(tmp_path.iterdir())) == 4
+
+
+@pytest.mark.asyncio
+async def test_admin_cprofile_writes_pstats(tmp_path):
+    async with client(make_app(tmp_path), "ADMIN") as ac:
+        response = await ac.get("/busy?profile=cprofile")
+
+    path = tmp_path / response.headers["x-profile-file"]
+    assert path.suffix == ".prof"
+    stats = pstats.Stats(str(path))
+    assert any(func[2] == "busy" for func in stats.stats)  # pyright: ignore
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("role", [None, "USER"])
+async def test_profiling_requires_admin(tmp_path, role):
+    async with client(make_app(tmp_path), role) as ac:
+        response = await ac.get("/busy", headers={"X-Profile": "1"})
+
+    assert response.status_code == 200
+    assert "x-profile-file" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_profiling_ignores_expired_admin_token(tmp_path):
+    payload = {"sub": "1", "role": "ADMIN", "expires": time.time() - 1}
+    token = jwt.encode(payload, SECRET, algorithm=ALGORITHM)
+    async with AsyncClient(
+        transport=ASGITransport(app=make_app(tmp_path)),
+        base_url="http://test",
+        cookies={"access_token": token},
+    ) as ac:
+        response = await ac.get("/busy", headers={"X-Profile": "1"})
+
+    assert "x-profile-file" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_continuous_profiler_flushes_on_stop(tmp_path):
+    profiler = ContinuousProfiler(minutes=10, directory=tmp_path, interval=0.001)
+    await profiler.start()
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(0)
+    await profiler.stop()
+
+    files = list(tmp_path.glob("continuous-*.collapsed"))
+    assert len(files) == 1
+    assert files[0].read_text()
+
+
+@pytest.mark.asyncio
+async def test_continuous_profiler_disabled_by_default(tmp_path):
+    profiler = ContinuousProfiler(minutes=0, directory=tmp_path)
+    await profiler.start()
+    await profiler.stop()
+    assert list(tmp_path.iterdir()) == []
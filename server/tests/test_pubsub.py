@@ -0,0 +1,68 @@
+import asyncio
+import tracemalloc
+
+import pytest
+
+from ..pubsub import Broker, event_stream, format_event
+
+
+@pytest.mark.asyncio
+async def test_publish_reaches_topic_subscribers_only():
+    broker = Broker()
+    sub = broker.subscribe(1)
+    other = broker.subscribe(2)
+    assert broker.publish(1, "created", {"id": 5}) == 1
+    assert await sub.get(0.1) == [("created", {"id": 5})]
+    assert await other.get(0.01) is None
+
+
+@pytest.mark.asyncio
+async def test_get_wakes_on_publish():
+    broker = Broker()
+    sub = broker.subscribe(1)
+    waiter = asyncio.create_task(sub.get(5))
+    await asyncio.sleep(0)
+    _ = broker.publish(1, "deleted", {"id": 1})
+    assert await asyncio.wait_for(waiter, 1) == [("deleted", {"id": 1})]
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_drops_oldest():
+    broker = Broker(queue_size=2)
+    sub = broker.subscribe(1)
+    for i in range(5):
+        _ = broker.publish(1, "created", {"id": i})
+    assert await sub.get(0.1) == [("created", {"id": 3}), ("created", {"id": 4})]
+    assert sub.dropped == 3
+
+
+@pytest.mark.asyncio
+async def test_event_stream_heartbeat_and_overflow():
+    broker = Broker(queue_size=1)
+    stream = event_stream(broker, 1, heartbeat=0.01)
+    # nothing is held until the body is iterated
+    assert broker.subscriber_count() == 0
+    assert (await anext(stream)).startswith("retry:")
+    assert broker.subscriber_count(1) == 1
+    assert await anext(stream) == ": keep-alive\n\n"
+
+    _ = broker.publish(1, "created", {"id": 1})
+    _ = broker.publish(1, "created", {"id": 2})
+    assert await anext(stream) == format_event("overflow", {"dropped": 1})
+    assert await anext(stream) == format_event("created", {"id": 2})
+
+    await stream.aclose()
+    assert broker.subscriber_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_idle_subscribers_are_cheap():
+    broker = Broker()
+    tracemalloc.start()
+    try:
+        subs = [broker.subscribe(i % 100) for i in range(10_000)]
+        used, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert broker.subscriber_count() == len(subs)
+    assert used / len(subs) < 512
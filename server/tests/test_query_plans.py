@@ -0,0 +1,341 @@
+"""EXPLAIN QUERY PLAN every statement the routes issue against a realistic dataset.
+
+A statement fails the check when its plan scans one of the large tables,
+with or without an index (a SCAN walks all of it), or builds a temp B-tree
+to sort. Statements that do so on purpose go in ALLOWED, keyed by the
+request that issued them and the offending plan line.
+
+A request also fails when SQLite runs more than READ_BUDGET thousand VM
+steps for it, which catches index searches that still read most of a
+table; OVER_BUDGET lists the exceptions.
+"""
+
+import json
+import os
+import sys
+import threading
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from fastapi import FastAPI
+from sqlalchemy import event
+from sqlmodel import SQLModel, Session, create_engine
+
+from .. import models
+from ..models import User
+from ..routes import auth, batch, categories, comments, recipes, shopping
+from ..routes.auth import get_current_user
+from ..writer import close_writers
+
+
+ROUTES_DIR = os.path.dirname(recipes.__file__)
+LARGE_TABLES = {
+    "recipe",
+    "comment",
+    "user",
+    "slugredirect",
+    "recipescore",
+    "recipesignature",
+    "recipebucket",
+    "nutrition",
+    "similarrecipe",
+    "job",
+    "counter",
+    "idempotencykey",
+    "recipecluster",
+}
+
+ALLOWED: dict[tuple[str, str], str] = {
+    ("GET /recipes/", "SCAN recipe"): "unfiltered page walks rowid order to LIMIT",
+    (
+        "GET /recipes/?view=card&limit=10",
+        "SCAN recipe",
+    ): "unfiltered page walks rowid order to LIMIT",
+    **{
+        (f"GET /recipes/?{query}", plan): "ranged page walks the sort order to LIMIT"
+        for query, plan in (
+            ("calories_min=100&calories_max=150", "SCAN recipe"),
+            ("servings_min=4", "SCAN recipe"),
+            (
+                "servings_min=4&sort=newest",
+                "SCAN recipe USING INDEX ix_recipe_created_at",
+            ),
+            (
+                "calories_max=300&sort=rating",
+                "SCAN recipe USING INDEX ix_recipe_rating",
+            ),
+            ("protein_min=30&carbs_max=20", "SCAN recipe"),
+        )
+    },
+    (
+        "GET /recipes/top?window=week",
+        "SCAN recipescore USING INDEX ix_recipescore_top_week",
+    ): "first leaderboard page walks the score index to LIMIT",
+    (
+        "GET /recipes/trending?limit=5",
+        "SCAN recipescore USING INDEX ix_recipescore_trending",
+    ): "first leaderboard page walks the score index to LIMIT",
+    ("GET /comments/", "SCAN comment"): "unfiltered page walks rowid order to LIMIT",
+}
+
+# thousands of SQLite VM steps a request may take on the seeded data: a
+# page of a few hundred rows, far below a pass over the 5000 recipes
+READ_BUDGET = 20
+OVER_BUDGET: dict[str, str] = {}
+
+RECIPE = {
+    "name": "Plan Soup",
+    "description": "d",
+    "instructions": "Boil *well*",
+    "ingredients": "water",
+    "calories": 120,
+    "prep_time": 15,
+    "servings": 2,
+    "category_id": 3,
+}
+
+# (method, path, json body); covers every route in server/routes
+REQUESTS = [
+    (
+        "POST",
+        "/auth/register",
+        {"username": "new", "email": "new@x.io", "password": "pw"},
+    ),
+    ("POST", "/auth/login", {"email": "new@x.io", "password": "pw"}),
+    ("GET", "/categories/", None),
+    ("GET", "/categories/3", None),
+    ("GET", "/categories/by-slug/category-3", None),
+    ("GET", "/categories/by-slug/old-category-3", None),
+    ("GET", "/categories/3/recipes?view=card", None),
+    ("GET", "/categories/3/recipes/count", None),
+    ("GET", "/categories/nutrition", None),
+    ("POST", "/categories/", {"name": "Plan", "description": None}),
+    ("PATCH", "/categories/4", {"name": "Category 5"}),
+    ("DELETE", "/categories/41", None),
+    ("GET", "/recipes/", None),
+    ("GET", "/recipes/?view=card&limit=10", None),
+    ("GET", "/recipes/?category_id=3&sort=rating", None),
+    ("GET", "/recipes/?category_id=3&sort=newest", None),
+    ("GET", "/recipes/?sort=prep_time&prep_time_max=20", None),
+    ("GET", "/recipes/?author_id=7&sort=newest", None),
+    ("GET", "/recipes/?author_id=7&sort=rating", None),
+    ("GET", "/recipes/?author_id=7&sort=prep_time", None),
+    ("GET", "/recipes/?calories_min=100&calories_max=150", None),
+    ("GET", "/recipes/?servings_min=4", None),
+    ("GET", "/recipes/?servings_min=4&sort=newest", None),
+    ("GET", "/recipes/?calories_max=300&sort=rating", None),
+    ("GET", "/recipes/?protein_min=30&carbs_max=20", None),
+    ("GET", "/recipes/?calories_min=100&calories_max=150&cursor=4000", None),
+    ("GET", "/recipes/?servings_min=4&sort=rating&cursor=2.5:2500", None),
+    ("GET", "/recipes/?category_id=3&fiber_min=5&sort=newest", None),
+    ("GET", "/recipes/top?window=week", None),
+    ("GET", "/recipes/top?window=all&limit=5&cursor=3.5:100", None),
+    ("GET", "/recipes/trending?limit=5", None),
+    ("GET", "/recipes/10", None),
+    ("GET", "/recipes/10?html=true", None),
+    ("GET", "/recipes/by-slug/recipe-10", None),
+    ("GET", "/recipes/by-slug/old-recipe-10", None),
+    ("GET", "/recipes/10/comments", None),
+    ("GET", "/recipes/10/comments/count", None),
+    ("GET", "/recipes/10/similar?limit=5", None),
+    ("GET", "/recipes/count?category_id=3", None),
+    ("GET", "/recipes/duplicates", None),
+    ("GET", "/recipes/export?category_id=3", None),
+    ("POST", "/recipes/", RECIPE),
+    (
+        "POST",
+        "/recipes/import",
+        "\n".join(json.dumps({**RECIPE, "name": f"Imported {i}"}) for i in range(3)),
+    ),
+    ("PATCH", "/recipes/2000", {"name": "Recipe 12", "category_id": 3}),
+    ("DELETE", "/recipes/12", None),
+    ("GET", "/comments/", None),
+    ("GET", "/comments/5", None),
+    ("GET", "/comments/count", None),
+    ("POST", "/comments/", {"title": "t", "text": "t", "rating": 4, "recipe_id": 10}),
+    ("PATCH", "/comments/1", {"rating": 2}),
+    ("DELETE", "/comments/6", None),
+    ("POST", "/batch/", {"operations": [{"method": "GET", "path": "/recipes/10"}]}),
+    (
+        "POST",
+        "/shopping-list/",
+        {"recipes": [{"recipe_id": 10}, {"recipe_id": 11, "servings": 4}]},
+    ),
+]
+
+
+def seed(engine, users=2000, categories=40, recipes=5000, comments=10000):
+    conn = engine.raw_connection()
+    try:
+        conn.executemany(
+            'INSERT INTO "user" (username, email, password, role) VALUES (?, ?, ?, ?)',
+            [(f"user{i}", f"user{i}@x.io", "x", "USER") for i in range(users)],
+        )
+        conn.executemany(
+            "INSERT INTO category (name, description, slug) VALUES (?, ?, ?)",
+            [(f"Category {i}", "d", f"category-{i}") for i in range(1, categories + 1)],
+        )
+        conn.executemany(
+            "INSERT INTO recipe (name, description, instructions, ingredients, calories,"
+            " prep_time, servings, category_id, slug, author_id, rating)"
+            " VALUES (?, 'd', '# Title', 'x', ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    f"Recipe {i}",
+                    50 + i % 900,
+                    5 + i % 120,
+                    1 + i % 8,
+                    1 + i % categories,
+                    f"recipe-{i}",
+                    1 + i % users,
+                    i % 50 / 10,
+                )
+                for i in range(1, recipes + 1)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO comment (title, text, rating, recipe_id, user_id)"
+            " VALUES ('t', 't', ?, ?, ?)",
+            [(i % 5, 1 + i % recipes, 1 + i % users) for i in range(comments)],
+        )
+        conn.executemany(
+            "INSERT INTO nutrition (recipe_id, protein, fat, carbs, fiber, sugar,"
+            " sodium) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (i, i % 60, i % 40, i % 90, i % 12, i % 30, i % 2000)
+                for i in range(1, recipes + 1, 2)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO slugredirect (kind, old_slug, target_id) VALUES (?, ?, ?)",
+            [("recipe", f"old-recipe-{i}", i) for i in range(1, 200)]
+            + [("category", f"old-category-{i}", i) for i in range(1, 20)],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def route_location() -> str | None:
+    frame = sys._getframe(2)
+    while frame is not None:
+        if os.path.dirname(frame.f_code.co_filename) == ROUTES_DIR:
+            name = os.path.basename(frame.f_code.co_filename)
+            return f"{name}:{frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(tmp_path, monkeypatch):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'plans.db'}", connect_args={"check_same_thread": False}
+    )
+    SQLModel.metadata.create_all(engine)
+    seed(engine)
+    monkeypatch.setattr(models, "engine", engine)
+    yield engine
+    close_writers()
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+async def test_route_statements_use_indexes(engine):
+    app = FastAPI()
+    app.include_router(categories.router, prefix="/categories")
+    app.include_router(recipes.router, prefix="/recipes")
+    app.include_router(comments.router, prefix="/comments")
+    app.include_router(auth.router, prefix="/auth")
+    app.include_router(batch.router, prefix="/batch")
+    app.include_router(shopping.router, prefix="/shopping-list")
+    with Session(engine) as session:
+        admin = session.get(User, 1)
+    app.dependency_overrides[get_current_user] = lambda: (admin, "ADMIN")
+
+    # (request, statement) -> (route function, parameters); statements from
+    # the writer thread and the threadpool count towards their request too
+    captured: dict[tuple[str, str], tuple[str, object]] = {}
+    current = [""]
+    lock = threading.Lock()
+
+    # thousands of SQLite VM steps per request, whatever the plans say
+    steps: dict[str, int] = {}
+
+    def counter(request: str):
+        def tick() -> int:
+            with lock:
+                steps[request] = steps.get(request, 0) + 1
+            return 0
+
+        return tick
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        conn.connection.dbapi_connection.set_progress_handler(
+            counter(current[0]) if current[0] else None, 1000
+        )
+        if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            return
+        if not current[0]:
+            return
+        if executemany:
+            parameters = parameters[0]
+        with lock:
+            _ = captured.setdefault(
+                (current[0], statement), (route_location() or "-", parameters)
+            )
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        for method, path, body in REQUESTS:
+            current[0] = f"{method} {path}"
+            if isinstance(body, str):
+                resp = await ac.request(method, path, content=body)
+            else:
+                resp = await ac.request(method, path, json=body)
+            current[0] = ""
+            assert resp.status_code < 400, (method, path, resp.text)
+    event.remove(engine, "before_cursor_execute", capture)
+
+    assert {loc for loc, _ in captured.values()} >= {
+        "recipes.py:read_recipes",
+        "recipes.py:import_batch",
+        "comments.py:insert",
+        "auth.py:login_user",
+    }
+
+    violations = []
+    exempted = set()
+    with engine.connect() as conn:
+        for (request, statement), (location, parameters) in captured.items():
+            plan = [
+                row[3]
+                for row in conn.exec_driver_sql(
+                    f"EXPLAIN QUERY PLAN {statement}", parameters  # pyright: ignore
+                )
+            ]
+            for line in plan:
+                words = line.split()
+                # a covering index is cheaper to walk but still walked end to end
+                scan = words[0] == "SCAN" and words[1].strip('"') in LARGE_TABLES
+                if not (scan or line.startswith("USE TEMP B-TREE")):
+                    continue
+                if (request, line) in ALLOWED:
+                    exempted.add((request, line))
+                else:
+                    violations.append(
+                        f"{request} ({location}): {line}\n    {statement}"
+                    )
+
+    # an index SEARCH can still read most of a table, e.g. on IS NOT NULL
+    over = {r: n for r, n in steps.items() if n > READ_BUDGET}
+    violations += [
+        f"{r}: ~{n}k VM steps, over {READ_BUDGET}k"
+        for r, n in over.items()
+        if r not in OVER_BUDGET
+    ]
+
+    assert not violations, "\n".join(violations)
+    # exemptions outlive the plans they were written for otherwise
+    assert exempted == ALLOWED.keys()
+    assert over.keys() == OVER_BUDGET.keys()
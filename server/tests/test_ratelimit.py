@@ -0,0 +1,174 @@
+import asyncio
+import time
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from fastapi import Depends, FastAPI
+from sqlmodel import SQLModel, Session, create_engine
+
+from ..models import batch_session
+from ..monitor import LoopMonitor
+from ..ratelimit import (
+    LIMITS,
+    Limit,
+    LoadShedder,
+    LoadSheddingMiddleware,
+    RateLimiter,
+    SqliteStore,
+    install_rate_limit_handler,
+    rate_limit,
+)
+from ..writer import write_lock
+
+
+def run(limit, times, now=1000.0, state=None):
+    decisions = []
+    for _ in range(times):
+        state, decision = limit.apply(state, now)
+        decisions.append(decision)
+    return state, decisions
+
+
+def test_token_bucket_allows_burst_then_blocks():
+    _, decisions = run(Limit("bucket", 3, 60), 4)
+    assert [d.allowed for d in decisions] == [True, True, True, False]
+    assert decisions[2].remaining == 0
+    assert decisions[3].reset == pytest.approx(20)
+
+
+def test_token_bucket_refills():
+    limit = Limit("bucket", 2, 60)
+    state, _ = run(limit, 2)
+    _, decision = limit.apply(state, 1030.0)
+    assert decision.allowed
+
+
+def test_sliding_window_counts_previous_window():
+    limit = Limit("window", 4, 60)
+    state, decisions = run(limit, 4, now=60.0)
+    assert all(d.allowed for d in decisions)
+    # halfway into the next window half of the previous 4 still count
+    state, decisions = run(limit, 3, now=150.0, state=state)
+    assert [d.allowed for d in decisions] == [True, True, False]
+
+
+def test_decision_headers():
+    _, [ok, denied] = run(Limit("bucket", 1, 10), 2)
+    assert ok.headers()["RateLimit-Limit"] == "1"
+    assert ok.headers()["RateLimit-Remaining"] == "0"
+    assert "Retry-After" not in ok.headers()
+    assert denied.headers()["Retry-After"] == "10"
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_shares_state(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    SQLModel.metadata.create_all(engine)
+    a = RateLimiter(SqliteStore(engine))
+    b = RateLimiter(SqliteStore(engine))
+    limit = LIMITS["auth.register"].limit
+    results = [
+        await (a if i % 2 else b).hit("auth.register", "ip:1") for i in range(limit + 1)
+    ]
+    assert [r.allowed for r in results] == [True] * limit + [False]
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_during_a_batch(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}",
+        connect_args={"check_same_thread": False, "timeout": 0.5},
+    )
+    SQLModel.metadata.create_all(engine)
+    limiter = RateLimiter(SqliteStore(engine))
+    limit = LIMITS["auth.register"].limit
+    entered, release = asyncio.Event(), asyncio.Event()
+
+    async def batch():
+        async with write_lock.exclusive():
+            with Session(engine) as session:
+                # the batch's transaction has written before the hit
+                _ = session.connection().exec_driver_sql(
+                    "INSERT INTO ratelimitstate VALUES ('other', 0, 0, 0)"
+                )
+                token = batch_session.set(session)
+                try:
+                    decision = await limiter.hit("auth.register", "ip:1")
+                finally:
+                    batch_session.reset(token)
+                    entered.set()
+                await release.wait()
+                session.commit()
+        return decision
+
+    task = asyncio.create_task(batch())
+    await entered.wait()
+    outside = asyncio.create_task(limiter.hit("auth.register", "ip:1"))
+    await asyncio.sleep(0.7)
+    # waiting for the batch on the write lock, not failing on SQLite's
+    assert not outside.done()
+    release.set()
+    assert (await task).remaining == limit - 1
+    assert (await outside).remaining == limit - 2
+
+
+@pytest.fixture(name="app")
+def app_fixture(monkeypatch):
+    monkeypatch.setitem(LIMITS, "test", Limit("bucket", 2, 60))
+    app = FastAPI()
+    install_rate_limit_handler(app)
+
+    @app.get("/limited", dependencies=[Depends(rate_limit("test"))])
+    async def limited():
+        return {"ok": True}
+
+    return app
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_rate_limit_dependency(app):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        responses = [await ac.get("/limited") for _ in range(3)]
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    assert responses[0].headers["RateLimit-Remaining"] == "1"
+    assert responses[2].headers["Retry-After"] == "30"
+    assert responses[2].json() == {"message": "Too many requests"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_load_shedding_on_loop_lag(app):
+    loop_monitor = LoopMonitor()
+    shedder = LoadShedder(loop_monitor, max_lag=0.1)
+    app.add_middleware(LoadSheddingMiddleware, shedder=shedder)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        ok = await ac.get("/limited")
+        loop_monitor.lag = 0.5
+        shed = await ac.get("/limited")
+        exempt = await ac.get("/metrics/")
+    assert ok.status_code == 200
+    assert shed.status_code == 503
+    assert shed.headers["Retry-After"] == "1"
+    assert exempt.status_code == 404
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_load_shedding_on_queue_time(app):
+    app.add_middleware(
+        LoadSheddingMiddleware, shedder=LoadShedder(LoopMonitor(), max_queue_time=1)
+    )
+    now = time.time()
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        fresh = await ac.get("/limited", headers={"X-Request-Start": f"t={now}"})
+        stale = await ac.get("/limited", headers={"X-Request-Start": f"t={now - 5}"})
+        stale_ms = await ac.get(
+            "/limited", headers={"X-Request-Start": f"t={int((now - 5) * 1000)}"}
+        )
+    assert fresh.status_code == 200
+    assert stale.status_code == 503
+    assert stale_ms.status_code == 503
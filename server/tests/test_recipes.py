@@ -1,10 +1,17 @@
+import csv
+from fnmatch import fnmatch
+import io
+import json
+
 import pytest
 from httpx import AsyncClient, ASGITransport
-from fastapi import FastAPI
-from sqlmodel import SQLModel, Session, create_engine
+from fastapi import FastAPI, Response
+from sqlmodel import SQLModel, Session, create_engine, select
 
-from ..models import get_session, Category
+from ..models import get_session, Category, RECIPE_EXPORT_FIELDS, Recipe, User
+from ..pubsub import comment_events
 from ..routes import recipes as recipes_router
+from ..routes.auth import get_current_user
 
 
 @pytest.fixture(name="engine")
@@ -53,6 +60,17 @@ def category_fixture(session):
     return category
 
 
+@pytest.fixture(name="author")
+def author_fixture(app, session):
+    """Create a user and authenticate every request as them."""
+    user = User(username="author", password="x", role="USER")
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+    app.dependency_overrides[get_current_user] = lambda: (user, user.role)
+    return user
+
+
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore::ResourceWarning")
 async def test_create_recipe_success(app, category):
@@ -101,7 +119,7 @@ async def test_create_recipe_category_not_found(app):
 
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore::ResourceWarning")
-async def test_create_recipe_conflict(app, category):
+async def test_create_recipe_duplicate_name_gets_suffix(app, category, author):
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
         # Create first recipe
@@ -118,7 +136,7 @@ async def test_create_recipe_conflict(app, category):
                 "category_id": category.id,
             },
         )
-        # Try to create duplicate
+        # Same name gets the next free slug
         resp = await ac.post(
             "/recipes/",
             json={
@@ -132,8 +150,8 @@ async def test_create_recipe_conflict(app, category):
                 "category_id": category.id,
             },
         )
-    assert resp.status_code == 409
-    assert "already exists" in resp.json()["message"]
+    assert resp.status_code == 201
+    assert resp.json()["slug"] == "vanilla-cake-2"
 
 
 @pytest.mark.asyncio
@@ -300,7 +318,7 @@ async def test_update_recipe_category_not_found(app, category):
 
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore::DeprecationWarning")
-async def test_update_recipe_conflict(app, category):
+async def test_update_recipe_duplicate_name_gets_suffix(app, category, author):
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
         # Create first recipe
@@ -332,13 +350,13 @@ async def test_update_recipe_conflict(app, category):
             },
         )
         recipe_id = post.json()["id"]
-        # Try to update to duplicate name
+        # Renaming onto an existing name picks a free suffix
         resp = await ac.patch(
             f"/recipes/{recipe_id}",
             json={"name": "Recipe A", "category_id": category.id},
         )
-    assert resp.status_code == 409
-    assert "already exists" in resp.json()["message"]
+    assert resp.status_code == 200
+    assert resp.json()["slug"] == "recipe-a-2"
 
 
 @pytest.mark.asyncio
@@ -421,3 +439,523 @@ async def test_read_comments_pagination(app, category):
         resp = await ac.get(f"/recipes/{recipe_id}/comments?offset=0&limit=50")
     assert resp.status_code == 200
     assert isinstance(resp.json(), list)
+
+
+def _add_recipes(session, category_id, count=3):
+    from ..models import Recipe
+
+    for i in range(count):
+        session.add(
+            Recipe(
+                name=f"Recipe {i}",
+                slug=f"recipe-{i}",
+                description="Test",
+                instructions="# Long markdown",
+                ingredients='{"flour": "1 cup"}',
+                calories=100 + i,
+                prep_time=10 + i,
+                servings=2,
+                category_id=category_id,
+            )
+        )
+    session.commit()
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_recipes_card_view(app, session, category):
+    _add_recipes(session, category.id)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/recipes/?view=card")
+    assert resp.status_code == 200
+    data = resp.json()
+    assert len(data) == 3
+    assert set(data[0]) == {"id", "name", "slug", "calories", "prep_time"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_recipes_sparse_fields(app, session, category):
+    _add_recipes(session, category.id)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/recipes/?fields=name,calories")
+    assert resp.status_code == 200
+    assert set(resp.json()[0]) == {"id", "name", "calories"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_recipes_unknown_field(app):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/recipes/?fields=name,password")
+    assert resp.status_code == 400
+    assert "password" in resp.json()["message"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_recipes_full_view_keeps_all_fields(app, session, category):
+    _add_recipes(session, category.id, count=1)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/recipes/")
+    assert resp.status_code == 200
+    assert resp.json()[0]["instructions"] == "# Long markdown"
+    assert resp.json()[0]["description"] == "Test"
+
+
+def test_card_projection_uses_covering_index(engine):
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        plan = conn.execute(
+            text(
+                "EXPLAIN QUERY PLAN SELECT id, name, slug, calories, prep_time "
+                "FROM recipe WHERE category_id = 1"
+            )
+        ).all()
+    assert "COVERING INDEX ix_recipe_card" in plan[0][3]
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_recipe_html_renders_and_stores(app, session, category):
+    from ..models import Recipe
+
+    recipe = Recipe(
+        name="Markdown",
+        slug="markdown",
+        description=None,
+        instructions="1. Mix\n2. **Bake**",
+        ingredients="{}",
+        calories=100,
+        prep_time=10,
+        servings=2,
+        category_id=category.id,
+    )
+    session.add(recipe)
+    session.commit()
+    session.refresh(recipe)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        plain = await ac.get(f"/recipes/{recipe.id}")
+        resp = await ac.get(f"/recipes/{recipe.id}?html=true")
+    assert plain.json()["instructions_html"] is None
+    assert resp.status_code == 200
+    assert "<strong>Bake</strong>" in resp.json()["instructions_html"]
+    session.refresh(recipe)
+    assert recipe.rendered_instructions == resp.json()["instructions_html"]
+
+
+RECIPE_JSON = {
+    "description": "Test",
+    "instructions": "Test",
+    "ingredients": "Test",
+    "calories": 100,
+    "prep_time": 10,
+    "servings": 2,
+}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_recipe_by_slug(app, category, author):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post(
+            "/recipes/",
+            json={**RECIPE_JSON, "name": "Soup", "category_id": category.id},
+        )
+        dup = await ac.post(
+            "/recipes/",
+            json={**RECIPE_JSON, "name": "Soup", "category_id": category.id},
+        )
+        resp = await ac.get("/recipes/by-slug/soup-2")
+        missing = await ac.get("/recipes/by-slug/stew")
+    assert dup.status_code == 201
+    assert resp.status_code == 200
+    assert resp.json()["id"] == dup.json()["id"]
+    assert missing.status_code == 404
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_renamed_recipe_slug_redirects(app, category, author):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        post = await ac.post(
+            "/recipes/",
+            json={**RECIPE_JSON, "name": "Old Soup", "category_id": category.id},
+        )
+        recipe_id = post.json()["id"]
+        await ac.patch(
+            f"/recipes/{recipe_id}",
+            json={"name": "New Soup", "category_id": category.id},
+        )
+        resp = await ac.get("/recipes/by-slug/old-soup")
+        followed = await ac.get("/recipes/by-slug/old-soup", follow_redirects=True)
+    assert resp.status_code == 301
+    assert resp.headers["location"].endswith("/recipes/by-slug/new-soup")
+    assert followed.json()["id"] == recipe_id
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_stream_comments_recipe_not_found(app):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/recipes/999/comments/stream")
+    assert resp.status_code == 404
+    assert resp.json()["message"] == "Recipe not found"
+
+
+@pytest.mark.asyncio
+async def test_unsent_comment_stream_holds_no_subscription(session, category):
+    recipe = Recipe(**RECIPE_JSON, name="Soup", slug="soup", category_id=category.id)
+    session.add(recipe)
+    session.commit()
+
+    resp = await recipes_router.stream_comments(recipe.id, session)
+    # a response dropped before its body is sent leaves nothing behind
+    assert comment_events.subscriber_count(recipe.id) == 0
+    body = resp.body_iterator
+    assert (await anext(body)).startswith("retry:")
+    assert comment_events.subscriber_count(recipe.id) == 1
+    await body.aclose()
+    assert comment_events.subscriber_count(recipe.id) == 0
+
+
+@pytest.fixture(name="admin")
+def admin_fixture(app, session):
+    user = User(username="admin", password="x", role="ADMIN")
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+    app.dependency_overrides[get_current_user] = lambda: (user, user.role)
+    return user
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_export_recipes_ndjson(app, session, category, admin):
+    _add_recipes(session, category.id, count=5)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/recipes/export")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert [r["slug"] for r in rows] == [f"recipe-{i}" for i in range(5)]
+    assert rows[0]["created_at"] > 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_export_recipes_csv_with_filters(app, session, category, admin):
+    from ..models import Recipe
+
+    _add_recipes(session, category.id, count=3)
+    other = Category(name="Other", slug="other", description=None)
+    session.add(other)
+    session.commit()
+    old = session.get(Recipe, 1)
+    old.created_at = 0
+    session.add(old)
+    session.commit()
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get(
+            "/recipes/export",
+            params={
+                "format": "csv",
+                "category_id": category.id,
+                "created_after": "2000-01-01T00:00:00Z",
+            },
+        )
+        empty = await ac.get(
+            "/recipes/export", params={"format": "csv", "category_id": other.id}
+        )
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(resp.text)))
+    assert [r["slug"] for r in rows] == ["recipe-1", "recipe-2"]
+    assert empty.text.splitlines() == [",".join(RECIPE_EXPORT_FIELDS)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_export_recipes_keeps_rotated_cookies(app, admin):
+    def rotating_user(response: Response):
+        # what get_current_user does when the access token has expired
+        response.set_cookie(key="access_token", value="access")
+        response.set_cookie(key="refresh_token", value="refresh")
+        return admin, admin.role
+
+    app.dependency_overrides[get_current_user] = rotating_user
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/recipes/export")
+    assert resp.status_code == 200
+    cookies = resp.headers.get_list("set-cookie")
+    assert [c.split(";")[0] for c in cookies] == [
+        "access_token=access",
+        "refresh_token=refresh",
+    ]
+    assert resp.headers["content-disposition"].startswith("attachment")
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_export_recipes_requires_admin(app, author):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/recipes/export")
+    assert resp.status_code == 403
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_import_recipes_ndjson(app, session, category, author):
+    from ..models import Recipe
+
+    _add_recipes(session, category.id, count=1)  # takes "recipe-0"
+    rows = [
+        {**RECIPE_JSON, "name": "Recipe 0", "category_id": category.id},
+        {**RECIPE_JSON, "name": "Recipe 0", "category_id": category.id},
+        {**RECIPE_JSON, "name": "Soup", "category_id": category.id},
+    ]
+    body = "\n".join(json.dumps(r) for r in rows)
+    body += '\n{"name": "broken"\n\n'
+    body += (
+        json.dumps(
+            {
+                **RECIPE_JSON,
+                "name": "Bad",
+                "calories": "lots",
+                "category_id": category.id,
+            }
+        )
+        + "\n"
+    )
+    body += json.dumps({**RECIPE_JSON, "name": "Lost", "category_id": 999})
+
+    async def chunks():
+        data = body.encode()
+        for i in range(0, len(data), 50):
+            yield data[i : i + 50]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.post(
+            "/recipes/import",
+            content=chunks(),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+    assert resp.status_code == 200
+    report = resp.json()
+    assert report["imported"] == 3
+    assert report["failed"] == 3
+    assert [e["line"] for e in report["errors"]] == [4, 6, 7]
+    assert report["errors"][0]["message"].startswith("Invalid JSON")
+    assert report["errors"][1]["message"].startswith("calories:")
+    assert report["errors"][2]["message"] == "Category not found"
+    assert report["rows_per_second"] > 0
+
+    session.expire_all()
+    imported = session.exec(select(Recipe).where(Recipe.id > 1)).all()
+    assert [r.slug for r in imported] == ["recipe-0-2", "recipe-0-3", "soup"]
+    assert all(r.author_id == author.id for r in imported)
+    assert all(r.rendered_instructions for r in imported)
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_import_recipes_splits_large_chunks(
+    app, session, category, author, monkeypatch
+):
+    from ..models import Job
+
+    monkeypatch.setattr(recipes_router, "IMPORT_BATCH_SIZE", 2)
+    sizes = []
+    import_batch = recipes_router.import_batch
+
+    def recording(session, batch, *args):
+        sizes.append(len(batch))
+        return import_batch(session, batch, *args)
+
+    monkeypatch.setattr(recipes_router, "import_batch", recording)
+    body = "\n".join(
+        json.dumps({**RECIPE_JSON, "name": f"R{i}", "category_id": category.id})
+        for i in range(5)
+    )
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        # the whole body arrives as one chunk
+        resp = await ac.post("/recipes/import", content=body.encode())
+    assert resp.json()["imported"] == 5
+    assert sizes == [2, 2, 1]
+    # one similar.refresh job per batch
+    refreshes = session.exec(
+        select(Job.payload).where(Job.kind == "similar.refresh")
+    ).all()
+    assert [len(json.loads(p)["recipe_ids"]) for p in refreshes] == [2, 2, 1]
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_recipes_filters_and_sorts(app, session, category):
+    from ..models import Recipe
+
+    _add_recipes(session, category.id, count=4)
+    for recipe, rating in zip(session.exec(select(Recipe)).all(), [3, 5, 1, 4]):
+        recipe.rating = rating
+        session.add(recipe)
+    session.commit()
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        by_rating = await ac.get("/recipes/?view=card&sort=rating")
+        filtered = await ac.get(
+            "/recipes/",
+            params={"calories_min": 101, "prep_time_max": 12, "sort": "prep_time"},
+        )
+        other = await ac.get(f"/recipes/?category_id={category.id + 1}")
+    assert [r["slug"] for r in by_rating.json()] == [
+        "recipe-1",
+        "recipe-3",
+        "recipe-0",
+        "recipe-2",
+    ]
+    assert [r["slug"] for r in filtered.json()] == ["recipe-1", "recipe-2"]
+    assert other.json() == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_recipes_cursor(app, session, category):
+    from ..models import Recipe
+
+    _add_recipes(session, category.id, count=5)
+    for recipe, rating in zip(session.exec(select(Recipe)).all(), [3, 5, 3, 4, 1]):
+        recipe.rating = rating
+        session.add(recipe)
+    session.commit()
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        for params, expected in [
+            ({"calories_min": 101}, [2, 3, 4, 5]),
+            ({"calories_min": 101, "sort": "rating", "fields": "name"}, [2, 4, 3, 5]),
+        ]:
+            rows, cursor = [], None
+            while True:
+                page = {**params, "limit": 2}
+                if cursor is not None:
+                    page["cursor"] = cursor
+                resp = await ac.get("/recipes/", params=page)
+                assert resp.status_code == 200
+                rows += resp.json()
+                cursor = resp.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+            assert [r["id"] for r in rows] == expected
+        # the sort value is read for the cursor but not returned
+        assert set(rows[0]) == {"id", "name"}
+
+        resp = await ac.get("/recipes/?sort=rating&cursor=3")
+    assert resp.status_code == 400
+    assert resp.json() == {"message": "Invalid cursor"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::ResourceWarning")
+async def test_read_recipes_filter_plans(app, engine, session, category):
+    from sqlalchemy import event
+
+    _add_recipes(session, category.id, count=3)
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith("SELECT") and "FROM recipe" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    # a sort walks its index and stops at LIMIT, checking any range on the way
+    plans = {
+        "category_id=1": ["SEARCH recipe USING INDEX ix_recipe_card (category_id=?)"],
+        # any of the author_id indexes, they tie; one author's recipes are sorted
+        "author_id=1": [
+            "SEARCH recipe USING INDEX ix_recipe_author_* (author_id=?)",
+            "USE TEMP B-TREE FOR ORDER BY",
+        ],
+        "calories_min=100&calories_max=200": ["SCAN recipe"],
+        "prep_time_max=30": ["SCAN recipe"],
+        "servings_min=2&servings_max=4": ["SCAN recipe"],
+        "sort=rating": ["SCAN recipe USING INDEX ix_recipe_rating"],
+        "sort=newest": ["SCAN recipe USING INDEX ix_recipe_created_at"],
+        "sort=prep_time": ["SCAN recipe USING INDEX ix_recipe_prep_time"],
+        "category_id=1&sort=rating": [
+            "SEARCH recipe USING INDEX ix_recipe_category_rating (category_id=?)"
+        ],
+        "category_id=1&sort=newest": [
+            "SEARCH recipe USING INDEX ix_recipe_category_created (category_id=?)"
+        ],
+        "category_id=1&sort=prep_time": [
+            "SEARCH recipe USING INDEX ix_recipe_category_prep_time (category_id=?)"
+        ],
+        "category_id=1&calories_max=500&prep_time_max=30&sort=rating": [
+            "SEARCH recipe USING INDEX ix_recipe_category_rating (category_id=?)"
+        ],
+        "author_id=1&sort=newest": [
+            "SEARCH recipe USING INDEX ix_recipe_author_created (author_id=?)"
+        ],
+        "author_id=1&sort=rating": [
+            "SEARCH recipe USING INDEX ix_recipe_author_rating (author_id=?)"
+        ],
+        "author_id=1&sort=prep_time": [
+            "SEARCH recipe USING INDEX ix_recipe_author_prep_time (author_id=?)"
+        ],
+        "calories_max=500&prep_time_max=30&sort=rating": [
+            "SCAN recipe USING INDEX ix_recipe_rating"
+        ],
+        "servings_min=4&sort=newest": ["SCAN recipe USING INDEX ix_recipe_created_at"],
+        "calories_min=100&sort=prep_time": [
+            "SCAN recipe USING INDEX ix_recipe_prep_time"
+        ],
+        # the range and the sort share an index: a search instead of a walk
+        "prep_time_max=20&sort=prep_time": [
+            "SEARCH recipe USING INDEX ix_recipe_prep_time (prep_time<?)"
+        ],
+        "protein_min=30&sort=rating": [
+            "SCAN recipe USING INDEX ix_recipe_rating",
+            "SEARCH nutrition USING INTEGER PRIMARY KEY (rowid=?)",
+        ],
+        "view=card&category_id=1": [
+            "SEARCH recipe USING COVERING INDEX ix_recipe_card (category_id=?)"
+        ],
+    }
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        for query in plans:
+            assert (await ac.get(f"/recipes/?{query}")).status_code == 200
+    event.remove(engine, "before_cursor_execute", capture)
+
+    assert len(statements) == len(plans)
+    with engine.connect() as conn:
+        for (statement, parameters), (query, expected) in zip(
+            statements, plans.items()
+        ):
+            plan = [
+                row[3]
+                for row in conn.exec_driver_sql(
+                    f"EXPLAIN QUERY PLAN {statement}", parameters
+                )
+            ]
+            assert len(plan) == len(expected), (query, plan)
+            assert all(map(fnmatch, plan, expected)), (query, plan)
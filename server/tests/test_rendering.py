@@ -0,0 +1,43 @@
+import pytest
+
+from ..metrics import metrics
+from ..rendering import clear_cache, content_hash, render_markdown
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    clear_cache()
+    metrics.reset()
+    yield
+    clear_cache()
+
+
+def test_render_markdown_basic():
+    html = render_markdown("# Title\n\nMix **well**")
+    assert "<h1>Title</h1>" in html
+    assert "<strong>well</strong>" in html
+
+
+def test_render_markdown_escapes_raw_html():
+    html = render_markdown("<script>alert(1)</script>")
+    assert "<script>" not in html
+    assert "&lt;script&gt;" in html
+
+
+def test_render_markdown_drops_javascript_links():
+    html = render_markdown("[click](javascript:alert(1))")
+    assert "href" not in html
+
+
+def test_render_markdown_is_cached_by_content():
+    first = render_markdown("*same*")
+    second = render_markdown("*same*")
+    assert first == second
+    snap = metrics.snapshot()
+    assert snap["timings"]["markdown_render"]["count"] == 1
+    assert snap["counters"]["markdown_cache_hits"] == 1
+
+
+def test_content_hash_is_stable():
+    assert content_hash("abc") == content_hash("abc")
+    assert content_hash("abc") != content_hash("abd")
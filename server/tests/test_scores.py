@@ -0,0 +1,141 @@
+import time
+
+import pytest
+from fastapi import FastAPI
+from sqlmodel import Session, select
+
+from ..models import Category, Recipe, RecipeScore, User
+from ..routes import comments, recipes
+from ..routes.auth import get_current_user
+from ..scores import DAY, bayesian, decay_scores, record_comment
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    with Session(engine) as session:
+        session.add(User(username="u", email="u@x.io", password="x", role="USER"))
+        session.add(Category(name="Soup", description=None, slug="soup"))
+        for i in range(1, 6):
+            session.add(
+                Recipe(
+                    name=f"Soup {i}",
+                    slug=f"soup-{i}",
+                    description=None,
+                    instructions="Boil",
+                    ingredients="water",
+                    calories=100,
+                    prep_time=10,
+                    servings=2,
+                    category_id=1,
+                    author_id=1,
+                )
+            )
+        session.commit()
+    return engine
+
+
+@pytest.fixture(name="app")
+def app_fixture(engine):
+    app = FastAPI()
+    app.include_router(recipes.router, prefix="/recipes")
+    app.include_router(comments.router, prefix="/comments")
+    with Session(engine, expire_on_commit=False) as session:
+        user = session.get(User, 1)
+    app.dependency_overrides[get_current_user] = lambda: (user, "USER")
+    return app
+
+
+def test_old_comments_weigh_less_this_week(engine):
+    now = time.time()
+    with Session(engine) as session:
+        record_comment(session, 1, 5, now - 14 * DAY)
+        record_comment(session, 2, 5, now)
+        session.commit()
+        old, new = session.get(RecipeScore, 1), session.get(RecipeScore, 2)
+
+        assert old.week_weight == pytest.approx(0.25)
+        assert old.top_all == new.top_all == pytest.approx(bayesian(5, 1))
+        assert old.top_week < new.top_week
+        assert old.trending < new.trending
+
+        record_comment(session, 1, 5, now - 14 * DAY, -1)
+        session.commit()
+        assert old.comments == 0
+        assert old.week_weight == pytest.approx(0)
+        assert old.top_week == pytest.approx(bayesian(0, 0))
+
+
+def test_decay_scores_decays_every_row(engine, monkeypatch):
+    monkeypatch.setattr("server.scores.DECAY_BATCH_SIZE", 2)
+    with Session(engine) as session:
+        for recipe_id in range(1, 6):
+            record_comment(session, recipe_id, 4, time.time())
+            session.get(RecipeScore, recipe_id).decayed_at -= DAY
+        session.commit()
+
+    assert decay_scores(engine) == 5
+    with Session(engine) as session:
+        for score in session.exec(select(RecipeScore)).all():
+            assert score.velocity == pytest.approx(0.5, rel=1e-3)
+            assert score.trending == pytest.approx(0.5 * score.top_week / 5, rel=1e-3)
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+async def test_leaderboards_follow_comment_writes(client):
+    ratings = {1: [5, 5, 5], 2: [4], 3: [1, 1], 4: [5]}
+    for recipe_id, values in ratings.items():
+        for rating in values:
+            resp = await client.post(
+                "/comments/",
+                json={
+                    "title": "t",
+                    "text": "t",
+                    "rating": rating,
+                    "recipe_id": recipe_id,
+                },
+            )
+            assert resp.status_code == 201
+
+    resp = await client.get("/recipes/top?window=all")
+    assert [r["id"] for r in resp.json()] == [1, 4, 2, 3]
+    assert resp.json()[0]["comments"] == 3
+    assert "X-Next-Cursor" not in resp.headers
+
+    resp = await client.get("/recipes/trending")
+    assert resp.json()[0]["id"] == 1
+
+    # the comment on recipe 4 drops to 1.0 and recipe 4 falls behind 2
+    resp = await client.patch("/comments/7", json={"rating": 1})
+    assert resp.status_code == 200
+    resp = await client.get("/recipes/top?window=week")
+    assert [r["id"] for r in resp.json()] == [1, 2, 4, 3]
+
+    resp = await client.delete("/recipes/1")
+    assert resp.status_code == 200
+    resp = await client.get("/recipes/top?window=month")
+    assert [r["id"] for r in resp.json()] == [2, 4, 3]
+
+
+@pytest.mark.asyncio
+async def test_leaderboard_cursor_pages(client, engine):
+    with Session(engine) as session:
+        for recipe_id in range(1, 6):
+            for _ in range(recipe_id % 3):
+                record_comment(session, recipe_id, 4, time.time())
+        session.commit()
+
+    seen, cursor = [], None
+    while True:
+        params = {"window": "all", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        resp = await client.get("/recipes/top", params=params)
+        seen += [r["id"] for r in resp.json()]
+        cursor = resp.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == [5, 2, 4, 1]
+
+    resp = await client.get("/recipes/top?cursor=nope")
+    assert resp.status_code == 400
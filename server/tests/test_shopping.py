@@ -0,0 +1,164 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from sqlmodel import Session
+
+from .. import models, shopping
+from ..metrics import metrics
+from ..models import Recipe
+from ..routes import shopping as shopping_routes
+from ..shopping import aggregate, compile_form
+
+
+PANCAKES = json.dumps(
+    {"flour": "2 cups", "milk": "1 cup", "eggs": 2, "salt": "to taste"}
+)
+OMELETTE = json.dumps(
+    {"Eggs": 3, "milk": "100 ml", "garlic": "1-2 cloves", "salt": "pinch"}
+)
+
+
+def test_aggregate_merges_units_and_scales():
+    shopping.clear_cache()
+    items = aggregate([(1, PANCAKES, 2.0), (2, OMELETTE, 1.0)])
+    assert items == [
+        {
+            "item": "eggs",
+            "quantity": 7,
+            "quantity_max": None,
+            "unit": None,
+            "notes": [],
+            "recipe_ids": [1, 2],
+        },
+        {
+            "item": "flour",
+            "quantity": 946,
+            "quantity_max": None,
+            "unit": "ml",
+            "notes": [],
+            "recipe_ids": [1],
+        },
+        {
+            "item": "garlic",
+            "quantity": 1,
+            "quantity_max": 2,
+            "unit": "clove",
+            "notes": [],
+            "recipe_ids": [2],
+        },
+        {
+            "item": "milk",
+            "quantity": 573,
+            "quantity_max": None,
+            "unit": "ml",
+            "notes": [],
+            "recipe_ids": [1, 2],
+        },
+        {
+            "item": "salt",
+            "quantity": None,
+            "quantity_max": None,
+            "unit": None,
+            "notes": ["to taste", "pinch"],
+            "recipe_ids": [1, 2],
+        },
+    ]
+
+    imperial = {i["item"]: i for i in aggregate([(1, PANCAKES, 3.0)], "imperial")}
+    assert (imperial["flour"]["quantity"], imperial["flour"]["unit"]) == (1.5, "quart")
+    assert aggregate([(1, "", 1.0)]) == []
+    assert aggregate([(1, '["½ cup", "2 eggs"]', 1.0)]) == [
+        {
+            "item": "eggs",
+            "quantity": 2,
+            "quantity_max": None,
+            "unit": None,
+            "notes": [],
+            "recipe_ids": [1],
+        }
+    ]
+
+
+def test_forms_number_their_own_keys():
+    form = compile_form(json.dumps({"Milk": "1 cup", "eggs": 2, "milk": "200 ml"}))
+    assert form.names == (("milk", "volume"), ("eggs", ""))
+    assert form.keys.tolist() == [0, 1, 0]
+    # the same key gets another number in another form, and still merges
+    other = compile_form(json.dumps({"eggs": 1}))
+    assert other.names == (("eggs", ""),) and other.keys.tolist() == [0]
+    [eggs] = [
+        i
+        for i in aggregate([(1, PANCAKES, 1.0), (2, OMELETTE, 1.0)])
+        if i["item"] == "eggs"
+    ]
+    assert eggs["quantity"] == 5
+
+
+def test_forms_are_cached():
+    shopping.clear_cache()
+    hits = metrics.counters.get("shopping_form_cache_hits", 0)
+    doubled = aggregate([(1, PANCAKES, 2.0)])
+    assert aggregate([(1, PANCAKES, 1.0), (1, PANCAKES, 1.0)]) == doubled
+    assert metrics.counters["shopping_form_cache_hits"] == hits + 2
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    with Session(engine) as session:
+        for name, ingredients, servings in [
+            ("Pancakes", PANCAKES, 4),
+            ("Omelette", OMELETTE, 1),
+        ]:
+            session.add(
+                Recipe(
+                    name=name,
+                    slug=name.lower(),
+                    description=None,
+                    instructions="Cook",
+                    ingredients=ingredients,
+                    calories=300,
+                    prep_time=10,
+                    servings=servings,
+                )
+            )
+        session.commit()
+    return engine
+
+
+@pytest.fixture(name="app")
+def app_fixture(engine):
+    app = FastAPI()
+    app.include_router(shopping_routes.router, prefix="/shopping-list")
+    return app
+
+
+@pytest.mark.asyncio
+async def test_create_shopping_list(client):
+    resp = await client.post(
+        "/shopping-list/",
+        json={"recipes": [{"recipe_id": 1, "servings": 8}, {"recipe_id": 2}]},
+    )
+    assert resp.status_code == 200
+    items = {i["item"]: i for i in resp.json()["items"]}
+    assert items["eggs"]["quantity"] == 7
+    assert items["milk"] == {
+        "item": "milk",
+        "quantity": 573,
+        "quantity_max": None,
+        "unit": "ml",
+        "notes": [],
+        "recipe_ids": [1, 2],
+    }
+
+    resp = await client.post(
+        "/shopping-list/", json={"recipes": [{"recipe_id": 1}, {"recipe_id": 7}]}
+    )
+    assert resp.status_code == 404
+    assert resp.json() == {"message": "Recipes not found: 7"}
+
+    resp = await client.post("/shopping-list/", json={"recipes": []})
+    assert resp.status_code == 422
+    too_many = [{"recipe_id": 1}] * (models.MAX_SHOPPING_RECIPES + 1)
+    resp = await client.post("/shopping-list/", json={"recipes": too_many})
+    assert resp.status_code == 422
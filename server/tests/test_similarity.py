@@ -0,0 +1,262 @@
+import json
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from sqlmodel import Session, select
+
+from .. import similarity
+from ..models import Recipe, SimilarChange, SimilarRecipe, User
+from ..routes import recipes
+from ..similarity import (
+    SimilarityIndex,
+    build,
+    featurize,
+    ingredient_names,
+    prune_changes,
+    refresh,
+)
+
+
+PANTRY = [
+    "flour",
+    "sugar",
+    "butter",
+    "eggs",
+    "milk",
+    "cheddar cheese",
+    "tomato",
+    "basil",
+    "olive oil",
+    "garlic",
+    "rice",
+    "chicken",
+]
+
+
+def make_recipe(i, ingredients, category_id=1, calories=300):
+    return Recipe(
+        name=f"Recipe {i}",
+        slug=f"recipe-{i}",
+        description=None,
+        instructions="Cook",
+        ingredients=json.dumps({name: "1 cup" for name in ingredients}),
+        calories=calories,
+        prep_time=20,
+        servings=2,
+        category_id=category_id,
+        author_id=1,
+    )
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine, monkeypatch):
+    monkeypatch.setattr(similarity, "_index", None)
+    rng = np.random.default_rng(7)
+    with Session(engine) as session:
+        session.add(User(username="u", email="u@x.io", password="x", role="USER"))
+        for i in range(1, 41):
+            picked = rng.choice(PANTRY, size=4, replace=False).tolist()
+            session.add(make_recipe(i, picked, 1 + i % 3, int(rng.integers(100, 900))))
+        session.commit()
+    return engine
+
+
+def stored_lists(engine):
+    lists = {}
+    with Session(engine) as session:
+        for row in session.exec(select(SimilarRecipe)).all():
+            lists.setdefault(row.recipe_id, {})[row.similar_id] = row.score
+    return lists
+
+
+def brute_force(engine, k=similarity.K):
+    with Session(engine) as session:
+        rows = session.exec(select(*similarity.FEATURE_COLUMNS)).all()
+    vectors = featurize(rows)
+    scores = vectors @ vectors.T
+    np.fill_diagonal(scores, -np.inf)
+    ids = [r[0] for r in rows]
+    return {
+        ids[i]: {ids[j]: scores[i, j] for j in np.argsort(-scores[i])[:k]}
+        for i in range(len(ids))
+    }
+
+
+def assert_same_lists(actual, expected):
+    assert actual.keys() == expected.keys()
+    for recipe_id, neighbours in expected.items():
+        # ties at the k-th score may be broken either way
+        kth = min(neighbours.values())
+        got = actual[recipe_id]
+        assert len(got) == len(neighbours)
+        for similar_id, score in got.items():
+            assert score >= kth - 1e-5
+            if similar_id in neighbours:
+                assert score == pytest.approx(neighbours[similar_id], abs=1e-5)
+
+
+@pytest.mark.parametrize(
+    "ingredients, expected",
+    [
+        ('{"Flour": "2 cups", "eggs": 2}', ["flour", "eggs"]),
+        ('["2 Tomatoes", {"name": "Olive-oil"}]', ["tomatoes", "olive oil"]),
+        ("water, salt;\npepper", ["water", "salt", "pepper"]),
+        ("42", []),
+    ],
+)
+def test_ingredient_names(ingredients, expected):
+    assert ingredient_names(ingredients) == expected
+
+
+def test_shared_ingredients_score_higher():
+    rows = [
+        (1, '{"flour": 1, "sugar": 1, "butter": 1}', 1, 300, 20, 4),
+        (2, '{"flour": 1, "sugar": 1, "eggs": 1}', 1, 350, 25, 4),
+        (3, '{"rice": 1, "chicken": 1}', 2, 600, 40, 2),
+        (4, '{"brown rice": 1, "chicken": 1}', 2, 650, 45, 2),
+    ]
+    vectors = featurize(rows)
+    assert np.linalg.norm(vectors, axis=1) == pytest.approx(1, abs=1e-6)
+    scores = vectors @ vectors.T
+    assert scores[0, 1] > scores[0, 2]
+    assert scores[2, 3] > scores[2, 0]
+
+
+def test_build_matches_brute_force(engine, monkeypatch):
+    # several matmul blocks
+    monkeypatch.setattr(similarity, "BLOCK_CELLS", 100)
+    index = build(engine, chunk_size=7)
+    assert index.size == 40
+    assert_same_lists(stored_lists(engine), brute_force(engine))
+
+
+def test_refresh_tracks_creates_updates_and_deletes(engine):
+    _ = build(engine)
+    with Session(engine) as session:
+        session.add(make_recipe(41, ["flour", "sugar", "butter", "eggs"]))
+        session.commit()
+    assert refresh(engine, [41]) > 1
+    assert_same_lists(stored_lists(engine), brute_force(engine))
+
+    with Session(engine) as session:
+        recipe = session.get(Recipe, 5)
+        recipe.ingredients = json.dumps({"rice": 1, "chicken": 1, "garlic": 1})
+        session.add(recipe)
+        session.commit()
+    _ = refresh(engine, [5])
+    assert_same_lists(stored_lists(engine), brute_force(engine))
+
+    with Session(engine) as session:
+        session.delete(session.get(Recipe, 41))
+        session.commit()
+    _ = refresh(engine, [41])
+    assert 41 not in similarity._index.positions
+    assert_same_lists(stored_lists(engine), brute_force(engine))
+
+
+def test_refresh_takes_a_batch(engine):
+    _ = build(engine)
+    with Session(engine) as session:
+        session.add(make_recipe(41, ["flour", "sugar", "butter", "eggs"]))
+        session.add(make_recipe(42, ["rice", "chicken", "garlic", "basil"], 2))
+        recipe = session.get(Recipe, 7)
+        recipe.ingredients = json.dumps({"tomato": 1, "basil": 1, "olive oil": 1})
+        session.add(recipe)
+        session.delete(session.get(Recipe, 3))
+        session.commit()
+    assert refresh(engine, [41, 42, 7, 3]) > 3
+    assert 3 not in similarity._index.positions
+    assert_same_lists(stored_lists(engine), brute_force(engine))
+
+
+def test_workers_replay_each_others_changes(engine, monkeypatch):
+    first = build(engine)
+    # a second worker process with its own matrix
+    monkeypatch.setattr(similarity, "_index", None)
+    _ = refresh(engine, [])
+    second = similarity._index
+    assert second is not first
+
+    with Session(engine) as session:
+        session.add(make_recipe(41, ["flour", "sugar", "butter", "eggs"]))
+        session.delete(session.get(Recipe, 9))
+        session.commit()
+    _ = refresh(engine, [41, 9])
+
+    monkeypatch.setattr(similarity, "_index", first)
+    with Session(engine) as session:
+        session.add(make_recipe(42, ["flour", "sugar", "butter", "milk"]))
+        session.commit()
+    _ = refresh(engine, [42])
+    assert similarity._index is first
+    assert 41 in first.positions and 9 not in first.positions
+    assert_same_lists(stored_lists(engine), brute_force(engine))
+    for recipe_id, position in second.positions.items():
+        if recipe_id in first.positions:
+            assert first.floors[first.positions[recipe_id]] >= second.floors[position]
+
+
+def test_pruned_or_rebuilt_log_reloads_the_index(engine, monkeypatch):
+    _ = refresh(engine, [])
+    stale = similarity._index
+    monkeypatch.setattr(similarity, "_index", None)
+    with Session(engine) as session:
+        session.add(make_recipe(41, ["rice", "chicken", "garlic", "basil"], 2))
+        session.commit()
+    _ = refresh(engine, [41])
+    with Session(engine) as session:
+        assert len(session.exec(select(SimilarChange)).all()) > 1
+
+    monkeypatch.setattr(similarity, "CHANGE_RETENTION", -1)
+    assert prune_changes(engine) > 0
+    with Session(engine) as session:
+        # the newest row stays, so numbering carries on
+        assert len(session.exec(select(SimilarChange)).all()) == 1
+
+    monkeypatch.setattr(similarity, "_index", stale)
+    _ = refresh(engine, [])
+    assert similarity._index is not stale and 41 in similarity._index.positions
+
+    stale = similarity._index
+    _ = build(engine)
+    monkeypatch.setattr(similarity, "_index", stale)
+    _ = refresh(engine, [])
+    assert similarity._index is not stale
+
+
+def test_index_loads_floors_from_stored_lists(engine):
+    _ = build(engine)
+    loaded = SimilarityIndex()
+    with Session(engine) as session:
+        loaded.load(session)
+    built = similarity._index
+    for recipe_id, position in built.positions.items():
+        assert loaded.floors[loaded.positions[recipe_id]] == pytest.approx(
+            built.floors[position]
+        )
+
+
+@pytest.fixture(name="app")
+def app_fixture(engine):
+    app = FastAPI()
+    app.include_router(recipes.router, prefix="/recipes")
+    return app
+
+
+@pytest.mark.asyncio
+async def test_read_similar_recipes(client, engine):
+    _ = build(engine)
+    expected = brute_force(engine)[3]
+
+    resp = await client.get("/recipes/3/similar?limit=4")
+    assert resp.status_code == 200
+    body = resp.json()
+    assert len(body) == 4
+    assert [r["score"] for r in body] == sorted(
+        (r["score"] for r in body), reverse=True
+    )
+    assert body[0]["score"] == pytest.approx(max(expected.values()), abs=1e-5)
+    assert set(body[0]) == {"id", "name", "slug", "category_id", "score"}
+
+    assert (await client.get("/recipes/99/similar")).status_code == 404
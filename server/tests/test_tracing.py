@@ -0,0 +1,96 @@
+import json
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from fastapi import FastAPI
+from sqlalchemy import text
+from sqlmodel import Session, create_engine
+
+from ..tracing import (
+    ChromeTraceExporter,
+    OtlpJsonExporter,
+    TracingMiddleware,
+    instrument_engine,
+    instrument_serialization,
+    span,
+)
+
+
+def make_app(exporter, sample_rate=1.0):
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    instrument_serialization()
+    app = FastAPI()
+
+    @app.get("/items/{id}", response_model=dict[str, int])
+    async def read_item(id: int):
+        with span("lookup", item=id):
+            with Session(engine) as session:
+                value = session.exec(
+                    text("SELECT :id + 1"), params={"id": id}
+                ).one()  # pyright: ignore
+        return {"id": id, "next": value[0]}
+
+    app.add_middleware(TracingMiddleware, sample_rate=sample_rate, exporter=exporter)
+    return app
+
+
+def client(app):
+    return AsyncClient(transport=ASGITransport(app=app), base_url="http://test")
+
+
+def read_chrome(path):
+    return json.loads(path.read_text().rstrip().rstrip(",") + "]")
+
+
+@pytest.mark.asyncio
+async def test_chrome_trace_has_nested_spans(tmp_path):
+    path = tmp_path / "trace.json"
+    async with client(make_app(ChromeTraceExporter(str(path)))) as ac:
+        response = await ac.get("/items/1")
+
+    assert response.json() == {"id": 1, "next": 2}
+    events = {e["name"]: e for e in read_chrome(path)}
+    root = events["GET /items/{id}"]
+    assert root["args"]["parent_id"] is None
+    assert root["args"]["http.status_code"] == 200
+    assert events["lookup"]["args"]["parent_id"] == root["args"]["span_id"]
+    assert events["lookup"]["args"]["item"] == 1
+    assert events["sql"]["args"]["parent_id"] == events["lookup"]["args"]["span_id"]
+    assert "SELECT" in events["sql"]["args"]["statement"]
+    assert "serialize_response" in events
+    assert response.headers["traceparent"].split("-")[2] == root["args"]["span_id"]
+
+
+@pytest.mark.asyncio
+async def test_incoming_traceparent_is_continued(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    parent = "00f067aa0ba902b7"
+    async with client(make_app(OtlpJsonExporter(str(path)), sample_rate=0.0001)) as ac:
+        # sampled flag set upstream wins over the local sample rate
+        response = await ac.get(
+            "/items/1", headers={"traceparent": f"00-{trace_id}-{parent}-01"}
+        )
+
+    assert response.headers["traceparent"].startswith(f"00-{trace_id}-")
+    spans = json.loads(path.read_text())["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert {s["traceId"] for s in spans} == {trace_id}
+    root = next(s for s in spans if s["kind"] == 2)
+    assert root["parentSpanId"] == parent
+
+
+@pytest.mark.asyncio
+async def test_disabled_tracing_exports_nothing(tmp_path):
+    path = tmp_path / "trace.json"
+    async with client(make_app(ChromeTraceExporter(str(path)), sample_rate=0)) as ac:
+        response = await ac.get("/items/1")
+
+    assert response.status_code == 200
+    assert "traceparent" not in response.headers
+    assert not path.exists()
+
+
+def test_span_outside_a_trace_is_a_noop():
+    with span("nothing") as s:
+        assert s is None
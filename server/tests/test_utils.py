@@ -1,5 +1,8 @@
 import pytest
-from ..utils import slugify
+from sqlmodel import SQLModel, Session, create_engine
+
+from ..models import Category
+from ..utils import SlugAllocator, allocate_slug, parse_fields, slugify
 
 
 @pytest.mark.parametrize(
@@ -24,3 +27,69 @@ def test_slugify_does_not_mutate_input():
     original = "Keep THIS Safe!"
     _ = slugify(original)
     assert original == "Keep THIS Safe!"
+
+
+VIEWS = {"full": ("id", "name", "slug", "calories"), "card": ("id", "name")}
+
+
+def test_parse_fields_uses_view_when_no_fields():
+    assert parse_fields(None, "card", VIEWS) == ("id", "name")
+
+
+def test_parse_fields_always_includes_id():
+    assert parse_fields("calories, name,calories", "full", VIEWS) == (
+        "id",
+        "calories",
+        "name",
+    )
+
+
+def test_parse_fields_rejects_unknown():
+    with pytest.raises(ValueError, match="password"):
+        _ = parse_fields("name,password", "full", VIEWS)
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def _category(session, slug):
+    session.add(Category(name=slug, description=None, slug=slug))
+    session.commit()
+
+
+def test_allocate_slug_free(session):
+    assert allocate_slug(session, Category, "Soups") == "soups"
+
+
+def test_allocate_slug_picks_next_suffix(session):
+    for slug in ("soups", "soups-2", "soups-7", "soups-and-stews"):
+        _category(session, slug)
+    assert allocate_slug(session, Category, "Soups") == "soups-8"
+
+
+def test_allocate_slug_ignores_prefix_siblings(session):
+    _category(session, "soups-and-stews")
+    assert allocate_slug(session, Category, "Soups") == "soups"
+
+
+def test_allocate_slug_excludes_own_record(session):
+    _category(session, "soups")
+    assert allocate_slug(session, Category, "Soups", exclude_id=1) == "soups"
+
+
+def test_slug_allocator_matches_allocate_slug(session):
+    for slug in ("soups", "soups-7", "soups-and-stews", "stews-2"):
+        _category(session, slug)
+    slugs = SlugAllocator(session, Category)
+    slugs.load(["soups", "stews", "salads"])
+    assert slugs.allocate("Soups") == "soups-8"
+    assert slugs.allocate("Soups") == "soups-9"
+    assert slugs.allocate("Stews") == "stews"
+    assert slugs.allocate("Stews") == "stews-3"
+    assert slugs.allocate("Salads") == "salads"
+    assert slugs.allocate("Salads") == "salads-2"
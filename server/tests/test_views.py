@@ -0,0 +1,152 @@
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI
+from sqlmodel import Session, select
+
+from ..models import Recipe, RecipeScore
+from ..routes import recipes
+from ..views import HyperLogLog, ViewTracker, view_tracker
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    with Session(engine) as session:
+        for i in range(1, 4):
+            session.add(
+                Recipe(
+                    name=f"Soup {i}",
+                    slug=f"soup-{i}",
+                    description=None,
+                    instructions="Boil",
+                    ingredients="water",
+                    calories=100,
+                    prep_time=10,
+                    servings=2,
+                )
+            )
+        session.commit()
+    return engine
+
+
+@pytest.fixture(name="app")
+def app_fixture(engine):
+    app = FastAPI()
+    app.include_router(recipes.router, prefix="/recipes")
+    return app
+
+
+@pytest_asyncio.fixture(name="tracker")
+async def tracker_fixture(engine):
+    tracker = ViewTracker(flush_interval=3600, dedupe_window=3600)
+    await tracker.start(engine)
+    yield tracker
+    await tracker.stop()
+
+
+def view_counts(engine):
+    with Session(engine) as session:
+        return {r.id: r.view_count for r in session.exec(select(Recipe))}
+
+
+@pytest.mark.parametrize("distinct", [0, 1, 50, 1000, 20000])
+def test_hyperloglog_estimates_distinct_items(distinct):
+    hll = HyperLogLog()
+    for _ in range(2):
+        for i in range(distinct):
+            hll.add(f"user:{i}")
+    assert hll.count() == pytest.approx(distinct, rel=0.05, abs=1)
+
+
+def test_hyperloglog_stays_sparse_for_few_items():
+    hll = HyperLogLog()
+    for i in range(64):
+        hll.add(f"user:{i}")
+        hll.add(f"user:{i}")
+    assert hll.count() == 64
+    assert hll.hashes is not None and not hll.registers
+
+    hll.add("user:64")
+    assert hll.hashes is None and len(hll.registers) == 1024
+    assert hll.count() == pytest.approx(65, rel=0.05)
+
+
+@pytest.mark.asyncio
+async def test_views_are_deduped_and_flushed_in_one_batch(engine, tracker):
+    for _ in range(3):
+        tracker.record(1, "user:1")
+    tracker.record(1, "ip:10.0.0.1")
+    tracker.record(2, "user:1")
+    assert view_counts(engine) == {1: 0, 2: 0, 3: 0}
+
+    assert await tracker.flush() == 2
+    assert view_counts(engine) == {1: 2, 2: 1, 3: 0}
+    with Session(engine) as session:
+        assert session.get(RecipeScore, 1).view_velocity == pytest.approx(2)
+
+    # already counted viewers in the same window add nothing
+    tracker.record(1, "user:1")
+    tracker.record(1, "user:2")
+    assert await tracker.flush() == 1
+    assert view_counts(engine) == {1: 3, 2: 1, 3: 0}
+
+
+@pytest.mark.asyncio
+async def test_views_of_deleted_recipes_are_dropped(engine, tracker):
+    tracker.record(1, "user:1")
+    tracker.record(3, "user:1")
+    with Session(engine) as session:
+        session.delete(session.get(Recipe, 3))
+        session.commit()
+
+    assert await tracker.flush() == 2
+    assert view_counts(engine) == {1: 1, 2: 0}
+    with Session(engine) as session:
+        assert session.get(RecipeScore, 1) is not None
+        assert session.get(RecipeScore, 3) is None
+
+
+@pytest.mark.asyncio
+async def test_stop_flushes_pending_views(engine):
+    tracker = ViewTracker(flush_interval=3600, dedupe_window=0)
+    await tracker.start(engine)
+    for _ in range(5):
+        tracker.record(3, "user:1")
+    await tracker.stop()
+    assert view_counts(engine)[3] == 5
+
+    tracker.record(3, "user:1")
+    assert tracker.pending == {}
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_views(engine, tracker):
+    def broken(views):
+        def write(s):
+            raise RuntimeError("disk full")
+
+        return write
+
+    tracker.record(1, "user:1")
+    tracker._write = broken
+    with pytest.raises(RuntimeError):
+        _ = await tracker.flush()
+    assert tracker.pending == {1: 1}
+
+    del tracker._write
+    assert await tracker.flush() == 1
+    assert view_counts(engine)[1] == 1
+
+
+@pytest.mark.asyncio
+async def test_reading_a_recipe_records_a_view(engine, client, monkeypatch):
+    tracker = ViewTracker(flush_interval=3600, dedupe_window=3600)
+    monkeypatch.setattr(recipes, "view_tracker", tracker)
+    await tracker.start(engine)
+    assert (await client.get("/recipes/2")).status_code == 200
+    assert (await client.get("/recipes/by-slug/soup-2")).status_code == 200
+    assert (await client.get("/recipes/9")).status_code == 404
+    await tracker.stop()
+
+    # both reads came from the same client address
+    assert view_counts(engine)[2] == 1
+    assert view_tracker.engine is None
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from sqlmodel import SQLModel, Session, create_engine, select
+
+from ..metrics import metrics
+from ..models import User
+from .. import writer as writer_module
+from ..writer import WriteLock, WriteQueue, get_writer, write
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(tmp_path):
+    db_path = tmp_path / "test.db"
+    engine = create_engine(
+        f"sqlite:///{db_path}", connect_args={"check_same_thread": False}
+    )
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture(name="writer")
+def writer_fixture(engine):
+    writer = WriteQueue(engine)
+    yield writer
+    writer.close()
+
+
+def add_user(name):
+    def insert(s):
+        user = User(username=name, password="x", role="USER")
+        s.add(user)
+        s.flush()
+        return user.id
+
+    return insert
+
+
+def fail(s):
+    raise ValueError("nope")
+
+
+def usernames(engine):
+    with Session(engine) as session:
+        return sorted(u.username for u in session.exec(select(User)).all())
+
+
+@pytest.mark.asyncio
+async def test_submit_returns_result(engine, writer):
+    user_id = await writer.submit(add_user("alice"))
+    assert user_id == 1
+    assert usernames(engine) == ["alice"]
+
+
+@pytest.mark.asyncio
+async def test_burst_is_group_committed(engine, writer):
+    metrics.reset()
+    ids = await asyncio.gather(*(writer.submit(add_user(f"u{i}")) for i in range(50)))
+    assert sorted(ids) == list(range(1, 51))
+    counters = metrics.snapshot()["counters"]
+    assert counters["writer_writes"] == 50
+    assert counters["writer_batches"] < 50
+
+
+@pytest.mark.asyncio
+async def test_failure_only_affects_its_caller(engine, writer):
+    results = await asyncio.gather(
+        writer.submit(add_user("a")),
+        writer.submit(fail),
+        writer.submit(add_user("b")),
+        return_exceptions=True,
+    )
+    assert isinstance(results[1], ValueError)
+    assert not isinstance(results[0], Exception)
+    assert not isinstance(results[2], Exception)
+    assert usernames(engine) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_write_uses_the_sessions_engine(engine):
+    with Session(engine) as session:
+        _ = await write(session, add_user("carol"))
+    assert get_writer(engine).engine is engine
+    assert usernames(engine) == ["carol"]
+    get_writer(engine).close()
+
+
+@pytest.mark.asyncio
+async def test_close_flushes_and_restarts_lazily(engine, writer):
+    _ = await writer.submit(add_user("a"))
+    writer.close()
+    _ = await writer.submit(add_user("b"))
+    assert usernames(engine) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_write_lock_holds_writes_during_exclusive(engine, writer, monkeypatch):
+    lock = WriteLock()
+    monkeypatch.setattr(writer_module, "write_lock", lock)
+    request = asyncio.create_task(hold(lock.shared_async()))
+    await asyncio.sleep(0.01)
+
+    # a batch waiting for shares to drain holds back new ones...
+    batch = asyncio.create_task(hold(lock.exclusive()))
+    await asyncio.sleep(0.01)
+    assert not batch.done() and lock._pending == 1
+    # ...but not the writes of requests that already share the lock
+    assert await writer.submit(add_user("alice")) == 1
+
+    _ = request.cancel()
+    await asyncio.sleep(0.01)
+    assert lock._exclusive
+    submitted = asyncio.create_task(writer.submit(add_user("bob")))
+    await asyncio.sleep(0.05)
+    assert not submitted.done()
+
+    _ = batch.cancel()
+    assert await submitted == 2
+
+
+async def hold(context):
+    async with context:
+        await asyncio.Event().wait()
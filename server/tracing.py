@@ -0,0 +1,298 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    __slots__: tuple[str, ...] = (
+        "name",
+        "trace",
+        "span_id",
+        "parent_id",
+        "start",
+        "end",
+        "thread_id",
+        "attributes",
+    )
+
+    def __init__(self, name: str, trace: "Trace", parent_id: str | None):
+        self.name: str = name
+        self.trace: Trace = trace
+        self.span_id: str = os.urandom(8).hex()
+        self.parent_id: str | None = parent_id
+        self.start: int = time.time_ns()
+        self.end: int = 0
+        self.thread_id: int = threading.get_ident()
+        self.attributes: dict[str, Any] = {}
+
+
+class Trace:
+    __slots__: tuple[str, ...] = ("trace_id", "spans", "lock")
+
+    def __init__(self, trace_id: str):
+        self.trace_id: str = trace_id
+        self.spans: list[Span] = []
+        self.lock: threading.Lock = threading.Lock()
+
+
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Span | None:
+    return _current.get()
+
+
+class _ActiveSpan:
+    __slots__: tuple[str, ...] = ("span", "token")
+
+    def __init__(self, span: Span):
+        self.span: Span = span
+        self.token: Any = None
+
+    def __enter__(self) -> Span:
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):  # pyright: ignore
+        self.span.end = time.time_ns()
+        if exc_type is not None:
+            self.span.attributes["error"] = exc_type.__name__
+        _current.reset(self.token)
+
+
+class _NoopSpan:
+    __slots__: tuple[str, ...] = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc, tb):  # pyright: ignore
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+def start_span(name: str, parent: Span, **attributes: Any) -> Span:
+    span = Span(name, parent.trace, parent.span_id)
+    span.attributes.update(attributes)
+    with parent.trace.lock:
+        parent.trace.spans.append(span)
+    return span
+
+
+def span(name: str, **attributes: Any) -> _ActiveSpan | _NoopSpan:
+    """Child span of the current one; a shared no-op when the request isn't sampled."""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return _ActiveSpan(start_span(name, parent, **attributes))
+
+
+class ChromeTraceExporter:
+    """Appends trace events to a file chrome://tracing and Perfetto can open.
+
+    The trailing `]` of the JSON array is optional in the trace event
+    format, so the file stays valid while it is being appended to.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self._lock: threading.Lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        pid = os.getpid()
+        events = [
+            {
+                "name": s.name,
+                "ph": "X",
+                "ts": s.start // 1000,
+                "dur": max(s.end - s.start, 0) // 1000,
+                "pid": pid,
+                "tid": s.thread_id,
+                "args": {
+                    "trace_id": trace.trace_id,
+                    "span_id": s.span_id,
+                    "parent_id": s.parent_id,
+                    **s.attributes,
+                },
+            }
+            for s in trace.spans
+        ]
+        with self._lock:
+            new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, "a") as f:
+                if new:
+                    _ = f.write("[\n")
+                for event in events:
+                    _ = f.write(json.dumps(event, default=str) + ",\n")
+
+
+class OtlpJsonExporter:
+    """Writes one OTLP/JSON ExportTraceServiceRequest per line."""
+
+    def __init__(self, path: str, service_name: str = "recipes"):
+        self.path: str = path
+        self.service_name: str = service_name
+        self._lock: threading.Lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        spans = [
+            {
+                "traceId": trace.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                # the request span is SERVER, everything below it INTERNAL
+                "kind": 2 if i == 0 else 1,
+                "startTimeUnixNano": str(s.start),
+                "endTimeUnixNano": str(s.end),
+                "attributes": [
+                    {"key": key, "value": {"stringValue": str(value)}}
+                    for key, value in s.attributes.items()
+                ],
+            }
+            for i, s in enumerate(trace.spans)
+        ]
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": self.service_name},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [{"scope": {"name": "server"}, "spans": spans}],
+                }
+            ]
+        }
+        line = json.dumps(request)
+        with self._lock:
+            with open(self.path, "a") as f:
+                _ = f.write(line + "\n")
+
+
+def create_exporter() -> ChromeTraceExporter | OtlpJsonExporter:
+    if os.environ.get("TRACE_FORMAT", "chrome") == "otlp":
+        return OtlpJsonExporter(os.environ.get("TRACE_FILE", "traces.otlp.jsonl"))
+    return ChromeTraceExporter(os.environ.get("TRACE_FILE", "traces.json"))
+
+
+class TracingMiddleware:
+    """Opens the root span of a request and hands the finished trace to the exporter.
+
+    Requests are sampled at `sample_rate`, or whenever an incoming W3C
+    `traceparent` header has its sampled flag set. With a sample rate of 0
+    every request passes straight through.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        sample_rate: float = float(os.environ.get("TRACE_SAMPLE_RATE", "0")),
+        exporter: ChromeTraceExporter | OtlpJsonExporter | None = None,
+    ):
+        self.app: ASGIApp = app
+        self.sample_rate: float = sample_rate
+        self.exporter: ChromeTraceExporter | OtlpJsonExporter = (
+            exporter or create_exporter()
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not self.sample_rate or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id, parent_id, sampled = None, None, False
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                match = TRACEPARENT.match(value.decode("latin-1").strip())
+                if match:
+                    trace_id, parent_id, flags = match.groups()
+                    sampled = bool(int(flags, 16) & 1)
+                break
+        if not sampled and random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(trace_id or os.urandom(16).hex())
+        root = Span(f"{scope['method']} {scope['path']}", trace, parent_id)
+        trace.spans.append(root)
+        traceparent = f"00-{trace.trace_id}-{root.span_id}-01"
+
+        async def send_with_traceparent(message: Message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                MutableHeaders(scope=message).append("traceparent", traceparent)
+            await send(message)
+
+        try:
+            with _ActiveSpan(root):
+                await self.app(scope, receive, send_with_traceparent)
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+            self.exporter.export(trace)
+
+
+def instrument_engine(engine: Any):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(
+        conn, cursor, statement, parameters, context, executemany
+    ):  # pyright: ignore
+        parent = _current.get()
+        if parent is not None:
+            conn.info.setdefault("trace_spans", []).append(
+                start_span("sql", parent, statement=statement)
+            )
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(
+        conn, cursor, statement, parameters, context, executemany
+    ):  # pyright: ignore
+        spans = conn.info.get("trace_spans")
+        if spans:
+            spans.pop().end = time.time_ns()
+
+    @event.listens_for(engine, "handle_error")
+    def error(context):  # pyright: ignore
+        spans = (
+            context.connection.info.get("trace_spans") if context.connection else None
+        )
+        if spans:
+            failed = spans.pop()
+            failed.end = time.time_ns()
+            failed.attributes["error"] = type(context.original_exception).__name__
+
+
+def instrument_serialization():
+    # FastAPI looks serialize_response up on the module for every request
+    import fastapi.routing
+
+    serialize = fastapi.routing.serialize_response
+    if getattr(serialize, "__traced__", False):
+        return
+
+    async def serialize_response(*args: Any, **kwargs: Any) -> Any:
+        with span("serialize_response"):
+            return await serialize(*args, **kwargs)
+
+    serialize_response.__traced__ = True  # pyright: ignore
+    fastapi.routing.serialize_response = serialize_response
@@ -1,4 +1,10 @@
 import re
+from collections.abc import Iterable
+
+from sqlalchemy import and_, func, or_, update
+from sqlmodel import Session, select
+
+from .models import Category, Comment, Recipe, SlugRedirect
 
 
 def slugify(text: str) -> str:
@@ -6,3 +12,125 @@ def slugify(text: str) -> str:
     text = re.sub(r"[^\w\s-]", "", text)
     text = re.sub(r"[-\s]+", "-", text)
     return text.strip("-")
+
+
+def allocate_slug(
+    session: Session,
+    model: type[Recipe] | type[Category],
+    text: str,
+    exclude_id: int | None = None,
+) -> str:
+    base = slugify(text)
+    column = model.slug
+
+    # slugs only contain word characters and "-", so the range [base, base.)
+    # is exactly "base" plus its "base-..." siblings: one probe on the index
+    query = select(column).where(column >= base, column < f"{base}.")
+    if exclude_id is not None:
+        query = query.where(model.id != exclude_id)
+    taken = session.exec(query).all()
+
+    if base not in taken:
+        return base
+
+    suffixes = [s[len(base) + 1 :] for s in taken]
+    used = [int(s) for s in suffixes if s.isdigit()]
+    return f"{base}-{max(used, default=1) + 1}"
+
+
+class SlugAllocator:
+    """Allocates slugs for many rows at once, the way allocate_slug does one.
+
+    Existing slugs are loaded for a whole batch of names in a few range
+    queries and remembered, so later batches and duplicate names inside a
+    batch don't go back to the database.
+    """
+
+    def __init__(self, session: Session, model: type[Recipe] | type[Category]):
+        self.session: Session = session
+        self.model: type[Recipe] | type[Category] = model
+        # base -> (bare slug taken, highest numeric suffix in use)
+        self.taken: dict[str, tuple[bool, int]] = {}
+
+    def load(self, bases: Iterable[str], chunk_size: int = 200):
+        missing = list(dict.fromkeys(b for b in bases if b not in self.taken))
+        column = self.model.slug
+        for i in range(0, len(missing), chunk_size):
+            chunk = missing[i : i + chunk_size]
+            for base in chunk:
+                self.taken[base] = (False, 0)
+            ranges = [and_(column >= b, column < f"{b}.") for b in chunk]
+            for slug in self.session.exec(select(column).where(or_(*ranges))).all():
+                if slug in self.taken:
+                    bare, last = self.taken[slug]
+                    self.taken[slug] = (True, last)
+                base, _, suffix = slug.rpartition("-")
+                if suffix.isdigit() and base in self.taken:
+                    bare, last = self.taken[base]
+                    self.taken[base] = (bare, max(last, int(suffix)))
+
+    def allocate(self, text: str) -> str:
+        base = slugify(text)
+        self.load([base])
+        bare, last = self.taken[base]
+        if not bare:
+            self.taken[base] = (True, last)
+            return base
+        suffix = max(last, 1) + 1
+        self.taken[base] = (True, suffix)
+        return f"{base}-{suffix}"
+
+
+def refresh_recipe_rating(session: Session, recipe_id: int | None):
+    average = (
+        select(func.coalesce(func.avg(Comment.rating), 0))
+        .where(Comment.recipe_id == recipe_id)
+        .scalar_subquery()
+    )
+    _ = session.exec(
+        update(Recipe)
+        .where(Recipe.id == recipe_id)
+        .values(rating=average)  # pyright: ignore
+    )
+
+
+def record_slug_redirect(session: Session, kind: str, old_slug: str, target_id: int):
+    redirect = session.exec(
+        select(SlugRedirect).where(
+            SlugRedirect.kind == kind, SlugRedirect.old_slug == old_slug
+        )
+    ).first()
+    if redirect:
+        redirect.target_id = target_id
+    else:
+        redirect = SlugRedirect(kind=kind, old_slug=old_slug, target_id=target_id)
+    session.add(redirect)
+
+
+def parse_fields(
+    fields: str | None, view: str, views: dict[str, tuple[str, ...]]
+) -> tuple[str, ...]:
+    if fields is None:
+        return views[view]
+
+    allowed = views["full"]
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    # id is always returned so clients can link back to the full record
+    return ("id", *(f for f in dict.fromkeys(requested) if f != "id"))
+
+
+def resolve_slug_redirect(
+    session: Session, kind: str, model: type[Recipe] | type[Category], slug: str
+) -> Recipe | Category | None:
+    redirect = session.exec(
+        select(SlugRedirect).where(
+            SlugRedirect.kind == kind, SlugRedirect.old_slug == slug
+        )
+    ).first()
+    if not redirect:
+        return None
+    return session.get(model, redirect.target_id)
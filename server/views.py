@@ -0,0 +1,195 @@
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+from array import array
+from collections import Counter
+
+from sqlalchemy import Engine, bindparam, update
+from sqlmodel import Session
+
+from .metrics import metrics
+from .models import Recipe
+from .scores import record_views
+from .writer import get_writer
+
+
+logger = logging.getLogger(__name__)
+
+VIEW_FLUSH_INTERVAL = float(os.environ.get("VIEW_FLUSH_INTERVAL", "5"))
+# 0 counts every view; devenv.nix turns deduping on with an hour
+VIEW_DEDUPE_WINDOW = float(os.environ.get("VIEW_DEDUPE_WINDOW", "0"))
+
+
+class HyperLogLog:
+    """Estimates how many distinct items were added.
+
+    A sketch starts sparse, keeping the 64-bit hashes it has seen and
+    counting them exactly, so a recipe with a handful of viewers costs a
+    few dozen bytes. Past 2**precision / 16 hashes, half the size of the
+    registers, it is promoted to 2**precision one-byte registers. The
+    standard error is then about 1.04 / sqrt(2**precision), 3% at the
+    default precision, and small counts use linear counting.
+    """
+
+    def __init__(self, precision: int = 10):
+        self.precision: int = precision
+        # None once promoted; registers stay empty until then
+        self.hashes: array[int] | None = array("Q")
+        self.registers: bytearray = bytearray()
+
+    def add(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=8).digest()
+        value = int.from_bytes(digest, "big")
+        if self.hashes is None:
+            self._set(value)
+        elif value not in self.hashes:
+            self.hashes.append(value)
+            if len(self.hashes) > (1 << self.precision) // 16:
+                self._promote(self.hashes)
+
+    def _promote(self, hashes: "array[int]"):
+        self.hashes = None
+        self.registers = bytearray(1 << self.precision)
+        for value in hashes:
+            self._set(value)
+
+    def _set(self, value: int):
+        bits = 64 - self.precision
+        index = value >> bits
+        rank = bits - (value & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        if self.hashes is not None:
+            return len(self.hashes)
+        m = len(self.registers)
+        # bytearray.count runs in C; there are at most 65 distinct ranks
+        total = sum(
+            self.registers.count(rank) * 2.0**-rank
+            for rank in range(max(self.registers) + 1)
+        )
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / total
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class ViewTracker:
+    """Counts recipe views in memory and adds them to the database in batches.
+
+    record() never touches the database. Every `flush_interval` seconds,
+    and once more on stop(), the pending counts are written in one
+    transaction through the writer. With a `dedupe_window` (off unless
+    configured), repeat views by the same viewer inside the window count
+    once; distinct viewers are estimated with a HyperLogLog per recipe.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = VIEW_FLUSH_INTERVAL,
+        dedupe_window: float = VIEW_DEDUPE_WINDOW,
+        precision: int = 10,
+    ):
+        self.flush_interval: float = flush_interval
+        self.dedupe_window: float = dedupe_window
+        self.precision: int = precision
+        self.engine: Engine | None = None
+        self.pending: Counter[int] = Counter()
+        self._viewers: dict[int, HyperLogLog] = {}
+        self._counted: dict[int, int] = {}
+        self._dirty: set[int] = set()
+        self._window_start: float = time.monotonic()
+        self._task: asyncio.Task[None] | None = None
+
+    def record(self, recipe_id: int, viewer: str):
+        if self.engine is None:
+            # not started (tests, scripts): there is nowhere to flush to
+            return
+        metrics.inc("views_recorded")
+        if not self.dedupe_window:
+            self.pending[recipe_id] += 1
+            return
+        hll = self._viewers.get(recipe_id)
+        if hll is None:
+            hll = self._viewers[recipe_id] = HyperLogLog(self.precision)
+        hll.add(viewer)
+        self._dirty.add(recipe_id)
+
+    async def start(self, engine: Engine):
+        self.engine = engine
+        self._window_start = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            _ = self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            _ = await self.flush()
+        finally:
+            self.engine = None
+
+    async def flush(self) -> int:
+        views = self._take()
+        if not views or self.engine is None:
+            return 0
+        try:
+            await get_writer(self.engine).submit(self._write(views))
+        except Exception:
+            # keep the counts for the next flush rather than losing them
+            self.pending.update(views)
+            raise
+        metrics.inc("views_flushed", sum(views.values()))
+        return len(views)
+
+    def _take(self) -> Counter[int]:
+        for recipe_id in self._dirty:
+            distinct = self._viewers[recipe_id].count()
+            new = distinct - self._counted.get(recipe_id, 0)
+            if new > 0:
+                self.pending[recipe_id] += new
+                self._counted[recipe_id] = distinct
+        self._dirty.clear()
+        if time.monotonic() - self._window_start >= self.dedupe_window:
+            self._viewers.clear()
+            self._counted.clear()
+            self._window_start = time.monotonic()
+
+        views, self.pending = self.pending, Counter()
+        return views
+
+    @staticmethod
+    def _write(views: Counter[int]):
+        table = Recipe.__table__  # pyright: ignore
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam("recipe_id"))
+            .values(view_count=table.c.view_count + bindparam("views"))
+        )
+        params = [{"recipe_id": r, "views": n} for r, n in views.items()]
+
+        def write(s: Session):
+            _ = s.connection().execute(statement, params)
+            record_views(s, views)
+
+        return write
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                _ = await self.flush()
+            except Exception:
+                logger.exception("Flushing recipe views failed")
+
+
+view_tracker = ViewTracker()
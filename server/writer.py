@@ -0,0 +1,300 @@
+import asyncio
+import queue
+import threading
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, TypeVar
+
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from .metrics import metrics
+from .tracing import span
+
+
+T = TypeVar("T")
+
+MAX_BATCH = 64
+IDLE_SECONDS = 30.0
+
+WriteFn = Callable[[Session], Any]
+Item = tuple[WriteFn, asyncio.Future[Any], asyncio.AbstractEventLoop]
+
+
+class Hold:
+    def __init__(self, exclusive: bool = False):
+        self.exclusive: bool = exclusive
+        self.held: bool = True
+
+
+# what the current request, job or thread it handed work to already holds
+_hold: ContextVar[Hold | None] = ContextVar("write_hold", default=None)
+
+
+class WriteLock:
+    """Keeps every other writer out while POST /batch runs.
+
+    A batch keeps one transaction open while it awaits its operations, so
+    any other write in the meantime would wait on SQLite's lock for
+    busy_timeout (blocking the event loop, if it runs there) and then fail.
+    Ordinary writers share this lock and a batch takes it exclusively;
+    whoever arrives during a batch waits here instead, on the loop without
+    blocking it.
+
+    Holds are per context: work a holder hands to a thread or runs inside
+    the batch doesn't take the lock again. Once a batch is waiting, new
+    shares wait behind it, except for the writer thread, whose writes
+    belong to requests that already hold a share.
+    """
+
+    def __init__(self):
+        self._mutex: threading.Lock = threading.Lock()
+        self._changed: threading.Condition = threading.Condition(self._mutex)
+        self._shared: int = 0
+        self._exclusive: bool = False
+        self._pending: int = 0
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future[None]]] = []
+
+    @contextmanager
+    def shared(self, priority: bool = False) -> Iterator[None]:
+        """Blocking; for threads."""
+        if _holds():
+            yield
+            return
+        with self._changed:
+            while not self._can_share(priority):
+                _ = self._changed.wait()
+            self._shared += 1
+        hold = Hold()
+        token = _hold.set(hold)
+        try:
+            yield
+        finally:
+            _hold.reset(token)
+            self._release(hold)
+
+    @asynccontextmanager
+    async def shared_async(self) -> AsyncIterator[None]:
+        if _holds():
+            yield
+            return
+        await self._acquire(lambda: self._can_share(False), False)
+        # left set: a request's dependencies and endpoint share one context
+        hold = Hold()
+        _ = _hold.set(hold)
+        try:
+            yield
+        finally:
+            self._release(hold)
+
+    @asynccontextmanager
+    async def exclusive(self) -> AsyncIterator[None]:
+        own = _hold.get()
+        if own is not None and own.held:
+            # the request shares the lock through its own session
+            self._release(own)
+        with self._mutex:
+            self._pending += 1
+        try:
+            await self._acquire(lambda: not self._exclusive and not self._shared, True)
+        finally:
+            with self._mutex:
+                self._pending -= 1
+                self._notify()
+        hold = Hold(exclusive=True)
+        token = _hold.set(hold)
+        try:
+            yield
+        finally:
+            _hold.reset(token)
+            self._release(hold)
+
+    def _can_share(self, priority: bool) -> bool:
+        return not self._exclusive and (priority or not self._pending)
+
+    async def _acquire(self, ready: Callable[[], bool], exclusive: bool):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._mutex:
+                if ready():
+                    if exclusive:
+                        self._exclusive = True
+                    else:
+                        self._shared += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            try:
+                await waiter[1]
+            finally:
+                with self._mutex:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+    def _release(self, hold: Hold):
+        with self._mutex:
+            if not hold.held:
+                return
+            hold.held = False
+            if hold.exclusive:
+                self._exclusive = False
+            else:
+                self._shared -= 1
+            self._notify()
+
+    def _notify(self):
+        # callers hold _mutex
+        self._changed.notify_all()
+        for loop, future in self._waiters:
+            if not loop.is_closed():
+                _ = loop.call_soon_threadsafe(_resolve, future, None, None)
+        self._waiters.clear()
+
+
+def _holds() -> bool:
+    hold = _hold.get()
+    return hold is not None and hold.held
+
+
+write_lock = WriteLock()
+
+
+class WriteQueue:
+    """Serializes writes to one SQLite database through a single thread.
+
+    Writes queued while a commit is in progress are applied together in
+    the next transaction (group commit). If any of them fails the batch is
+    rolled back and replayed one write per transaction, so every caller
+    gets its own result or exception.
+    """
+
+    def __init__(self, engine: Engine, max_batch: int = MAX_BATCH):
+        self.engine: Engine = engine
+        self.max_batch: int = max_batch
+        self._queue: queue.SimpleQueue[Item | None] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._lock: threading.Lock = threading.Lock()
+
+    async def submit(self, fn: Callable[[Session], T]) -> T:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[T] = loop.create_future()
+        self._queue.put((fn, future, loop))
+        self._ensure_thread()
+        return await future
+
+    def close(self):
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(None)
+        thread.join()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="sqlite-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=IDLE_SECONDS)
+            except queue.Empty:
+                with self._lock:
+                    # re-check under the lock, submit() may have just queued
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+
+            stop = item is None
+            batch: list[Item] = [] if item is None else [item]
+            while not stop and len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+
+            if batch:
+                self._commit(batch)
+            if stop:
+                with self._lock:
+                    self._thread = None
+                return
+
+    def _commit(self, batch: list[Item]):
+        metrics.inc("writer_batches")
+        metrics.inc("writer_writes", len(batch))
+        with metrics.timer("writer_commit"), write_lock.shared(priority=True):
+            try:
+                with Session(self.engine, expire_on_commit=False) as session:
+                    results = [fn(session) for fn, _, _ in batch]
+                    session.commit()
+            except Exception:
+                for item in batch:
+                    self._commit_one(item)
+                return
+
+        for (_, future, loop), result in zip(batch, results):
+            _ = loop.call_soon_threadsafe(_resolve, future, result, None)
+
+    def _commit_one(self, item: Item):
+        fn, future, loop = item
+        try:
+            with write_lock.shared(priority=True):
+                with Session(self.engine, expire_on_commit=False) as session:
+                    result = fn(session)
+                    session.commit()
+        except Exception as e:
+            _ = loop.call_soon_threadsafe(_resolve, future, None, e)
+        else:
+            _ = loop.call_soon_threadsafe(_resolve, future, result, None)
+
+
+def _resolve(future: asyncio.Future[Any], result: Any, error: Exception | None):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+_writers: dict[Engine, WriteQueue] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(engine: Engine) -> WriteQueue:
+    with _writers_lock:
+        writer = _writers.get(engine)
+        if writer is None:
+            writer = _writers[engine] = WriteQueue(engine)
+        return writer
+
+
+async def write(session: Session, fn: Callable[[Session], T]) -> T:
+    """Run fn in the writer thread against the database session is bound to."""
+    if session.info.get("batch"):
+        # inside POST /batch the write has to join the batch transaction
+        result = fn(session)
+        session.commit()
+        return result
+
+    with span("writer.write"):
+        return await get_writer(session.get_bind()).submit(fn)
+
+
+def close_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()